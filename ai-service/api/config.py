@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Dict, Optional
 from pydantic_settings import BaseSettings
 from pydantic import SecretStr
 import structlog
@@ -18,6 +18,168 @@ class Settings(BaseSettings):
     # e2b template id
     e2b_sandbox_nextjs_template_id: str = ""
 
+    # e2b sandbox lifetime, e2b default is 5 minutes
+    e2b_sandbox_timeout_seconds: int = 300
+
+    # warm sandbox pool, target grows from min to max when checkouts miss
+    # sizes are for the whole deployment, every uvicorn worker keeps its share
+    # (web_concurrency, the WEB_CONCURRENCY env var uvicorn reads for --workers)
+    # idle sandboxes get their timeout extended renew_before it runs out, the ones
+    # above the min size are retired after max_idle
+    sandbox_pool_min_size: int = 1
+    sandbox_pool_max_size: int = 4
+    sandbox_pool_renew_before_seconds: int = 60
+    sandbox_pool_max_idle_seconds: int = 1800
+    sandbox_pool_refill_interval_seconds: int = 15
+    web_concurrency: int = 1
+
+    # sandbox connection cache
+    sandbox_connection_cache_size: int = 256
+    sandbox_connection_idle_ttl_seconds: int = 120
+
+    # sandbox commands are killed past their timeout (the agent may ask for up to the max),
+    # only the head and tail of their output is kept
+    sandbox_command_timeout_seconds: int = 300
+    sandbox_command_max_timeout_seconds: int = 1800
+    sandbox_command_output_head_bytes: int = 4096
+    sandbox_command_output_tail_bytes: int = 8192
+
+    # recursive listings stop after this many entries
+    sandbox_list_max_entries: int = 500
+
+    # code search output caps, long lines (minified files) are cut at the column limit
+    sandbox_search_max_lines: int = 200
+    sandbox_search_max_columns: int = 300
+
+    # shadcn component api index, json built once per template id (python -m services.component_index)
+    component_index_enabled: bool = True
+    component_index_path: str = "sandbox-template/nextjs/component-index.json"
+    component_index_build_timeout_seconds: int = 120
+
+    # content-hash manifest, writes of unchanged files are skipped
+    sandbox_write_manifest_enabled: bool = True
+    sandbox_manifest_build_timeout_seconds: int = 30
+
+    # project snapshots for restoring expired sandboxes, store backend is memory or redis
+    sandbox_snapshot_store_backend: str = "memory"
+    sandbox_snapshot_store_max_size: int = 256
+    # memory backend only, per uvicorn worker
+    sandbox_snapshot_store_max_bytes: int = 256 * 1024 * 1024
+    sandbox_snapshot_ttl_seconds: int = 604800
+    sandbox_snapshot_max_bytes: int = 20 * 1024 * 1024
+    sandbox_snapshot_timeout_seconds: int = 60
+    sandbox_restore_timeout_seconds: int = 300
+    # snapshot in the background after every code agent run that wrote files or ran commands
+    sandbox_snapshot_after_code_run: bool = True
+
+    # redis (shared with the golang api)
+    redis_url: str = "redis://redis:6379/0"
+
+    # /query response cache, backend is memory, redis or none
+    response_cache_backend: str = "memory"
+    response_cache_max_size: int = 1024
+    response_cache_ttl_seconds: int = 3600
+
+    # /ai/auto provider routing, hedging starts after the best provider's latency percentile
+    ai_router_query_timeout_seconds: float = 60
+    ai_router_code_timeout_seconds: float = 900
+    ai_router_hedge_enabled: bool = True
+    ai_router_hedge_percentile: float = 0.95
+    ai_router_hedge_min_samples: int = 20
+    ai_router_failure_cooldown_seconds: float = 30
+
+    # background code agent jobs, one running job per sandbox at a time
+    # job store backend is memory or redis
+    code_agent_job_workers: int = 4
+    code_agent_job_queue_size: int = 100
+    code_agent_job_store_backend: str = "memory"
+    code_agent_job_store_max_size: int = 1000
+    code_agent_job_ttl_seconds: int = 86400
+    code_agent_job_poll_interval_seconds: float = 1
+
+    # one code agent run per sandbox across routes and workers, a lease in the job store
+    # backend (redis shares it between workers), refreshed while the run goes on
+    code_agent_sandbox_lock_ttl_seconds: float = 60
+    code_agent_sandbox_lock_poll_seconds: float = 0.5
+
+    # code agent run budgets (0 disables a budget), a run past one ends with a partial result,
+    # repeated identical tool calls are answered from the run's memo until the duplicate limit
+    code_agent_max_steps: int = 25
+    code_agent_max_run_seconds: float = 600
+    code_agent_max_tokens: int = 500000
+    code_agent_max_duplicate_calls: int = 3
+
+    # agent scratchpad compaction, stale tool results are always shortened, the oldest
+    # large ones too while the scratchpad is over the ceiling (0 disables the ceiling)
+    # the compacted part grows block_steps at a time so the prompt cache keeps hitting
+    code_agent_scratchpad_enabled: bool = True
+    code_agent_scratchpad_max_tokens: int = 60000
+    code_agent_scratchpad_keep_recent_steps: int = 4
+    code_agent_scratchpad_block_steps: int = 8
+
+    # client side llm admission control per provider (0 disables a limit),
+    # calls that would queue longer than the max wait are shed with a 429
+    llm_admission_max_wait_seconds: float = 10
+    openai_requests_per_minute: int = 500
+    openai_tokens_per_minute: int = 200000
+    openai_max_concurrency: int = 16
+    google_requests_per_minute: int = 300
+    google_tokens_per_minute: int = 1000000
+    google_max_concurrency: int = 16
+    anthropic_requests_per_minute: int = 50
+    anthropic_tokens_per_minute: int = 40000
+    anthropic_max_concurrency: int = 8
+
+    # estimated llm cost, usd per million tokens by model name prefix (longest prefix wins),
+    # keys: input, output, cache_read, cache_write. Models without a price report no cost
+    llm_prices: Dict[str, Dict[str, float]] = {
+        "gpt-4o-mini": {"input": 0.15, "output": 0.6, "cache_read": 0.075},
+        "gpt-4o": {"input": 2.5, "output": 10, "cache_read": 1.25},
+        "gpt-4.1-mini": {"input": 0.4, "output": 1.6, "cache_read": 0.1},
+        "gpt-4.1": {"input": 2, "output": 8, "cache_read": 0.5},
+        "gemini-2.5-flash": {"input": 0.3, "output": 2.5, "cache_read": 0.075},
+        "gemini-2.5-pro": {"input": 1.25, "output": 10, "cache_read": 0.31},
+        "claude-3-5-haiku": {
+            "input": 0.8,
+            "output": 4,
+            "cache_read": 0.08,
+            "cache_write": 1,
+        },
+        "claude-3-5-sonnet": {
+            "input": 3,
+            "output": 15,
+            "cache_read": 0.3,
+            "cache_write": 3.75,
+        },
+        "claude-3-7-sonnet": {
+            "input": 3,
+            "output": 15,
+            "cache_read": 0.3,
+            "cache_write": 3.75,
+        },
+        "claude-sonnet-4": {
+            "input": 3,
+            "output": 15,
+            "cache_read": 0.3,
+            "cache_write": 3.75,
+        },
+        "claude-opus-4": {
+            "input": 15,
+            "output": 75,
+            "cache_read": 1.5,
+            "cache_write": 18.75,
+        },
+    }
+
+    # opentelemetry tracing, the caller's W3C traceparent is continued.
+    # exporter: none, file (json lines at tracing_file_path) or otlp (http collector)
+    tracing_exporter: str = "none"
+    tracing_file_path: str = "traces.jsonl"
+    tracing_otlp_endpoint: str = "http://otel-collector:4318/v1/traces"
+    tracing_service_name: str = "ai-service"
+    # share of new traces recorded, traces started by the caller follow its decision
+    tracing_sample_ratio: float = 1.0
+
     # llm models
     openai_model: str = ""
     google_model: str = ""
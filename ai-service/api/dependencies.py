@@ -1,13 +1,35 @@
 from fastapi import Depends
 from typing import Annotated
 from services.sandbox_service import SandboxService
+from services.sandbox_pool import SandboxPool, pool_share
+from api.config import settings
 from clients.openai_client import OpenAIClient
 from clients.google_client import GoogleClient
 from clients.anthropic_client import AnthropicClient
 from services.ai_services import CodeAgentService, GeneralAIService
-from services.models.ai_models import AIClient
+from services.ai_router import AIRouter
+from services.admission_controller import AdmissionController
+from services.component_index import ComponentIndexService
+from services.scratchpad_compactor import ScratchpadCompactor
+from services.usage_tracker import PriceTable, UsageTracker
+from services.job_manager import CodeAgentJobManager
+from services.job_store import JobStore, InMemoryJobStore, RedisJobStore
+from services.sandbox_lock import SandboxLock, InMemorySandboxLock, RedisSandboxLock
+from services.snapshot_store import (
+    SnapshotStore,
+    InMemorySnapshotStore,
+    RedisSnapshotStore,
+)
+from services.models.admission_models import ProviderLimits
+from services.models.ai_models import AIClient, CodeAgentBudget
+from services.response_cache import (
+    ResponseCache,
+    InMemoryResponseCache,
+    RedisResponseCache,
+)
 from utils.logging import logger
 from functools import lru_cache
+from typing import Dict, Optional
 
 """
 This file will instantiate all the necessary objects that will be passed around
@@ -17,16 +39,169 @@ Annotated[Type, Metadata]
 """
 
 
+# create the sandbox snapshot store once (redis keeps snapshots across restarts)
+@lru_cache()
+def get_snapshot_store() -> SnapshotStore:
+    logger.info(
+        "snapshot_store_created", backend=settings.sandbox_snapshot_store_backend
+    )
+    if settings.sandbox_snapshot_store_backend == "redis":
+        return RedisSnapshotStore(
+            url=settings.redis_url, ttl_seconds=settings.sandbox_snapshot_ttl_seconds
+        )
+    return InMemorySnapshotStore(
+        max_size=settings.sandbox_snapshot_store_max_size,
+        max_bytes=settings.sandbox_snapshot_store_max_bytes,
+    )
+
+
 # create the sandbox service once (holds interations with e2b sandbox)
 @lru_cache()
 def get_sandbox_service() -> SandboxService:
     logger.info("sandbox_service_client_created")
-    return SandboxService()
+    return SandboxService(snapshot_store=get_snapshot_store())
 
 
 sandbox_service_dependency = Annotated[SandboxService, Depends(get_sandbox_service)]
 
 
+# create the warm sandbox pool once (started and stopped by the app lifespan)
+@lru_cache()
+def get_sandbox_pool(sandbox: sandbox_service_dependency) -> SandboxPool:
+    logger.info("sandbox_pool_created")
+    return SandboxPool(
+        sandbox_service=sandbox,
+        template_id=settings.e2b_sandbox_nextjs_template_id,
+        min_size=pool_share(settings.sandbox_pool_min_size, settings.web_concurrency),
+        max_size=pool_share(settings.sandbox_pool_max_size, settings.web_concurrency),
+        renew_before_seconds=settings.sandbox_pool_renew_before_seconds,
+        max_idle_seconds=settings.sandbox_pool_max_idle_seconds,
+        refill_interval_seconds=settings.sandbox_pool_refill_interval_seconds,
+    )
+
+
+sandbox_pool_dependency = Annotated[SandboxPool, Depends(get_sandbox_pool)]
+
+
+# create the shadcn component index once (loaded or rebuilt by the app lifespan)
+@lru_cache()
+def get_component_index() -> Optional[ComponentIndexService]:
+    if not settings.component_index_enabled:
+        return None
+    logger.info("component_index_created")
+    return ComponentIndexService(
+        template_id=settings.e2b_sandbox_nextjs_template_id,
+        path=settings.component_index_path,
+        build_timeout_seconds=settings.component_index_build_timeout_seconds,
+    )
+
+
+component_index_dependency = Annotated[
+    Optional[ComponentIndexService], Depends(get_component_index)
+]
+
+
+# create the /query response cache once (shared by all providers, keys include the provider)
+@lru_cache()
+def get_response_cache() -> Optional[ResponseCache]:
+    logger.info("response_cache_created", backend=settings.response_cache_backend)
+    if settings.response_cache_backend == "redis":
+        return RedisResponseCache(
+            url=settings.redis_url, ttl_seconds=settings.response_cache_ttl_seconds
+        )
+    if settings.response_cache_backend == "memory":
+        return InMemoryResponseCache(
+            max_size=settings.response_cache_max_size,
+            ttl_seconds=settings.response_cache_ttl_seconds,
+        )
+    return None
+
+
+response_cache_dependency = Annotated[
+    Optional[ResponseCache], Depends(get_response_cache)
+]
+
+
+# llm usage totals since startup, shared by every ai service
+@lru_cache()
+def get_usage_tracker() -> UsageTracker:
+    logger.info("usage_tracker_created", priced_models=len(settings.llm_prices))
+    return UsageTracker(prices=PriceTable(settings.llm_prices))
+
+
+usage_tracker_dependency = Annotated[UsageTracker, Depends(get_usage_tracker)]
+
+
+# create the llm admission controller once (rate and concurrency limits are per provider)
+@lru_cache()
+def get_admission_controller() -> AdmissionController:
+    logger.info("admission_controller_created")
+    return AdmissionController(
+        limits={
+            "openai": ProviderLimits(
+                requests_per_minute=settings.openai_requests_per_minute,
+                tokens_per_minute=settings.openai_tokens_per_minute,
+                max_concurrency=settings.openai_max_concurrency,
+            ),
+            "google": ProviderLimits(
+                requests_per_minute=settings.google_requests_per_minute,
+                tokens_per_minute=settings.google_tokens_per_minute,
+                max_concurrency=settings.google_max_concurrency,
+            ),
+            "anthropic": ProviderLimits(
+                requests_per_minute=settings.anthropic_requests_per_minute,
+                tokens_per_minute=settings.anthropic_tokens_per_minute,
+                max_concurrency=settings.anthropic_max_concurrency,
+            ),
+        },
+        max_wait_seconds=settings.llm_admission_max_wait_seconds,
+    )
+
+
+admission_controller_dependency = Annotated[
+    AdmissionController, Depends(get_admission_controller)
+]
+
+
+# same budget for every code agent, 0 in the settings disables a limit
+@lru_cache()
+def get_code_agent_budget() -> CodeAgentBudget:
+    return CodeAgentBudget(
+        max_steps=settings.code_agent_max_steps or None,
+        max_run_seconds=settings.code_agent_max_run_seconds or None,
+        max_tokens=settings.code_agent_max_tokens or None,
+        max_duplicate_calls=settings.code_agent_max_duplicate_calls or None,
+    )
+
+
+# one code agent run per sandbox, shared with the other workers when jobs are in redis
+@lru_cache()
+def get_sandbox_lock() -> SandboxLock:
+    logger.info("sandbox_lock_created", backend=settings.code_agent_job_store_backend)
+    if settings.code_agent_job_store_backend == "redis":
+        return RedisSandboxLock(
+            url=settings.redis_url,
+            ttl_seconds=settings.code_agent_sandbox_lock_ttl_seconds,
+            poll_interval_seconds=settings.code_agent_sandbox_lock_poll_seconds,
+        )
+    return InMemorySandboxLock(
+        ttl_seconds=settings.code_agent_sandbox_lock_ttl_seconds,
+        poll_interval_seconds=settings.code_agent_sandbox_lock_poll_seconds,
+    )
+
+
+# stateless, shared by every code agent
+@lru_cache()
+def get_scratchpad_compactor() -> Optional[ScratchpadCompactor]:
+    if not settings.code_agent_scratchpad_enabled:
+        return None
+    return ScratchpadCompactor(
+        max_tokens=settings.code_agent_scratchpad_max_tokens,
+        keep_recent_steps=settings.code_agent_scratchpad_keep_recent_steps,
+        block_steps=settings.code_agent_scratchpad_block_steps,
+    )
+
+
 # create the open ai client object (holds connection to openai llm)
 @lru_cache()
 def get_openai_client() -> OpenAIClient:
@@ -40,11 +215,24 @@ openai_dependency = Annotated[OpenAIClient, Depends(get_openai_client)]
 # create open ai coding agent
 @lru_cache()
 def get_openai_code_agent_service(
-    openai: openai_dependency, sandbox: sandbox_service_dependency
+    openai: openai_dependency,
+    sandbox: sandbox_service_dependency,
+    admission: admission_controller_dependency,
+    component_index: component_index_dependency,
 ) -> CodeAgentService:
     logger.info("openai_code_agent_service_client_created")
     ai_client = AIClient(openai_client=openai)
-    return CodeAgentService(llm=ai_client, sandbox_service=sandbox)
+    return CodeAgentService(
+        llm=ai_client,
+        sandbox_service=sandbox,
+        admission=admission,
+        component_index=component_index,
+        budget=get_code_agent_budget(),
+        scratchpad=get_scratchpad_compactor(),
+        usage_tracker=get_usage_tracker(),
+        sandbox_lock=get_sandbox_lock(),
+        snapshot_after_run=settings.sandbox_snapshot_after_code_run,
+    )
 
 
 openai_code_agent_service_dependency = Annotated[
@@ -54,10 +242,19 @@ openai_code_agent_service_dependency = Annotated[
 
 # create general openai llm service
 @lru_cache()
-def get_openai_service(openai: openai_dependency) -> GeneralAIService:
+def get_openai_service(
+    openai: openai_dependency,
+    response_cache: response_cache_dependency,
+    admission: admission_controller_dependency,
+) -> GeneralAIService:
     logger.info("openai_general_service_client_created")
     ai_client = AIClient(openai_client=openai)
-    return GeneralAIService(llm=ai_client)
+    return GeneralAIService(
+        llm=ai_client,
+        response_cache=response_cache,
+        admission=admission,
+        usage_tracker=get_usage_tracker(),
+    )
 
 
 openai_service_dependency = Annotated[GeneralAIService, Depends(get_openai_service)]
@@ -76,11 +273,24 @@ google_dependency = Annotated[GoogleClient, Depends(get_google_client)]
 # create google coding agent
 @lru_cache()
 def get_google_code_agent_service(
-    google: google_dependency, sandbox: sandbox_service_dependency
+    google: google_dependency,
+    sandbox: sandbox_service_dependency,
+    admission: admission_controller_dependency,
+    component_index: component_index_dependency,
 ) -> CodeAgentService:
     logger.info("google_code_agent_service_client_created")
     ai_client = AIClient(google_client=google)
-    return CodeAgentService(llm=ai_client, sandbox_service=sandbox)
+    return CodeAgentService(
+        llm=ai_client,
+        sandbox_service=sandbox,
+        admission=admission,
+        component_index=component_index,
+        budget=get_code_agent_budget(),
+        scratchpad=get_scratchpad_compactor(),
+        usage_tracker=get_usage_tracker(),
+        sandbox_lock=get_sandbox_lock(),
+        snapshot_after_run=settings.sandbox_snapshot_after_code_run,
+    )
 
 
 google_code_agent_service_dependency = Annotated[
@@ -90,10 +300,19 @@ google_code_agent_service_dependency = Annotated[
 
 # create general google llm service
 @lru_cache()
-def get_google_service(google: google_dependency) -> GeneralAIService:
+def get_google_service(
+    google: google_dependency,
+    response_cache: response_cache_dependency,
+    admission: admission_controller_dependency,
+) -> GeneralAIService:
     logger.info("google_general_service_client_created")
     ai_client = AIClient(google_client=google)
-    return GeneralAIService(llm=ai_client)
+    return GeneralAIService(
+        llm=ai_client,
+        response_cache=response_cache,
+        admission=admission,
+        usage_tracker=get_usage_tracker(),
+    )
 
 
 google_service_dependency = Annotated[GeneralAIService, Depends(get_google_service)]
@@ -112,11 +331,24 @@ anthropic_dependency = Annotated[AnthropicClient, Depends(get_anthropic_client)]
 # create the anthropic coding agent
 @lru_cache()
 def get_anthropic_code_agent_service(
-    anthropic: anthropic_dependency, sandbox: sandbox_service_dependency
+    anthropic: anthropic_dependency,
+    sandbox: sandbox_service_dependency,
+    admission: admission_controller_dependency,
+    component_index: component_index_dependency,
 ) -> CodeAgentService:
     logger.info("anthropic_code_agent_service_client_created")
     ai_client = AIClient(anthropic_client=anthropic)
-    return CodeAgentService(llm=ai_client, sandbox_service=sandbox)
+    return CodeAgentService(
+        llm=ai_client,
+        sandbox_service=sandbox,
+        admission=admission,
+        component_index=component_index,
+        budget=get_code_agent_budget(),
+        scratchpad=get_scratchpad_compactor(),
+        usage_tracker=get_usage_tracker(),
+        sandbox_lock=get_sandbox_lock(),
+        snapshot_after_run=settings.sandbox_snapshot_after_code_run,
+    )
 
 
 anthropic_code_agent_service_dependency = Annotated[
@@ -126,12 +358,105 @@ anthropic_code_agent_service_dependency = Annotated[
 
 # create general anthropic llm service
 @lru_cache()
-def get_anthropic_service(anthropic: anthropic_dependency) -> GeneralAIService:
+def get_anthropic_service(
+    anthropic: anthropic_dependency,
+    response_cache: response_cache_dependency,
+    admission: admission_controller_dependency,
+) -> GeneralAIService:
     logger.info("anthropic_general_service_client_created")
     ai_client = AIClient(anthropic_client=anthropic)
-    return GeneralAIService(llm=ai_client)
+    return GeneralAIService(
+        llm=ai_client,
+        response_cache=response_cache,
+        admission=admission,
+        usage_tracker=get_usage_tracker(),
+    )
 
 
 anthropic_service_dependency = Annotated[
     GeneralAIService, Depends(get_anthropic_service)
 ]
+
+
+# create the provider router once, only providers with an api key and model are routed to
+@lru_cache()
+def get_ai_router(
+    sandbox: sandbox_service_dependency,
+    response_cache: response_cache_dependency,
+    admission: admission_controller_dependency,
+    component_index: component_index_dependency,
+) -> AIRouter:
+    query_services: Dict[str, GeneralAIService] = {}
+    code_services: Dict[str, CodeAgentService] = {}
+
+    if settings.openai_api_key and settings.openai_model:
+        openai = get_openai_client()
+        query_services["openai"] = get_openai_service(openai, response_cache, admission)
+        code_services["openai"] = get_openai_code_agent_service(
+            openai, sandbox, admission, component_index
+        )
+
+    if settings.google_api_key and settings.google_model:
+        google = get_google_client()
+        query_services["google"] = get_google_service(google, response_cache, admission)
+        code_services["google"] = get_google_code_agent_service(
+            google, sandbox, admission, component_index
+        )
+
+    if settings.anthropic_api_key.get_secret_value() and settings.anthropic_model:
+        anthropic = get_anthropic_client()
+        query_services["anthropic"] = get_anthropic_service(
+            anthropic, response_cache, admission
+        )
+        code_services["anthropic"] = get_anthropic_code_agent_service(
+            anthropic, sandbox, admission, component_index
+        )
+
+    logger.info("ai_router_created", providers=list(query_services))
+    return AIRouter(
+        query_services=query_services,
+        code_services=code_services,
+        query_timeout_seconds=settings.ai_router_query_timeout_seconds,
+        code_timeout_seconds=settings.ai_router_code_timeout_seconds,
+        hedge_enabled=settings.ai_router_hedge_enabled,
+        hedge_percentile=settings.ai_router_hedge_percentile,
+        hedge_min_samples=settings.ai_router_hedge_min_samples,
+        failure_cooldown_seconds=settings.ai_router_failure_cooldown_seconds,
+    )
+
+
+ai_router_dependency = Annotated[AIRouter, Depends(get_ai_router)]
+
+
+# create the code agent job store once (redis lets any worker serve a job's status)
+@lru_cache()
+def get_job_store() -> JobStore:
+    logger.info("job_store_created", backend=settings.code_agent_job_store_backend)
+    if settings.code_agent_job_store_backend == "redis":
+        return RedisJobStore(
+            url=settings.redis_url, ttl_seconds=settings.code_agent_job_ttl_seconds
+        )
+    return InMemoryJobStore(max_size=settings.code_agent_job_store_max_size)
+
+
+job_store_dependency = Annotated[JobStore, Depends(get_job_store)]
+
+
+# create the code agent job workers once (started and stopped by the app lifespan)
+@lru_cache()
+def get_code_agent_job_manager(
+    ai_router: ai_router_dependency, job_store: job_store_dependency
+) -> CodeAgentJobManager:
+    logger.info("code_agent_job_manager_created")
+    return CodeAgentJobManager(
+        ai_router=ai_router,
+        job_store=job_store,
+        workers=settings.code_agent_job_workers,
+        max_queued=settings.code_agent_job_queue_size,
+        poll_interval_seconds=settings.code_agent_job_poll_interval_seconds,
+    )
+
+
+code_agent_job_manager_dependency = Annotated[
+    CodeAgentJobManager, Depends(get_code_agent_job_manager)
+]
@@ -4,16 +4,63 @@ from api.routes.sandbox import router as sandbox_router
 from api.routes.openai import router as openai_router
 from api.routes.google import router as google_router
 from api.routes.anthropic import router as anthropic_router
+from api.routes.ai import router as ai_router
+from api.routes.cache import router as cache_router
+from api.routes.jobs import router as jobs_router
+from api.routes.metrics import router as metrics_router
 from fastapi.middleware.cors import CORSMiddleware
 from api.config import settings
+from api.dependencies import (
+    get_admission_controller,
+    get_ai_router,
+    get_code_agent_job_manager,
+    get_component_index,
+    get_job_store,
+    get_response_cache,
+    get_sandbox_pool,
+    get_sandbox_service,
+)
+from contextlib import asynccontextmanager
 from utils.logging import LoggingMiddleWare
+from utils.metrics import MetricsMiddleWare, mark_worker_stopped
+from utils.tracing import TracingMiddleWare, configure_tracing, shutdown_tracing
 
 # env
 env = settings.environment
 PRODUCTION = env == "production"
 
+
+# background work that lives as long as the server
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_tracing()
+    sandbox_service = get_sandbox_service()
+    sandbox_pool = get_sandbox_pool(sandbox_service)
+    component_index = get_component_index()
+    ai_router = get_ai_router(
+        sandbox_service,
+        get_response_cache(),
+        get_admission_controller(),
+        component_index,
+    )
+    job_manager = get_code_agent_job_manager(ai_router, get_job_store())
+
+    await sandbox_pool.start()
+    if component_index:
+        await component_index.start()
+    await job_manager.start()
+    yield
+    await job_manager.stop()
+    if component_index:
+        await component_index.stop()
+    await sandbox_pool.stop()
+    mark_worker_stopped()
+    shutdown_tracing()
+
+
 # create server
 ai_service = FastAPI(
+    lifespan=lifespan,
     docs_url=None if PRODUCTION else "/docs",
     redoc_url=None if PRODUCTION else "/redoc",
     openapi_url=None if PRODUCTION else "/openapi.json",
@@ -26,9 +73,13 @@ api_v1_router.include_router(sandbox_router)
 api_v1_router.include_router(openai_router)
 api_v1_router.include_router(google_router)
 api_v1_router.include_router(anthropic_router)
+api_v1_router.include_router(ai_router)
+api_v1_router.include_router(cache_router)
+api_v1_router.include_router(jobs_router)
 
-# main server only knows the api v1 router
+# main server only knows the api v1 router, and /metrics where scrapers expect it
 ai_service.include_router(api_v1_router)
+ai_service.include_router(metrics_router)
 
 # need to configure for production
 ai_service.add_middleware(
@@ -41,3 +92,9 @@ ai_service.add_middleware(
 
 # log all http requests
 ai_service.add_middleware(LoggingMiddleWare)
+
+# root span of every request, around the logging so its logs carry the trace id
+ai_service.add_middleware(TracingMiddleWare)
+
+# outermost, times every request including the other middlewares
+ai_service.add_middleware(MetricsMiddleWare)
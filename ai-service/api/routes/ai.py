@@ -0,0 +1,197 @@
+from fastapi import APIRouter, HTTPException, Header, Request, Response
+from fastapi.responses import StreamingResponse
+from api.routes.models.ai_models import (
+    AICodeAgentRequest,
+    AICodeAgentResponse,
+    AIProvider,
+    AIRequest,
+    AIResponse,
+)
+from api.dependencies import (
+    admission_controller_dependency,
+    ai_router_dependency,
+    usage_tracker_dependency,
+)
+from services.ai_router import ProviderNotConfiguredError
+from api.routes.responses import code_agent_stream, http_error, query_stream
+from services.models.ai_models import ProviderHealthStats
+from services.models.admission_models import AdmissionStats
+from services.models.usage_models import UsageStats
+from utils.cancellation import run_cancellable, stream_with_deadline
+from utils.cache_control import use_response_cache
+from typing import Annotated, List, Optional
+from utils.logging import logger
+
+"""
+Provider agnostic version of the openai / google / anthropic routes.
+The provider path parameter pins a provider, "auto" lets the AIRouter pick the
+healthiest configured provider, fail over when it errors and hedge slow queries.
+Responses carry the llm usage of the request, /usage has the totals per provider and model.
+The provider that answered is returned in the X-AI-Provider header
+(and as a "provider" event on the /stream variants).
+"""
+router = APIRouter(
+    prefix="/ai",
+    tags=["AI Service"],
+)
+
+
+@router.get("/providers")
+async def get_provider_health(
+    ai_router: ai_router_dependency,
+) -> List[ProviderHealthStats]:
+    return ai_router.stats()
+
+
+@router.get("/admission")
+async def get_admission_stats(
+    admission: admission_controller_dependency,
+) -> List[AdmissionStats]:
+    return admission.stats()
+
+
+@router.get("/usage")
+async def get_usage_stats(usage_tracker: usage_tracker_dependency) -> List[UsageStats]:
+    return usage_tracker.stats()
+
+
+@router.post("/{provider}/{sandbox_id}/code")
+async def code_agent_request(
+    provider: AIProvider,
+    sandbox_id: str,
+    request: AICodeAgentRequest,
+    http_request: Request,
+    response: Response,
+    ai_router: ai_router_dependency,
+    x_request_timeout: Annotated[Optional[float], Header()] = None,
+) -> AICodeAgentResponse:
+    logger.info(
+        "ai_code_agent_started",
+        provider=provider.value,
+        sandbox_id=sandbox_id,
+        message_length=len(request.message),
+    )
+    try:
+        served_by, result = await run_cancellable(
+            http_request,
+            ai_router.process_code_request(
+                provider=provider.value,
+                sandbox_id=sandbox_id,
+                user_message=request.message,
+            ),
+            timeout=x_request_timeout,
+        )
+
+        logger.info(
+            "ai_code_agent_completed",
+            provider=served_by,
+            sandbox_id=sandbox_id,
+            commands_executed=len(result.commands),
+            files_modified=len(result.files),
+        )
+
+        response.headers["X-AI-Provider"] = served_by
+        return AICodeAgentResponse(
+            human_message=request.message,
+            summary=result.summary,
+            commands=result.commands,
+            files=result.files,
+            usage=result.usage,
+        )
+
+    except ProviderNotConfiguredError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise http_error(
+            e, "ai_code_agent", provider=provider.value, sandbox_id=sandbox_id
+        )
+
+
+@router.post("/{provider}/{sandbox_id}/code/stream")
+async def code_agent_stream_request(
+    provider: AIProvider,
+    sandbox_id: str,
+    request: AICodeAgentRequest,
+    ai_router: ai_router_dependency,
+    x_request_timeout: Annotated[Optional[float], Header()] = None,
+) -> StreamingResponse:
+    logger.info(
+        "ai_code_agent_stream_started",
+        provider=provider.value,
+        sandbox_id=sandbox_id,
+        message_length=len(request.message),
+    )
+    return code_agent_stream(
+        stream_with_deadline(
+            ai_router.stream_code_request(
+                provider=provider.value,
+                sandbox_id=sandbox_id,
+                user_message=request.message,
+            ),
+            timeout=x_request_timeout,
+        ),
+        request.message,
+        "ai_code_agent",
+        provider=provider.value,
+        sandbox_id=sandbox_id,
+    )
+
+
+@router.post("/{provider}/query")
+async def query_request(
+    provider: AIProvider,
+    request: AIRequest,
+    response: Response,
+    ai_router: ai_router_dependency,
+    cache_control: Annotated[Optional[str], Header()] = None,
+) -> AIResponse:
+    logger.info(
+        "ai_query_started",
+        provider=provider.value,
+        message_length=len(request.message),
+    )
+
+    try:
+        served_by, result = await ai_router.process_query_request(
+            provider=provider.value,
+            user_message=request.message,
+            use_cache=use_response_cache(cache_control),
+        )
+
+        logger.info(
+            "ai_query_completed",
+            provider=served_by,
+            message_length=len(request.message),
+        )
+
+        response.headers["X-AI-Provider"] = served_by
+        return AIResponse(content=result.content, usage=result.usage)
+
+    except ProviderNotConfiguredError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise http_error(e, "ai_query", provider=provider.value)
+
+
+@router.post("/{provider}/query/stream")
+async def query_stream_request(
+    provider: AIProvider,
+    request: AIRequest,
+    ai_router: ai_router_dependency,
+    cache_control: Annotated[Optional[str], Header()] = None,
+) -> StreamingResponse:
+    logger.info(
+        "ai_query_stream_started",
+        provider=provider.value,
+        message_length=len(request.message),
+    )
+    return query_stream(
+        ai_router.stream_query_request(
+            provider=provider.value,
+            user_message=request.message,
+            use_cache=use_response_cache(cache_control),
+        ),
+        request.message,
+        "ai_query",
+        provider=provider.value,
+    )
@@ -0,0 +1,14 @@
+from fastapi import APIRouter, HTTPException
+from api.dependencies import response_cache_dependency
+from services.models.cache_models import ResponseCacheStats
+
+router = APIRouter(prefix="/cache", tags=["Cache"])
+
+
+@router.get("/responses")
+async def get_response_cache_stats(
+    response_cache: response_cache_dependency,
+) -> ResponseCacheStats:
+    if response_cache is None:
+        raise HTTPException(status_code=404, detail="response cache is disabled")
+    return response_cache.stats()
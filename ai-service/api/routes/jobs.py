@@ -0,0 +1,124 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from api.routes.models.ai_models import (
+    AICodeAgentRequest,
+    AICodeAgentResponse,
+    AIProvider,
+)
+from api.dependencies import code_agent_job_manager_dependency
+from services.ai_router import ProviderNotConfiguredError
+from services.job_manager import JobNotFoundError, JobQueueFullError
+from services.models.ai_models import AIStreamEvent, CodeAgentData
+from services.models.job_models import CodeAgentJob, CodeAgentJobStats
+from utils.sse import format_sse, SSE_HEADERS
+from typing import AsyncIterator
+from utils.logging import logger
+
+"""
+Background version of the /ai code agent route.
+Submitting returns the job right away (202), the run continues even if the client
+disconnects or a proxy times out. Poll the job for its status and progress, or
+stream it to get the progress events followed by the final response.
+"""
+router = APIRouter(
+    prefix="/jobs",
+    tags=["Code Agent Jobs"],
+)
+
+
+@router.get("")
+async def get_job_stats(
+    job_manager: code_agent_job_manager_dependency,
+) -> CodeAgentJobStats:
+    return job_manager.stats()
+
+
+@router.post("/{provider}/{sandbox_id}/code", status_code=202)
+async def submit_code_agent_job(
+    provider: AIProvider,
+    sandbox_id: str,
+    request: AICodeAgentRequest,
+    job_manager: code_agent_job_manager_dependency,
+) -> CodeAgentJob:
+    try:
+        return await job_manager.submit(
+            provider=provider.value,
+            sandbox_id=sandbox_id,
+            user_message=request.message,
+        )
+    except ProviderNotConfiguredError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        logger.error(
+            "code_agent_job_submit_failed",
+            provider=provider.value,
+            sandbox_id=sandbox_id,
+            error_type=type(e).__name__,
+            error=str(e),
+            exc_info=True,
+        )
+        raise HTTPException(
+            status_code=500, detail=f"code agent job submit failed: {str(e)}"
+        )
+
+
+@router.get("/{job_id}")
+async def get_code_agent_job(
+    job_id: str,
+    job_manager: code_agent_job_manager_dependency,
+) -> CodeAgentJob:
+    try:
+        return await job_manager.get(job_id)
+    except JobNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@router.get("/{job_id}/stream")
+async def stream_code_agent_job(
+    job_id: str,
+    job_manager: code_agent_job_manager_dependency,
+) -> StreamingResponse:
+    try:
+        job = await job_manager.get(job_id, include_progress=False)
+    except JobNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    async def event_stream() -> AsyncIterator[str]:
+        try:
+            async for stream_event in job_manager.stream(job_id):
+                if stream_event.event == "final":
+                    result = CodeAgentData(**stream_event.data)
+                    response = AICodeAgentResponse(
+                        human_message=job.message,
+                        summary=result.summary,
+                        commands=result.commands,
+                        files=result.files,
+                        usage=result.usage,
+                    )
+                    stream_event = AIStreamEvent(
+                        event="final", data=response.model_dump()
+                    )
+                yield format_sse(stream_event)
+
+        except Exception as e:
+            logger.error(
+                "code_agent_job_stream_failed",
+                job_id=job_id,
+                error_type=type(e).__name__,
+                error=str(e),
+                exc_info=True,
+            )
+            yield format_sse(
+                AIStreamEvent(
+                    event="error",
+                    data={"detail": f"code agent job stream failed: {str(e)}"},
+                )
+            )
+        finally:
+            job_manager.unsubscribe(job_id)
+
+    return StreamingResponse(
+        event_stream(), media_type="text/event-stream", headers=SSE_HEADERS
+    )
@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Response
+from utils.metrics import render_metrics
+
+"""
+Prometheus scrape endpoint, mounted at the root (/metrics) and left out of the docs.
+With PROMETHEUS_MULTIPROC_DIR set it merges the metrics of every worker.
+"""
+
+router = APIRouter()
+
+
+@router.get("/metrics", tags=["Metrics"], include_in_schema=False)
+def metrics() -> Response:
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
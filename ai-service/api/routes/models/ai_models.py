@@ -1,5 +1,7 @@
 from pydantic import BaseModel, Field
-from typing import Dict, List
+from enum import Enum
+from services.models.usage_models import LLMUsage
+from typing import Dict, List, Optional
 
 
 class AICodeAgentRequest(BaseModel):
@@ -13,6 +15,9 @@ class AICodeAgentResponse(BaseModel):
     files: Dict[str, str] = Field(
         ..., description="list of files updated and their respective paths"
     )
+    usage: Optional[LLMUsage] = Field(
+        None, description="tokens, llm and tool time and estimated cost of the run"
+    )
 
 
 class AIRequest(BaseModel):
@@ -21,3 +26,14 @@ class AIRequest(BaseModel):
 
 class AIResponse(BaseModel):
     content: str = Field(..., description="open ai llm response to general query")
+    usage: Optional[LLMUsage] = Field(
+        None, description="tokens, llm time and estimated cost of the query"
+    )
+
+
+# provider path parameter of the unified /ai routes
+class AIProvider(str, Enum):
+    openai = "openai"
+    google = "google"
+    anthropic = "anthropic"
+    auto = "auto"
@@ -1,6 +1,10 @@
 from pydantic import BaseModel, Field
 from e2b_code_interpreter import WriteInfo
-from services.models.sandbox_models import WriteEntry
+from services.models.sandbox_models import (
+    SandboxSnapshot,
+    SandboxTreeEntry,
+    WriteEntry,
+)
 from typing import List, Optional
 
 
@@ -9,9 +13,21 @@ class CreateSandboxResponse(BaseModel):
     url: str = Field(..., description="sandbox url")
 
 
+class RestoreSandboxResponse(BaseModel):
+    id: str = Field(..., description="new sandbox id")
+    url: str = Field(..., description="new sandbox url")
+    snapshot: SandboxSnapshot = Field(..., description="snapshot that was restored")
+
+
 class ListSandboxResponse(BaseModel):
     path: Optional[str] = Field(..., description="input path specified")
     files: List[WriteInfo] = Field(..., description="list of files from specified path")
+    tree: Optional[List[SandboxTreeEntry]] = Field(
+        default=None, description="recursive listing with size and mtime (depth > 1)"
+    )
+    truncated: bool = Field(
+        default=False, description="recursive listing hit the entry limit"
+    )
 
 
 class ReadSandboxResponse(BaseModel):
@@ -23,6 +39,13 @@ class ExecuteSandboxResponse(BaseModel):
     command: str = Field(..., description="input terminal command")
     stdout: str = Field(..., description="on stdout message")
     stderr: str = Field(..., description="on stderr message")
+    exit_code: Optional[int] = Field(
+        default=None, description="None when the command was killed"
+    )
+    timed_out: bool = Field(default=False, description="killed past its timeout")
+    truncated_bytes: int = Field(
+        default=0, description="output dropped from the middle of stdout and stderr"
+    )
 
 
 class WriteSandboxRequest(BaseModel):
@@ -35,6 +58,9 @@ class WriteSandboxResponse(BaseModel):
     files_written_to: List[WriteInfo] = Field(
         ..., description="successfully files written to"
     )
+    files_skipped: List[str] = Field(
+        default_factory=list, description="paths not written, content was unchanged"
+    )
     write_data: List[WriteEntry] = Field(
         ..., description="list of file paths and content"
     )
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, Request
+from fastapi.responses import StreamingResponse
 from api.routes.models.ai_models import (
     AICodeAgentRequest,
     AICodeAgentResponse,
@@ -9,13 +10,19 @@ from api.dependencies import (
     openai_service_dependency,
     openai_code_agent_service_dependency,
 )
-from services.models.ai_models import CodeAgentData
+from api.routes.responses import code_agent_stream, http_error, query_stream
+from services.models.ai_models import CodeAgentData, LLMQueryData
+from utils.cancellation import run_cancellable, stream_with_deadline
+from utils.cache_control import use_response_cache
+from typing import Annotated, Optional
 from utils.logging import logger
 
 """
 This route will be used by the Golang service.
 It is tailored for responses by OpenAI specifically.
 The related OpenAI service will handle running code in the sandbox or a general query.
+Query routes skip the response cache when sent "Cache-Control: no-cache".
+The /stream variants send tokens, tool events and the final response as server-sent events.
 # TODO  add user messages context in the param for a better answer.
 """
 router = APIRouter(
@@ -28,7 +35,9 @@ router = APIRouter(
 async def code_agent_request(
     sandbox_id: str,
     request: AICodeAgentRequest,
+    http_request: Request,
     openai_code_agent: openai_code_agent_service_dependency,
+    x_request_timeout: Annotated[Optional[float], Header()] = None,
 ) -> AICodeAgentResponse:
     logger.info(
         "openai_code_agent_started",
@@ -36,8 +45,12 @@ async def code_agent_request(
         message_length=len(request.message),
     )
     try:
-        result: CodeAgentData = await openai_code_agent.process_code_request(
-            sandbox_id=sandbox_id, user_message=request.message
+        result: CodeAgentData = await run_cancellable(
+            http_request,
+            openai_code_agent.process_code_request(
+                sandbox_id=sandbox_id, user_message=request.message
+            ),
+            timeout=x_request_timeout,
         )
 
         logger.info(
@@ -52,41 +65,71 @@ async def code_agent_request(
             summary=result.summary,
             commands=result.commands,
             files=result.files,
+            usage=result.usage,
         )
 
     except Exception as e:
-        logger.error(
-            "openai_code_agent_failed",
-            sandbox_id=sandbox_id,
-            error_type=type(e).__name__,
-            error=str(e),
-            exc_info=True,
-        )
-        raise HTTPException(
-            status_code=500, detail=f"openai code agent failed: {str(e)}"
-        )
+        raise http_error(e, "openai_code_agent", sandbox_id=sandbox_id)
+
+
+@router.post("/{sandbox_id}/code/stream")
+async def code_agent_stream_request(
+    sandbox_id: str,
+    request: AICodeAgentRequest,
+    openai_code_agent: openai_code_agent_service_dependency,
+    x_request_timeout: Annotated[Optional[float], Header()] = None,
+) -> StreamingResponse:
+    logger.info(
+        "openai_code_agent_stream_started",
+        sandbox_id=sandbox_id,
+        message_length=len(request.message),
+    )
+    return code_agent_stream(
+        stream_with_deadline(
+            openai_code_agent.stream_code_request(
+                sandbox_id=sandbox_id, user_message=request.message
+            ),
+            timeout=x_request_timeout,
+        ),
+        request.message,
+        "openai_code_agent",
+        sandbox_id=sandbox_id,
+    )
 
 
 @router.post("/query")
 async def query_request(
-    request: AIRequest, openai_service: openai_service_dependency
+    request: AIRequest,
+    openai_service: openai_service_dependency,
+    cache_control: Annotated[Optional[str], Header()] = None,
 ) -> AIResponse:
     logger.info("openai_query_started", message_length=len(request.message))
 
     try:
-        result: str = await openai_service.process_query_request(
-            user_message=request.message
+        result: LLMQueryData = await openai_service.process_query_request(
+            user_message=request.message, use_cache=use_response_cache(cache_control)
         )
 
         logger.info("openai_query_completed", message_length=len(request.message))
 
-        return AIResponse(content=result)
+        return AIResponse(content=result.content, usage=result.usage)
 
     except Exception as e:
-        logger.error(
-            "openai_query_failed",
-            error_type=type(e).__name__,
-            error=str(e),
-            exc_info=True,
-        )
-        raise HTTPException(status_code=500, detail=f"openai query failed: {str(e)}")
+        raise http_error(e, "openai_query")
+
+
+@router.post("/query/stream")
+async def query_stream_request(
+    request: AIRequest,
+    openai_service: openai_service_dependency,
+    cache_control: Annotated[Optional[str], Header()] = None,
+) -> StreamingResponse:
+    logger.info("openai_query_stream_started", message_length=len(request.message))
+    return query_stream(
+        openai_service.stream_query_request(
+            user_message=request.message,
+            use_cache=use_response_cache(cache_control),
+        ),
+        request.message,
+        "openai_query",
+    )
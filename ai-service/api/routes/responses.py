@@ -0,0 +1,131 @@
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from api.routes.models.ai_models import AICodeAgentResponse, AIResponse
+from services.models.ai_models import AIStreamEvent, CodeAgentData
+from services.admission_controller import AdmissionRejectedError
+from utils.sse import format_sse, SSE_HEADERS
+from utils.cancellation import RequestCancelledError
+from typing import Any, AsyncIterator
+from utils.logging import logger
+
+"""
+Error handling and streaming shared by every llm route (openai, google, anthropic
+and the provider agnostic /ai routes), the routers only call these.
+name is the route's log prefix (e.g. "openai_code_agent"), the events are logged as
+{name}_stream_completed / {name}_failed / {name}_stream_failed with log_fields.
+- cancelled requests keep their status (499 disconnect, 504 deadline)
+- calls shed by the llm admission controller are 429 with a Retry-After header,
+  an error event with retry_after on the streams
+- anything else is logged and becomes a 500 / an error event with the detail
+"""
+
+
+def _failed_detail(name: str, e: Exception) -> str:
+    return f"{name.replace('_', ' ')} failed: {str(e)}"
+
+
+# raise it from the route's except block, unexpected errors are logged with their trace
+def http_error(e: Exception, name: str, **log_fields: Any) -> HTTPException:
+    if isinstance(e, RequestCancelledError):
+        return HTTPException(status_code=e.status_code, detail=str(e))
+    if isinstance(e, AdmissionRejectedError):
+        return HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after_seconds)},
+        )
+    logger.error(
+        f"{name}_failed",
+        error_type=type(e).__name__,
+        error=str(e),
+        exc_info=True,
+        **log_fields,
+    )
+    return HTTPException(status_code=500, detail=_failed_detail(name, e))
+
+
+# the stream has already started (200), errors are sent as a last "error" event
+def error_event(e: Exception, name: str, **log_fields: Any) -> AIStreamEvent:
+    if isinstance(e, RequestCancelledError):
+        return AIStreamEvent(event="error", data={"detail": str(e), "reason": e.reason})
+    if isinstance(e, AdmissionRejectedError):
+        return AIStreamEvent(
+            event="error",
+            data={"detail": str(e), "retry_after": e.retry_after_seconds},
+        )
+    logger.error(
+        f"{name}_stream_failed",
+        error_type=type(e).__name__,
+        error=str(e),
+        exc_info=True,
+        **log_fields,
+    )
+    return AIStreamEvent(event="error", data={"detail": _failed_detail(name, e)})
+
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events, media_type="text/event-stream", headers=SSE_HEADERS
+    )
+
+
+# tokens and tool events as they come, the final event as an AICodeAgentResponse
+def code_agent_stream(
+    events: AsyncIterator[AIStreamEvent],
+    message: str,
+    name: str,
+    **log_fields: Any,
+) -> StreamingResponse:
+    async def event_stream() -> AsyncIterator[str]:
+        try:
+            async for stream_event in events:
+                if stream_event.event == "final":
+                    result = CodeAgentData(**stream_event.data)
+                    logger.info(
+                        f"{name}_stream_completed",
+                        commands_executed=len(result.commands),
+                        files_modified=len(result.files),
+                        **log_fields,
+                    )
+                    response = AICodeAgentResponse(
+                        human_message=message,
+                        summary=result.summary,
+                        commands=result.commands,
+                        files=result.files,
+                        usage=result.usage,
+                    )
+                    stream_event = AIStreamEvent(
+                        event="final", data=response.model_dump()
+                    )
+                yield format_sse(stream_event)
+        except Exception as e:
+            yield format_sse(error_event(e, name, **log_fields))
+
+    return sse_response(event_stream())
+
+
+# tokens as they come, the final event as an AIResponse
+def query_stream(
+    events: AsyncIterator[AIStreamEvent],
+    message: str,
+    name: str,
+    **log_fields: Any,
+) -> StreamingResponse:
+    async def event_stream() -> AsyncIterator[str]:
+        try:
+            async for stream_event in events:
+                if stream_event.event == "final":
+                    logger.info(
+                        f"{name}_stream_completed",
+                        message_length=len(message),
+                        **log_fields,
+                    )
+                    response = AIResponse(**stream_event.data)
+                    stream_event = AIStreamEvent(
+                        event="final", data=response.model_dump()
+                    )
+                yield format_sse(stream_event)
+        except Exception as e:
+            yield format_sse(error_event(e, name, **log_fields))
+
+    return sse_response(event_stream())
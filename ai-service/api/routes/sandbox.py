@@ -1,25 +1,48 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from api.routes.models.sandbox_models import (
     CreateSandboxResponse,
+    RestoreSandboxResponse,
     ListSandboxResponse,
     ReadSandboxResponse,
     ExecuteSandboxResponse,
     WriteSandboxRequest,
     WriteSandboxResponse,
 )
-from api.dependencies import sandbox_service_dependency
-from api.config import settings
-from services.models.sandbox_models import TerminalInfo
-from e2b_code_interpreter import Sandbox, WriteInfo
-from typing import List
+from api.dependencies import (
+    component_index_dependency,
+    sandbox_service_dependency,
+    sandbox_pool_dependency,
+)
+from services.models.ai_models import AIStreamEvent
+from services.models.component_models import ComponentIndexStats
+from services.models.sandbox_models import (
+    TerminalInfo,
+    SandboxConnectionCacheStats,
+    SandboxPoolStats,
+    SandboxSearchResult,
+    SandboxSnapshot,
+    SandboxTree,
+    SandboxWriteResult,
+)
+from services.sandbox_service import (
+    SandboxService,
+    SnapshotNotFoundError,
+    SnapshotTooLargeError,
+)
+from e2b_code_interpreter import AsyncSandbox, FileType, WriteInfo
+from typing import Annotated, AsyncIterator, List, Optional
 from utils.logging import logger
+from utils.sse import format_sse, SSE_HEADERS
 
 """
 Create route is for the Golang service.
 It will call this route to get a sandbox id / url which will be stored.
 Subsequent calls to the ai services will use this sandbox id to execute
 code in the correct sandbox.
-If a sandbox id expires use this route to create a new sandbox id to run code in.
+If a sandbox id expires use this route to create a new sandbox id to run code in,
+or restore its last snapshot into a new sandbox so the generated app is kept.
+Sandboxes are handed out from a warm pool, a new one is only booted on a pool miss.
 Other routes are for development
 """
 
@@ -28,13 +51,12 @@ router = APIRouter(prefix="/sandbox", tags=["Sandbox Service"])
 
 @router.post("/")
 async def create_sandbox(
-    sandbox_service: sandbox_service_dependency,
+    sandbox_pool: sandbox_pool_dependency,
 ) -> CreateSandboxResponse:
     logger.info("sandbox_creation_started")
     try:
-        sbx: Sandbox = sandbox_service.create(
-            template_id=settings.e2b_sandbox_nextjs_template_id
-        )  # currently only creating a nextjs sandbox
+        # currently only creating a nextjs sandbox
+        sbx: AsyncSandbox = await sandbox_pool.checkout()
         logger.info("sandbox_creation_completed")
         return CreateSandboxResponse(id=sbx.sandbox_id, url=sbx.get_host(3000))
     except Exception as e:
@@ -49,13 +71,138 @@ async def create_sandbox(
         )
 
 
+@router.post("/{sandbox_id}/snapshot")
+async def snapshot_sandbox(
+    sandbox_id: str, sandbox_service: sandbox_service_dependency
+) -> SandboxSnapshot:
+    try:
+        return await sandbox_service.snapshot(sandbox_id=sandbox_id)
+    except SnapshotTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        logger.error(
+            "sandbox_snapshot_failed",
+            sandbox_id=sandbox_id,
+            error_type=type(e).__name__,
+            error=str(e),
+            exc_info=True,
+        )
+        raise HTTPException(
+            status_code=500, detail=f"Failed to snapshot sandbox: {str(e)}"
+        )
+
+
+@router.get("/{sandbox_id}/snapshot")
+async def get_sandbox_snapshot(
+    sandbox_id: str, sandbox_service: sandbox_service_dependency
+) -> SandboxSnapshot:
+    snapshot = await sandbox_service.snapshot_store.get(sandbox_id)
+    if snapshot is None:
+        raise HTTPException(
+            status_code=404, detail=f"no snapshot for sandbox {sandbox_id}"
+        )
+    return snapshot
+
+
+# restores into a pooled sandbox, the expired sandbox id only names the snapshot
+@router.post("/{sandbox_id}/restore")
+async def restore_sandbox(
+    sandbox_id: str,
+    sandbox_service: sandbox_service_dependency,
+    sandbox_pool: sandbox_pool_dependency,
+) -> RestoreSandboxResponse:
+    logger.info("sandbox_restore_started", source_sandbox_id=sandbox_id)
+    if await sandbox_service.snapshot_store.get(sandbox_id) is None:
+        raise HTTPException(
+            status_code=404, detail=f"no snapshot for sandbox {sandbox_id}"
+        )
+    sbx: Optional[AsyncSandbox] = None
+    try:
+        sbx = await sandbox_pool.checkout()
+        snapshot = await sandbox_service.restore(
+            sandbox_id=sbx.sandbox_id, source_sandbox_id=sandbox_id
+        )
+        return RestoreSandboxResponse(
+            id=sbx.sandbox_id, url=sbx.get_host(3000), snapshot=snapshot
+        )
+    except SnapshotNotFoundError as e:
+        # deleted or expired since the check above
+        if sbx is not None:
+            await sandbox_pool.discard(sbx)
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        # half restored, it is nobody's sandbox
+        if sbx is not None:
+            await sandbox_pool.discard(sbx)
+        logger.error(
+            "sandbox_restore_failed",
+            source_sandbox_id=sandbox_id,
+            error_type=type(e).__name__,
+            error=str(e),
+            exc_info=True,
+        )
+        raise HTTPException(
+            status_code=500, detail=f"Failed to restore sandbox: {str(e)}"
+        )
+
+
+@router.get("/pool")
+async def get_pool_stats(sandbox_pool: sandbox_pool_dependency) -> SandboxPoolStats:
+    return sandbox_pool.stats()
+
+
+@router.get("/components")
+async def get_component_index_stats(
+    component_index: component_index_dependency,
+) -> ComponentIndexStats:
+    if component_index is None:
+        raise HTTPException(status_code=404, detail="component index is disabled")
+    return component_index.stats()
+
+
+@router.get("/connections")
+async def get_connection_stats(
+    sandbox_service: sandbox_service_dependency,
+) -> SandboxConnectionCacheStats:
+    return sandbox_service.connections.stats()
+
+
 @router.get("/{sandbox_id}/files")
 async def list_sandbox_files(
-    sandbox_id: str, path: str, sandbox_service: sandbox_service_dependency
+    sandbox_id: str,
+    path: str,
+    sandbox_service: sandbox_service_dependency,
+    depth: Annotated[int, Query(ge=1, le=10)] = 1,
+    ignore: Annotated[Optional[List[str]], Query()] = None,
 ) -> ListSandboxResponse:
-    logger.info("file_listing_started", path=path)
+    logger.info("file_listing_started", path=path, depth=depth)
     try:
-        files: List[WriteInfo] = sandbox_service.list_files(
+        if depth > 1 or ignore is not None:
+            tree: SandboxTree = await sandbox_service.list_tree(
+                sandbox_id=sandbox_id, path=path, depth=depth, ignore=ignore
+            )
+            logger.info(
+                "file_listing_completed",
+                path=path,
+                file_count=len(tree.entries),
+                truncated=tree.truncated,
+            )
+            tree_files = [
+                WriteInfo(
+                    name=entry.path.split("/")[-1],
+                    type=FileType.DIR if entry.type == "dir" else FileType.FILE,
+                    path=f"{path.rstrip('/')}/{entry.path}",
+                )
+                for entry in tree.entries
+            ]
+            return ListSandboxResponse(
+                path=path,
+                files=tree_files,
+                tree=tree.entries,
+                truncated=tree.truncated,
+            )
+
+        files: List[WriteInfo] = await sandbox_service.list_files(
             sandbox_id=sandbox_id, path=path
         )
 
@@ -82,7 +229,9 @@ async def read_sandbox_file(
 ) -> ReadSandboxResponse:
     logger.info("file_read_started", path=path)
     try:
-        file_content: str = sandbox_service.read_file(sandbox_id=sandbox_id, path=path)
+        file_content: str = await sandbox_service.read_file(
+            sandbox_id=sandbox_id, path=path
+        )
 
         logger.info("file_read_completed", path=path, content_length=len(file_content))
 
@@ -101,29 +250,74 @@ async def read_sandbox_file(
         )
 
 
-@router.post("/{sandbox_id}/command")
+@router.get("/{sandbox_id}/search")
+async def search_sandbox_files(
+    sandbox_id: str,
+    pattern: str,
+    sandbox_service: sandbox_service_dependency,
+    path: str = "/home/user/",
+    glob: Optional[str] = None,
+    context: Annotated[int, Query(ge=0, le=5)] = 0,
+    ignore_case: bool = False,
+    fixed_strings: bool = False,
+) -> SandboxSearchResult:
+    try:
+        return await sandbox_service.search(
+            sandbox_id=sandbox_id,
+            pattern=pattern,
+            path=path,
+            glob=glob,
+            context=context,
+            ignore_case=ignore_case,
+            fixed_strings=fixed_strings,
+        )
+    except Exception as e:
+        logger.error(
+            "file_search_failed",
+            path=path,
+            error_type=type(e).__name__,
+            error=str(e),
+            exc_info=True,
+        )
+        raise HTTPException(
+            status_code=500, detail=f"Failed to search files in sandbox: {str(e)}"
+        )
+
+
+# stream=true sends the output live as server-sent events, ending with a "result" event
+@router.post("/{sandbox_id}/command", response_model=ExecuteSandboxResponse)
 async def execute_sandbox_command(
-    sandbox_id: str, command: str, sandbox_service: sandbox_service_dependency
-) -> ExecuteSandboxResponse:
-    logger.info("command_execution_started", command=command)
+    sandbox_id: str,
+    command: str,
+    sandbox_service: sandbox_service_dependency,
+    stream: bool = False,
+    timeout_seconds: Annotated[Optional[int], Query(ge=1, le=1800)] = None,
+) -> Response:
+    logger.info("command_execution_started", command=command, stream=stream)
+    if stream:
+        return StreamingResponse(
+            _stream_command(sandbox_service, sandbox_id, command, timeout_seconds),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS,
+        )
+
     try:
-        result: TerminalInfo = sandbox_service.execute_terminal_command(
-            sandbox_id=sandbox_id, command=command
+        result: TerminalInfo = await sandbox_service.execute_terminal_command(
+            sandbox_id=sandbox_id, command=command, timeout_seconds=timeout_seconds
         )
 
         logger.info(
             "command_execution_completed",
             command=command,
+            exit_code=result.exit_code,
+            timed_out=result.timed_out,
             stdout_length=len(result.stdout) if result.stdout else 0,
             stderr_length=len(result.stderr) if result.stderr else 0,
+            truncated_bytes=result.truncated_bytes,
             has_errors=bool(result.stderr),
         )
 
-        return ExecuteSandboxResponse(
-            command=command,
-            stdout=result.stdout,
-            stderr=result.stderr,
-        )
+        return ExecuteSandboxResponse(command=command, **result.model_dump())
 
     except Exception as e:
         logger.error(
@@ -139,6 +333,42 @@ async def execute_sandbox_command(
         )
 
 
+async def _stream_command(
+    sandbox_service: SandboxService,
+    sandbox_id: str,
+    command: str,
+    timeout_seconds: Optional[int],
+) -> AsyncIterator[str]:
+    try:
+        async for stream_event in sandbox_service.stream_terminal_command(
+            sandbox_id=sandbox_id, command=command, timeout_seconds=timeout_seconds
+        ):
+            if stream_event.event == "result":
+                stream_event = AIStreamEvent(
+                    event="result",
+                    data=ExecuteSandboxResponse(
+                        command=command, **stream_event.data
+                    ).model_dump(),
+                )
+            yield format_sse(stream_event)
+    except Exception as e:
+        logger.error(
+            "command_execution_failed",
+            command=command,
+            error_type=type(e).__name__,
+            error=str(e),
+            exc_info=True,
+        )
+        yield format_sse(
+            AIStreamEvent(
+                event="error",
+                data={
+                    "detail": f"Failed to execute terminal command in sandbox: {str(e)}"
+                },
+            )
+        )
+
+
 @router.post("/{sandbox_id}/files")
 async def write_sandbox_files(
     sandbox_id: str,
@@ -147,18 +377,21 @@ async def write_sandbox_files(
 ) -> WriteSandboxResponse:
     logger.info("file_write_started", file_count=len(files.write_data))
     try:
-        result: List[WriteInfo] = sandbox_service.write_files(
+        result: SandboxWriteResult = await sandbox_service.write_files(
             sandbox_id=sandbox_id, write_data=files.write_data
         )
 
         logger.info(
             "file_write_completed",
             files_requested=len(files.write_data),
-            files_written=len(result),
+            files_written=len(result.written),
+            files_skipped=len(result.skipped),
         )
 
         return WriteSandboxResponse(
-            files_written_to=result, write_data=files.write_data
+            files_written_to=result.written,
+            files_skipped=result.skipped,
+            write_data=files.write_data,
         )
 
     except Exception as e:
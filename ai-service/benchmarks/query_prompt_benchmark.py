@@ -0,0 +1,72 @@
+from langchain.prompts import HumanMessagePromptTemplate, ChatPromptTemplate
+from langchain.output_parsers import PydanticOutputParser
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import BaseMessage
+from clients.openai_client import OpenAIClient
+from prompts.query_prompt import QUERY_PROMPT
+from services.ai_services import GeneralAIService
+from services.models.ai_models import AIClient, LLMQueryResult
+from typing import List
+import argparse
+import asyncio
+import time
+
+"""
+Micro-benchmark for the per-request CPU cost of GeneralAIService.process_query_request.
+Compares rebuilding the parser and prompt templates on every call (the old behaviour)
+against the prompt compiled once per service. The llm is a local fake model so only
+our own overhead is measured.
+Run from the ai-service directory: python -m benchmarks.query_prompt_benchmark
+"""
+
+
+class FakeLLMClient(OpenAIClient):
+    def __init__(self) -> None:
+        self.client = FakeListChatModel(responses=['{"response": "ok"}'])
+
+
+class RebuildPerRequestService(GeneralAIService):
+    def _build_messages(self, user_message: str) -> List[BaseMessage]:
+        parser = PydanticOutputParser(pydantic_object=LLMQueryResult)
+        message = HumanMessagePromptTemplate.from_template(template=QUERY_PROMPT)
+        chat_prompt = ChatPromptTemplate.from_messages(messages=[message])
+        return chat_prompt.format_prompt(
+            user_message=user_message,
+            format_instructions=parser.get_format_instructions(),
+        ).to_messages()
+
+
+async def run(service: GeneralAIService, requests: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            await service.process_query_request(user_message=f"question number {i}")
+
+    start = time.process_time()
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    return (time.process_time() - start) / requests
+
+
+async def main(requests: int, concurrency: int) -> None:
+    ai_client = AIClient(openai_client=FakeLLMClient())
+    services = {
+        "rebuild_per_request": RebuildPerRequestService(llm=ai_client),
+        "compiled_once": GeneralAIService(llm=ai_client),
+    }
+
+    # warm up imports and pydantic schema caches before measuring
+    for service in services.values():
+        await run(service, requests=50, concurrency=concurrency)
+
+    for name, service in services.items():
+        cpu_per_request = await run(service, requests, concurrency)
+        print(f"{name:<22} {cpu_per_request * 1e6:10.1f} us cpu/request")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--requests", type=int, default=2000)
+    arg_parser.add_argument("--concurrency", type=int, default=100)
+    args = arg_parser.parse_args()
+    asyncio.run(main(requests=args.requests, concurrency=args.concurrency))
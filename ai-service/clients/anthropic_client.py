@@ -1,10 +1,13 @@
 from langchain_anthropic import ChatAnthropic
+from langchain_core.messages import SystemMessage
 from api.config import settings
 from utils.logging import logger
 
 """
 Class that will configure and hold the Anthropic/Claude connection.
 Contains a method to return the configured ChatAnthropic instance.
+Static system prompts are marked with a cache_control breakpoint so Anthropic
+caches the tools + system prefix across requests and agent steps.
 """
 
 
@@ -31,3 +34,14 @@ class AnthropicClient:
 
     def get_client(self) -> ChatAnthropic:
         return self.client
+
+    def get_system_message(self, content: str) -> SystemMessage:
+        return SystemMessage(
+            content=[
+                {
+                    "type": "text",
+                    "text": content,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ]
+        )
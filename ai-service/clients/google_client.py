@@ -1,10 +1,13 @@
 from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.messages import SystemMessage
 from api.config import settings
 from utils.logging import logger
 
 """
 Class that will configure and hold the Google connection.
 Contains a method to return the configured Google instance.
+Gemini applies implicit caching to repeated prompt prefixes,
+static system prompts only need to stay first and unchanged.
 """
 
 
@@ -31,3 +34,6 @@ class GoogleClient:
 
     def get_client(self) -> ChatGoogleGenerativeAI:
         return self.client
+
+    def get_system_message(self, content: str) -> SystemMessage:
+        return SystemMessage(content=content)
@@ -1,10 +1,13 @@
 from langchain_openai import ChatOpenAI
+from langchain_core.messages import SystemMessage
 from api.config import settings
 from utils.logging import logger
 
 """
 Class that will configure and hold the OpenAI connection.
 Contains a method to return the configured ChatOpenAI instance.
+OpenAI caches identical prompt prefixes (over 1024 tokens) automatically,
+static system prompts only need to stay first and unchanged.
 """
 
 
@@ -30,3 +33,6 @@ class OpenAIClient:
 
     def get_client(self) -> ChatOpenAI:
         return self.client
+
+    def get_system_message(self, content: str) -> SystemMessage:
+        return SystemMessage(content=content)
@@ -4,3 +4,6 @@ You have just been asked the following question, answer it to the best of your a
 {user_message}
 {format_instructions}
 """
+
+# bump whenever QUERY_PROMPT changes, cached responses are keyed on it
+QUERY_PROMPT_VERSION = "1"
@@ -0,0 +1,244 @@
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Sequence
+from langchain_core.messages import BaseMessage
+from langchain_core.messages.ai import UsageMetadata
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+from services.models.admission_models import AdmissionStats, ProviderLimits
+from utils.logging import logger
+import asyncio
+import math
+import time
+
+"""
+AdmissionController: client side pacing of llm calls, per provider.
+Every provider gets a token bucket for requests per minute, one for tokens per
+minute and a cap on concurrent in-flight calls. A call queues until it fits and is
+shed with AdmissionRejectedError (429 + Retry-After in the routes) when it would
+wait longer than max_wait_seconds. Token use is estimated from the prompt before
+the call and corrected with the usage the provider reports afterwards.
+Inside an admission scope (one code agent run) only the first call can be shed, the
+later steps of an admitted run wait for capacity: stopping a run halfway would leave
+the sandbox with the changes of its first steps only.
+"""
+
+
+# ~4 characters per token, close enough for pacing, corrected after the call
+def estimate_tokens(messages: Sequence[BaseMessage]) -> int:
+    return sum(len(str(message.content)) for message in messages) // 4 + 1
+
+
+class AdmissionRejectedError(Exception):
+    def __init__(self, provider: str, retry_after: float) -> None:
+        self.provider = provider
+        self.retry_after_seconds = max(1, math.ceil(retry_after))
+        super().__init__(
+            f"{provider} is over its admission limits, retry after {self.retry_after_seconds}s"
+        )
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int) -> None:
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.available = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(
+            self.capacity, self.available + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        self._refill()
+        # a single call larger than the bucket only has to wait for a full bucket
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.available) / self.rate)
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.available -= min(amount, self.capacity)
+
+    # can go negative, the debt delays the next calls
+    def adjust(self, amount: float) -> None:
+        self._refill()
+        self.available -= amount
+
+
+class ProviderAdmission:
+    def __init__(self, provider: str, limits: ProviderLimits) -> None:
+        self.provider = provider
+        self.requests = (
+            TokenBucket(limits.requests_per_minute)
+            if limits.requests_per_minute
+            else None
+        )
+        self.tokens = (
+            TokenBucket(limits.tokens_per_minute) if limits.tokens_per_minute else None
+        )
+        self.slots = (
+            asyncio.Semaphore(limits.max_concurrency)
+            if limits.max_concurrency
+            else None
+        )
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def stats(self) -> AdmissionStats:
+        return AdmissionStats(
+            provider=self.provider,
+            in_flight=self.in_flight,
+            waiting=self.waiting,
+            admitted=self.admitted,
+            rejected=self.rejected,
+            available_requests=self.requests.available if self.requests else None,
+            available_tokens=self.tokens.available if self.tokens else None,
+        )
+
+
+class AdmissionTicket:
+    def __init__(self, tokens: Optional[TokenBucket], estimated_tokens: int) -> None:
+        self.tokens = tokens
+        self.estimated_tokens = estimated_tokens
+
+    def record_usage(self, usage: Optional[UsageMetadata]) -> None:
+        if self.tokens and usage:
+            self.tokens.adjust(usage["total_tokens"] - self.estimated_tokens)
+
+
+# one multi-call unit of work (a code agent run), admitted once its first call was
+class AdmissionScope:
+    def __init__(self) -> None:
+        self.admitted = False
+
+
+_current_scope: ContextVar[Optional[AdmissionScope]] = ContextVar(
+    "admission_scope", default=None
+)
+
+
+@contextmanager
+def admission_scope() -> Iterator[AdmissionScope]:
+    scope = AdmissionScope()
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+
+
+class AdmissionController:
+    def __init__(
+        self, limits: Dict[str, ProviderLimits], max_wait_seconds: float
+    ) -> None:
+        self.providers = {
+            provider: ProviderAdmission(provider, provider_limits)
+            for provider, provider_limits in limits.items()
+        }
+        self.max_wait_seconds = max_wait_seconds
+
+    def stats(self) -> List[AdmissionStats]:
+        return [state.stats() for state in self.providers.values()]
+
+    # shed=False waits as long as it takes instead of raising AdmissionRejectedError
+    @asynccontextmanager
+    async def admit(
+        self, provider: str, estimated_tokens: int, shed: bool = True
+    ) -> AsyncIterator[AdmissionTicket]:
+        state = self.providers.get(provider)
+        if state is None:
+            yield AdmissionTicket(None, estimated_tokens)
+            return
+
+        deadline = time.monotonic() + self.max_wait_seconds if shed else math.inf
+        state.waiting += 1
+        try:
+            await self._acquire_slot(state, deadline)
+            try:
+                await self._wait_for_rate(state, estimated_tokens, deadline)
+            except BaseException:
+                if state.slots:
+                    state.slots.release()
+                raise
+        finally:
+            state.waiting -= 1
+
+        state.admitted += 1
+        state.in_flight += 1
+        try:
+            yield AdmissionTicket(state.tokens, estimated_tokens)
+        finally:
+            state.in_flight -= 1
+            if state.slots:
+                state.slots.release()
+
+    # llm step for a runnable chain (prompt | gate(llm) | parser), used by the code agent
+    def gate(self, provider: str, llm: Runnable) -> Runnable:
+        async def admitted_llm_call(
+            prompt: PromptValue, config: RunnableConfig
+        ) -> BaseMessage:
+            scope = _current_scope.get()
+            async with self.admit(
+                provider,
+                estimate_tokens(prompt.to_messages()),
+                shed=scope is None or not scope.admitted,
+            ) as ticket:
+                if scope is not None:
+                    scope.admitted = True
+                response = await llm.ainvoke(prompt, config)
+            ticket.record_usage(getattr(response, "usage_metadata", None))
+            return response
+
+        return RunnableLambda(admitted_llm_call, name="llm_admission")
+
+    async def _acquire_slot(self, state: ProviderAdmission, deadline: float) -> None:
+        if state.slots is None:
+            return
+        if deadline == math.inf:
+            await state.slots.acquire()
+            return
+        try:
+            await asyncio.wait_for(
+                state.slots.acquire(), timeout=max(deadline - time.monotonic(), 0.001)
+            )
+        except asyncio.TimeoutError:
+            raise self._reject(state, "concurrency", self.max_wait_seconds)
+
+    async def _wait_for_rate(
+        self, state: ProviderAdmission, estimated_tokens: int, deadline: float
+    ) -> None:
+        while True:
+            wait = max(
+                state.requests.wait_time(1) if state.requests else 0.0,
+                state.tokens.wait_time(estimated_tokens) if state.tokens else 0.0,
+            )
+            if wait == 0:
+                if state.requests:
+                    state.requests.take(1)
+                if state.tokens:
+                    state.tokens.take(estimated_tokens)
+                return
+
+            if time.monotonic() + wait > deadline:
+                raise self._reject(state, "rate", wait)
+            await asyncio.sleep(wait)
+
+    def _reject(
+        self, state: ProviderAdmission, limit: str, retry_after: float
+    ) -> AdmissionRejectedError:
+        state.rejected += 1
+        logger.warning(
+            "llm_admission_rejected",
+            provider=state.provider,
+            limit=limit,
+            in_flight=state.in_flight,
+            waiting=state.waiting,
+            retry_after_seconds=round(retry_after, 2),
+        )
+        return AdmissionRejectedError(state.provider, retry_after)
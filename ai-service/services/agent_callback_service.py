@@ -1,74 +1,154 @@
-from langchain.callbacks.base import BaseCallbackHandler
-from typing import Dict, Any, List
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import LLMResult
+from typing import Dict, Any, List, Optional
+from uuid import UUID
 from services.models.callback_models import CodeAgentCallBackResult
+from services.models.ai_models import AIStreamEvent
+from services.admission_controller import estimate_tokens
+from services.usage_callback_service import UsageCallBack
 from utils.logging import logger
+import asyncio
 
 """
 When a coding agent uses tools to update files or execute commands,
 we want to store those inputs (specifically after a sucessful tool use)
 this way we know what files changed without relying on the AI to remeber 
 what action(s) it took. This call back object is made per code request
+When an event queue is given, tool start/end events are also pushed to it
+so a streaming route can forward them to the caller as they happen.
+apply_sandbox_patch only sends diffs, its post-patch content comes in a custom event.
+Token usage and llm / tool timing come from UsageCallBack. The prompt of the llm
+step still in flight is estimated, so a cancelled run can report what it wasted.
+Tool calls of one agent step run concurrently (CodeAgentExecutor), so pending
+inputs are kept per tool run (run_id) and only that run's end can promote them.
 """
 
 
-class CodeAgentCallBack(BaseCallbackHandler):
-    def __init__(self) -> None:
+# tools report failures in their output instead of raising, always at its start:
+# a file or log that merely mentions "error" is a success
+FAILURE_PREFIXES = ("failed to ", "Command failed with exit code", "Command timed out")
+
+
+def tool_succeeded(output: Any) -> bool:
+    return not str(output).startswith(FAILURE_PREFIXES)
+
+
+class CodeAgentCallBack(UsageCallBack):
+    # run on the event loop thread so pushing to the asyncio queue is safe
+    run_inline = True
+
+    def __init__(
+        self,
+        provider: str,
+        model: str,
+        event_queue: Optional[asyncio.Queue] = None,
+    ) -> None:
+        super().__init__(provider=provider, model=model)
+        self.event_queue = event_queue
         self.updated_files: Dict[str, str] = {}
         self.commands_executed: List[str] = []
 
-        # store agent tool inputs in pending, if tool was successful then return outputs to user
-        self.pending_files: Dict[str, str] = {}
-        self.pending_commands: List[str] = []
+        # store agent tool inputs in pending per tool run, if tool was successful then return outputs to user
+        self.pending_tools: Dict[UUID, str] = {}
+        self.pending_files: Dict[UUID, Dict[str, str]] = {}
+        self.pending_commands: Dict[UUID, str] = {}
+
+        # prompt of the llm step in flight, estimated
+        self.in_flight_prompt_tokens = 0
+
+    def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],
+        messages: List[List[BaseMessage]],
+        *,
+        run_id: UUID,
+        **kwargs: Any,
+    ) -> None:
+        super().on_chat_model_start(serialized, messages, run_id=run_id, **kwargs)
+        self.in_flight_prompt_tokens = sum(
+            estimate_tokens(prompt) for prompt in messages
+        )
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        super().on_llm_end(response, run_id=run_id, **kwargs)
+        self.in_flight_prompt_tokens = 0
 
     def on_tool_start(
         self,
         serialized: dict[str, Any],
         input_str: str,
         *,
+        run_id: UUID,
         inputs: dict[str, Any],
         **kwargs,
     ) -> None:
-        logger.debug("agent_tool_started", inputs=inputs)
+        super().on_tool_start(serialized, input_str, run_id=run_id, **kwargs)
+        tool_name = serialized.get("name", "")
+        logger.debug("agent_tool_started", tool_name=tool_name, inputs=inputs)
+        self._emit("tool_start", tool=tool_name, inputs=inputs)
 
+        self.pending_tools[run_id] = tool_name
         if not inputs:
             return
         if "write_data" in inputs:
-            self._capture_file_writes(inputs)
+            self._capture_file_writes(run_id, inputs)
         elif "command" in inputs:
-            self._capture_command(inputs)
+            self._capture_command(run_id, inputs)
 
-    def on_tool_end(self, output: str, **kwargs: Any) -> None:
-        tool_name = kwargs.get("name", "")
-        success = "failed to" not in output and "error" not in output
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        super().on_tool_end(output, run_id=run_id, **kwargs)
+        tool_name = self.pending_tools.pop(run_id, kwargs.get("name", ""))
+        success = tool_succeeded(output)
         if not success:
             logger.warning(
-                "agent_tool_failed", tool_name=tool_name, output_preview=output[:100]
+                "agent_tool_failed",
+                tool_name=tool_name,
+                output_preview=str(output)[:100],
             )
         else:
             logger.debug("agent_tool_completed", tool_name=tool_name, success=True)
+        self._emit("tool_end", tool=tool_name, success=success)
 
-        if tool_name == "write_sandbox_files" or tool_name == "execute_sandbox_command":
-            # Move pending to final on success
-            if "failed to" not in output and "error" not in output:
-                self.updated_files.update(self.pending_files)
-                self.commands_executed.extend(self.pending_commands)
+        # Move this run's pending to final on success, other runs may still be in flight
+        files = self.pending_files.pop(run_id, {})
+        command = self.pending_commands.pop(run_id, None)
+        if success:
+            self.updated_files.update(files)
+            if command:
+                self.commands_executed.append(command)
 
-        # Clear pending regardless
-        self.pending_files.clear()
-        self.pending_commands.clear()
+    def on_tool_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        super().on_tool_error(error, run_id=run_id, **kwargs)
+        tool_name = self.pending_tools.pop(run_id, "")
+        logger.warning(
+            "agent_tool_failed", tool_name=tool_name, output_preview=str(error)[:100]
+        )
+        self._emit("tool_end", tool=tool_name, success=False)
+        self.pending_files.pop(run_id, None)
+        self.pending_commands.pop(run_id, None)
 
-    def _capture_file_writes(self, inputs: Dict[str, Any]) -> None:
+    # patched files arrive with their post-patch content, they are already written
+    def on_custom_event(self, name: str, data: Any, **kwargs: Any) -> None:
+        if name == "sandbox_files_patched":
+            self.updated_files.update(data["files"])
+
+    def _capture_file_writes(self, run_id: UUID, inputs: Dict[str, Any]) -> None:
         write_data = inputs.get(
             "write_data", []
         )  # write data is the input name of write_sandbox_tool param
 
-        for file in write_data:
-            self.pending_files[file["path"]] = file["data"]
+        self.pending_files[run_id] = {file["path"]: file["data"] for file in write_data}
 
-    def _capture_command(self, inputs: Dict[str, Any]) -> None:
+    def _capture_command(self, run_id: UUID, inputs: Dict[str, Any]) -> None:
         command = inputs.get("command", "")
         if command:
-            self.pending_commands.append(command)
+            self.pending_commands[run_id] = command
+
+    def _emit(self, event: str, **data: Any) -> None:
+        if self.event_queue is not None:
+            self.event_queue.put_nowait(AIStreamEvent(event=event, data=data))
 
     def get_result(self) -> CodeAgentCallBackResult:
         logger.debug(
@@ -78,5 +158,10 @@ class CodeAgentCallBack(BaseCallbackHandler):
         )
 
         return CodeAgentCallBackResult(
-            updated_files=self.updated_files, commands_executed=self.commands_executed
+            updated_files=self.updated_files,
+            commands_executed=self.commands_executed,
+            input_tokens=self.input_tokens,
+            output_tokens=self.output_tokens,
+            cache_read_tokens=self.cache_read_tokens,
+            cache_creation_tokens=self.cache_creation_tokens,
         )
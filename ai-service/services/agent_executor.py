@@ -0,0 +1,382 @@
+from langchain.agents import AgentExecutor
+from langchain.agents.output_parsers.tools import ToolAgentAction
+from langchain_core.agents import AgentAction, AgentFinish, AgentStep
+from langchain_core.callbacks import AsyncCallbackManagerForChainRun
+from opentelemetry import context, trace
+from pydantic import Field, PrivateAttr
+from services.agent_callback_service import tool_succeeded
+from services.models.ai_models import CodeAgentBudget
+from services.sandbox_manifest import normalize_path
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    FrozenSet,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+from utils.logging import logger
+from utils.tracing import set_span_error, tracer
+import asyncio
+import json
+import time
+import weakref
+
+"""
+CodeAgentExecutor: the AgentExecutor of the code agent. The tool calls of one model
+turn run concurrently (as in LangChain) but a call waits for the earlier calls it
+conflicts with, so a read never runs before the write it depends on. Every run is
+held to a CodeAgentBudget, its state lives in a context variable (run()).
+"""
+
+ALL_PATHS = "*"
+
+READ = "read"
+WRITE = "write"
+INDEPENDENT = "independent"
+
+# tools missing here (commands included) are treated as writing every path
+INDEPENDENT_TOOLS = {"lookup_ui_components"}
+LIST_TOOLS = {"list_sandbox_files", "search_sandbox"}
+
+# read-only tools, the only ones a repeated call can be answered from the memo for
+MEMOIZED_TOOLS = {"read_sandbox_file", *LIST_TOOLS, *INDEPENDENT_TOOLS}
+
+
+# reads and listings run together, writes to one path keep their order, commands may
+# touch anything and wait for (and hold back) every other call, lookups never wait
+class ToolAccess:
+    def __init__(self, mode: str, paths: FrozenSet[str]) -> None:
+        self.mode = mode
+        self.paths = paths
+
+    def conflicts_with(self, other: "ToolAccess") -> bool:
+        if INDEPENDENT in (self.mode, other.mode):
+            return False
+        if self.mode == READ and other.mode == READ:
+            return False
+        if ALL_PATHS in self.paths or ALL_PATHS in other.paths:
+            return True
+        return not self.paths.isdisjoint(other.paths)
+
+
+def tool_access(tool: str, tool_input: Any) -> ToolAccess:
+    args = tool_input if isinstance(tool_input, dict) else {}
+    if tool in INDEPENDENT_TOOLS:
+        return ToolAccess(INDEPENDENT, frozenset())
+    if tool in LIST_TOOLS:
+        return ToolAccess(READ, frozenset({ALL_PATHS}))
+    try:
+        if tool == "read_sandbox_file":
+            return ToolAccess(READ, frozenset({normalize_path(args["path"])}))
+        if tool == "write_sandbox_files":
+            entries = args["write_data"]
+        elif tool == "apply_sandbox_patch":
+            entries = args["patches"]
+        else:
+            entries = None
+        if entries is not None:
+            return ToolAccess(
+                WRITE, frozenset(normalize_path(entry["path"]) for entry in entries)
+            )
+    except (KeyError, TypeError):
+        pass  # malformed input, the tool itself reports it, keep it ordered meanwhile
+    return ToolAccess(WRITE, frozenset({ALL_PATHS}))
+
+
+DUPLICATE_NOTE = "(identical to an earlier call of this run and nothing it depends on changed since, this is the earlier result, do not repeat the call)"
+
+
+class MemoEntry:
+    def __init__(self, access: ToolAccess, observation: Any) -> None:
+        self.access = access
+        self.observation = observation
+
+
+# state of one agent run, created per request by CodeAgentExecutor.run()
+class AgentRun:
+    def __init__(self) -> None:
+        self.started_at = time.monotonic()
+        self.tokens = 0
+        self.duplicate_calls = 0
+        self.stop_reason: Optional[str] = None
+        self.memo: Dict[str, MemoEntry] = {}
+        self._counted_messages: Set[int] = set()
+
+    # every tool call of a turn carries the same model message, count it once
+    def count_usage(self, agent_action: AgentAction) -> None:
+        if (
+            not isinstance(agent_action, ToolAgentAction)
+            or not agent_action.message_log
+        ):
+            return
+        message = agent_action.message_log[-1]
+        if id(message) in self._counted_messages:
+            return
+        self._counted_messages.add(id(message))
+        usage = getattr(message, "usage_metadata", None) or {}
+        self.tokens += usage.get("total_tokens", 0)
+
+    def stop(self, reason: str) -> None:
+        if self.stop_reason is None:
+            self.stop_reason = reason
+
+    # a finished call drops the memo entries it may have changed, read-only calls
+    # are kept for the next identical one. writes and commands are never answered
+    # from the memo, a rerun build or curl must see the new state
+    def remember(
+        self, tool: str, key: str, access: ToolAccess, observation: Any
+    ) -> None:
+        if access.mode == WRITE:
+            self.memo = {
+                memo_key: entry
+                for memo_key, entry in self.memo.items()
+                if not access.conflicts_with(entry.access)
+            }
+        if tool in MEMOIZED_TOOLS and tool_succeeded(observation):
+            self.memo[key] = MemoEntry(access, observation)
+
+
+_current_run: ContextVar[Optional[AgentRun]] = ContextVar(
+    "code_agent_run", default=None
+)
+
+
+def call_key(agent_action: AgentAction) -> str:
+    return f"{agent_action.tool}:{json.dumps(agent_action.tool_input, sort_keys=True, default=str)}"
+
+
+# the tool calls of one model turn, each done event is set once that call finished
+class ToolCallBatch:
+    def __init__(self, tool_calls: List[Dict[str, Any]]) -> None:
+        self.call_ids = [tool_call.get("id") for tool_call in tool_calls]
+        self.accesses = [
+            tool_access(tool_call.get("name", ""), tool_call.get("args"))
+            for tool_call in tool_calls
+        ]
+        self.done = [asyncio.Event() for _ in tool_calls]
+        self.remaining = len(tool_calls)
+
+    def index_of(self, call_id: str) -> Optional[int]:
+        return self.call_ids.index(call_id) if call_id in self.call_ids else None
+
+    def conflicting(self, index: int) -> List[int]:
+        access = self.accesses[index]
+        return [
+            earlier
+            for earlier in range(index)
+            if access.conflicts_with(self.accesses[earlier])
+        ]
+
+    # True once every call of the batch finished
+    def finish(self, index: int) -> bool:
+        self.done[index].set()
+        self.remaining -= 1
+        return self.remaining == 0
+
+
+class CodeAgentExecutor(AgentExecutor):
+    # steps and wall clock are enforced through max_iterations and max_execution_time
+    budget: CodeAgentBudget = Field(default_factory=CodeAgentBudget)
+
+    # keyed by id() of the model message the calls came from (weakly referenced)
+    _batches: Dict[int, Tuple[weakref.ref, ToolCallBatch]] = PrivateAttr(
+        default_factory=dict
+    )
+
+    async def _aperform_agent_action(
+        self,
+        name_to_tool_map: Dict[str, Any],
+        color_mapping: Dict[str, str],
+        agent_action: AgentAction,
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> AgentStep:
+        batch, index = self._batch_for(agent_action)
+        if batch is None:
+            return await self._perform_or_recall(
+                name_to_tool_map, color_mapping, agent_action, run_manager
+            )
+
+        try:
+            waiting_for = batch.conflicting(index)
+            if waiting_for:
+                logger.debug(
+                    "agent_tool_call_waiting",
+                    tool_name=agent_action.tool,
+                    position=index,
+                    waiting_for=waiting_for,
+                )
+            for earlier in waiting_for:
+                await batch.done[earlier].wait()
+            return await self._perform_or_recall(
+                name_to_tool_map, color_mapping, agent_action, run_manager
+            )
+        finally:
+            if batch.finish(index):
+                self._batches.pop(id(agent_action.message_log[-1]), None)
+
+    async def _perform_or_recall(
+        self,
+        name_to_tool_map: Dict[str, Any],
+        color_mapping: Dict[str, str],
+        agent_action: AgentAction,
+        run_manager: Optional[AsyncCallbackManagerForChainRun],
+    ) -> AgentStep:
+        run = _current_run.get()
+        if run is None:
+            return await super()._aperform_agent_action(
+                name_to_tool_map, color_mapping, agent_action, run_manager
+            )
+
+        run.count_usage(agent_action)
+        key = call_key(agent_action)
+        entry = run.memo.get(key)
+        if entry is not None:
+            run.duplicate_calls += 1
+            logger.info(
+                "agent_tool_call_deduplicated",
+                tool_name=agent_action.tool,
+                duplicate_calls=run.duplicate_calls,
+            )
+            max_duplicates = self.budget.max_duplicate_calls
+            if max_duplicates is not None and run.duplicate_calls >= max_duplicates:
+                run.stop("max_duplicate_calls")
+            return AgentStep(
+                action=agent_action,
+                observation=f"{DUPLICATE_NOTE}\n{entry.observation}",
+            )
+
+        step = await super()._aperform_agent_action(
+            name_to_tool_map, color_mapping, agent_action, run_manager
+        )
+        run.remember(
+            agent_action.tool,
+            key,
+            tool_access(agent_action.tool, agent_action.tool_input),
+            step.observation,
+        )
+        return step
+
+    # both ainvoke and the astream_events iterator take their steps through here
+    async def _aiter_next_step(
+        self,
+        name_to_tool_map: Dict[str, Any],
+        color_mapping: Dict[str, str],
+        inputs: Dict[str, str],
+        intermediate_steps: List[Tuple[AgentAction, str]],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> AsyncIterator[Union[AgentFinish, AgentAction, AgentStep]]:
+        span = tracer.start_span(
+            "agent_step",
+            attributes={"agent.intermediate_steps": len(intermediate_steps)},
+        )
+        steps = super()._aiter_next_step(
+            name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager
+        )
+        tool_calls = 0
+        try:
+            while True:
+                # current only while the step runs, never across our own yield
+                token = context.attach(trace.set_span_in_context(span))
+                try:
+                    item = await steps.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    context.detach(token)
+                if isinstance(item, AgentStep):
+                    tool_calls += 1
+                elif isinstance(item, AgentFinish):
+                    span.set_attribute("agent.finished", True)
+                yield item
+        except Exception as e:
+            set_span_error(span, e)
+            raise
+        finally:
+            await steps.aclose()
+            span.set_attribute("agent.tool_calls", tool_calls)
+            span.end()
+
+    def _should_continue(self, iterations: int, time_elapsed: float) -> bool:
+        run = _current_run.get()
+        if run is None:
+            return super()._should_continue(iterations, time_elapsed)
+
+        if self.max_iterations is not None and iterations >= self.max_iterations:
+            run.stop("max_steps")
+        elif (
+            self.max_execution_time is not None
+            and time_elapsed >= self.max_execution_time
+        ):
+            run.stop("max_run_seconds")
+        elif (
+            self.budget.max_tokens is not None and run.tokens >= self.budget.max_tokens
+        ):
+            run.stop("max_tokens")
+        return run.stop_reason is None
+
+    # budgets, memo and span of one request, wrap each ainvoke / astream_events call.
+    # a run past a budget ends early with AgentRun.stop_reason, traced as a
+    # code_agent_run span with one agent_step span per iteration
+    @contextmanager
+    def run(self, **attributes: Any) -> Iterator[AgentRun]:
+        run = AgentRun()
+        token = _current_run.set(run)
+        with tracer.start_as_current_span(
+            "code_agent_run",
+            attributes=attributes,
+            record_exception=False,
+            set_status_on_exception=False,
+        ) as span:
+            try:
+                yield run
+            except Exception as e:
+                set_span_error(span, e)
+                raise
+            finally:
+                _current_run.reset(token)
+                # the wall clock limit also cuts a step short, that path skips _should_continue
+                if (
+                    run.stop_reason is None
+                    and self.max_execution_time is not None
+                    and time.monotonic() - run.started_at >= self.max_execution_time
+                ):
+                    run.stop("max_run_seconds")
+                span.set_attribute("agent.tokens", run.tokens)
+                span.set_attribute("agent.duplicate_calls", run.duplicate_calls)
+                if run.stop_reason:
+                    span.set_attribute("agent.stop_reason", run.stop_reason)
+
+    # None for a single call, or when the call cannot be matched to its model turn
+    def _batch_for(
+        self, agent_action: AgentAction
+    ) -> Tuple[Optional[ToolCallBatch], int]:
+        if (
+            not isinstance(agent_action, ToolAgentAction)
+            or not agent_action.message_log
+        ):
+            return None, 0
+        message = agent_action.message_log[-1]
+        tool_calls = getattr(message, "tool_calls", None) or []
+        if len(tool_calls) < 2:
+            return None, 0
+
+        entry = self._batches.get(id(message))
+        if entry is None or entry[0]() is not message:
+            # batches of cancelled runs never finish, drop them with their message
+            for key, (message_ref, _) in list(self._batches.items()):
+                if message_ref() is None:
+                    del self._batches[key]
+            entry = (weakref.ref(message), ToolCallBatch(tool_calls))
+            self._batches[id(message)] = entry
+        batch = entry[1]
+        index = batch.index_of(agent_action.tool_call_id)
+        if index is None:
+            return None, 0
+        return batch, index
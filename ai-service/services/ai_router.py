@@ -0,0 +1,398 @@
+from collections import deque
+from langchain_core.callbacks import BaseCallbackHandler
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+from uuid import UUID
+from services.ai_services import CodeAgentService, GeneralAIService
+from services.admission_controller import AdmissionRejectedError
+from services.models.ai_models import (
+    AIStreamEvent,
+    CodeAgentData,
+    LLMQueryData,
+    ProviderHealthStats,
+)
+from utils.logging import logger
+import asyncio
+import httpx
+import time
+
+"""
+AIRouter: picks which provider serves a query or code request.
+A named provider is pinned, "auto" ranks the configured providers by health
+(recent latency weighted by recent error rate, failing providers cool down)
+and fails over to the next one on 5xx, 429, timeouts and connection errors
+(or when the local admission controller sheds the call).
+Auto queries can also be hedged: once the best provider takes longer than its
+own latency percentile, the second provider is started and the first success wins.
+Query and code requests are scored separately, their latencies differ by minutes.
+A provider that has only failed so far scores as if it took the whole timeout, it is
+not preferred once its cooldown ends.
+A code request only fails over while its agent has not started any tool: after
+that the sandbox may already be changed and replaying the task elsewhere would
+apply it twice (streams stop failing over at their first event the same way).
+"""
+
+AUTO_PROVIDER = "auto"
+
+
+class ProviderNotConfiguredError(Exception):
+    pass
+
+
+def is_failover_error(e: BaseException) -> bool:
+    if isinstance(
+        e,
+        (
+            asyncio.TimeoutError,
+            httpx.TimeoutException,
+            httpx.NetworkError,
+            AdmissionRejectedError,
+        ),
+    ):
+        return True
+
+    # openai / anthropic expose status_code, google api errors expose code
+    status = getattr(e, "status_code", None) or getattr(e, "code", None)
+    if isinstance(status, int) and (status >= 500 or status == 429):
+        return True
+
+    error_type = type(e).__name__
+    return any(name in error_type for name in ("Timeout", "Connection", "Unavailable"))
+
+
+# tells whether a code agent attempt started a tool, run inline on the event loop
+class ToolActivityCallBack(BaseCallbackHandler):
+    run_inline = True
+
+    def __init__(self) -> None:
+        self.tools_started = 0
+
+    def on_tool_start(
+        self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self.tools_started += 1
+
+
+class ProviderHealth:
+    def __init__(
+        self, provider: str, cooldown_seconds: float, failure_penalty_seconds: float
+    ) -> None:
+        self.provider = provider
+        self.cooldown_seconds = cooldown_seconds
+        self.failure_penalty_seconds = failure_penalty_seconds
+
+        self.latency_ewma = 0.0
+        self.error_rate_ewma = 0.0
+        self.latencies: Deque[float] = deque(maxlen=200)
+        self.cooldown_until = 0.0
+        self.successes = 0
+        self.failures = 0
+
+    def record_success(self, latency: float) -> None:
+        self.successes += 1
+        self.latencies.append(latency)
+        self.latency_ewma = (
+            latency if self.successes == 1 else 0.8 * self.latency_ewma + 0.2 * latency
+        )
+        self.error_rate_ewma *= 0.8
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.error_rate_ewma = 0.8 * self.error_rate_ewma + 0.2
+        self.cooldown_until = time.monotonic() + self.cooldown_seconds
+
+    def score(self) -> float:
+        # lower is better, providers without samples score 0 so they get tried,
+        # providers that only failed get the penalty as their latency
+        latency = self.latency_ewma
+        if self.successes == 0 and self.failures:
+            latency = self.failure_penalty_seconds
+        return latency * (1 + 4 * self.error_rate_ewma)
+
+    def cooling_down(self) -> bool:
+        return time.monotonic() < self.cooldown_until
+
+    def latency_percentile(
+        self, percentile: float, min_samples: int
+    ) -> Optional[float]:
+        if len(self.latencies) < min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(len(ordered) * percentile), len(ordered) - 1)]
+
+    def stats(self, kind: str) -> ProviderHealthStats:
+        return ProviderHealthStats(
+            provider=self.provider,
+            kind=kind,
+            score=self.score(),
+            latency_ewma=self.latency_ewma,
+            error_rate_ewma=self.error_rate_ewma,
+            cooling_down=self.cooling_down(),
+            successes=self.successes,
+            failures=self.failures,
+        )
+
+
+class AIRouter:
+    def __init__(
+        self,
+        query_services: Dict[str, GeneralAIService],
+        code_services: Dict[str, CodeAgentService],
+        query_timeout_seconds: float,
+        code_timeout_seconds: float,
+        hedge_enabled: bool,
+        hedge_percentile: float,
+        hedge_min_samples: int,
+        failure_cooldown_seconds: float,
+    ) -> None:
+        self.query_services = query_services
+        self.code_services = code_services
+        self.query_timeout_seconds = query_timeout_seconds
+        self.code_timeout_seconds = code_timeout_seconds
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+
+        self.health: Dict[str, Dict[str, ProviderHealth]] = {
+            kind: {
+                provider: ProviderHealth(
+                    provider, failure_cooldown_seconds, timeout_seconds
+                )
+                for provider in services
+            }
+            for kind, services, timeout_seconds in (
+                ("query", query_services, query_timeout_seconds),
+                ("code", code_services, code_timeout_seconds),
+            )
+        }
+
+    def stats(self) -> List[ProviderHealthStats]:
+        return [
+            health.stats(kind)
+            for kind, providers in self.health.items()
+            for health in providers.values()
+        ]
+
+    async def process_query_request(
+        self, provider: str, user_message: str, use_cache: bool = True
+    ) -> Tuple[str, LLMQueryData]:
+        def call(name: str) -> Awaitable[LLMQueryData]:
+            return self.query_services[name].process_query_request(
+                user_message=user_message, use_cache=use_cache
+            )
+
+        candidates = self._candidates("query", provider)
+        if provider == AUTO_PROVIDER and self.hedge_enabled and len(candidates) > 1:
+            return await self._hedged(candidates, call)
+        return await self._with_failover("query", candidates, call)
+
+    async def process_code_request(
+        self, provider: str, sandbox_id: str, user_message: str
+    ) -> Tuple[str, CodeAgentData]:
+        activity: Dict[str, ToolActivityCallBack] = {}
+
+        def call(name: str) -> Awaitable[CodeAgentData]:
+            activity[name] = ToolActivityCallBack()
+            return self.code_services[name].process_code_request(
+                sandbox_id=sandbox_id,
+                user_message=user_message,
+                callbacks=[activity[name]],
+            )
+
+        return await self._with_failover(
+            "code",
+            self._candidates("code", provider),
+            call,
+            replayable=lambda name: not activity[name].tools_started,
+        )
+
+    async def stream_query_request(
+        self, provider: str, user_message: str, use_cache: bool = True
+    ) -> AsyncIterator[AIStreamEvent]:
+        async for stream_event in self._stream_with_failover(
+            "query",
+            self._candidates("query", provider),
+            lambda name: self.query_services[name].stream_query_request(
+                user_message=user_message, use_cache=use_cache
+            ),
+        ):
+            yield stream_event
+
+    async def stream_code_request(
+        self, provider: str, sandbox_id: str, user_message: str
+    ) -> AsyncIterator[AIStreamEvent]:
+        async for stream_event in self._stream_with_failover(
+            "code",
+            self._candidates("code", provider),
+            lambda name: self.code_services[name].stream_code_request(
+                sandbox_id=sandbox_id, user_message=user_message
+            ),
+        ):
+            yield stream_event
+
+    # raises ProviderNotConfiguredError up front, for work that starts later
+    def validate_provider(self, kind: str, provider: str) -> None:
+        self._candidates(kind, provider)
+
+    def _candidates(self, kind: str, provider: str) -> List[str]:
+        providers = self.health[kind]
+        if provider != AUTO_PROVIDER:
+            if provider not in providers:
+                raise ProviderNotConfiguredError(
+                    f"provider {provider} is not configured"
+                )
+            return [provider]
+
+        if not providers:
+            raise ProviderNotConfiguredError("no ai provider is configured")
+
+        # healthy providers first, then by score (sorted is stable, config order breaks ties)
+        return sorted(
+            providers,
+            key=lambda name: (providers[name].cooling_down(), providers[name].score()),
+        )
+
+    async def _attempt(
+        self, kind: str, name: str, call: Callable[[str], Awaitable[Any]]
+    ) -> Any:
+        timeout = (
+            self.query_timeout_seconds if kind == "query" else self.code_timeout_seconds
+        )
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(call(name), timeout=timeout)
+        except (asyncio.CancelledError, AdmissionRejectedError):
+            raise  # hedge loser, caller gone or shed locally, says nothing about provider health
+        except Exception:
+            self.health[kind][name].record_failure()
+            raise
+        self.health[kind][name].record_success(time.monotonic() - start)
+        return result
+
+    # replayable tells whether the failed attempt of a provider may be run again elsewhere
+    async def _with_failover(
+        self,
+        kind: str,
+        candidates: List[str],
+        call: Callable[[str], Awaitable[Any]],
+        replayable: Callable[[str], bool] = lambda name: True,
+    ) -> Tuple[str, Any]:
+        for index, name in enumerate(candidates):
+            try:
+                return name, await self._attempt(kind, name, call)
+            except Exception as e:
+                if index == len(candidates) - 1 or not is_failover_error(e):
+                    raise
+                if not replayable(name):
+                    logger.warning(
+                        "ai_router_failover_skipped",
+                        kind=kind,
+                        failed_provider=name,
+                        reason="the failed attempt already used tools",
+                        error_type=type(e).__name__,
+                    )
+                    raise
+                logger.warning(
+                    "ai_router_failover",
+                    kind=kind,
+                    failed_provider=name,
+                    next_provider=candidates[index + 1],
+                    error_type=type(e).__name__,
+                    error=str(e),
+                )
+        raise ProviderNotConfiguredError("no ai provider is configured")
+
+    async def _hedged(
+        self, candidates: List[str], call: Callable[[str], Awaitable[LLMQueryData]]
+    ) -> Tuple[str, LLMQueryData]:
+        primary, backup = candidates[0], candidates[1]
+        hedge_after = self.health["query"][primary].latency_percentile(
+            self.hedge_percentile, self.hedge_min_samples
+        )
+        if hedge_after is None:
+            return await self._with_failover("query", candidates, call)
+
+        tasks: Dict[asyncio.Task, str] = {
+            asyncio.create_task(self._attempt("query", primary, call)): primary
+        }
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                logger.info(
+                    "ai_router_hedged",
+                    primary=primary,
+                    backup=backup,
+                    hedge_after_seconds=round(hedge_after, 3),
+                )
+                tasks[asyncio.create_task(self._attempt("query", backup, call))] = (
+                    backup
+                )
+
+            pending = set(tasks)
+            last_error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return tasks[task], task.result()
+                    last_error = task.exception()
+                    if not is_failover_error(last_error):
+                        raise last_error
+
+            # every started attempt failed, try whoever was not started yet
+            remaining = [name for name in candidates if name not in tasks.values()]
+            if remaining:
+                return await self._with_failover("query", remaining, call)
+            assert last_error is not None
+            raise last_error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _stream_with_failover(
+        self,
+        kind: str,
+        candidates: List[str],
+        stream: Callable[[str], AsyncIterator[AIStreamEvent]],
+    ) -> AsyncIterator[AIStreamEvent]:
+        # fail over only until the first event was sent, after that the caller has partial output
+        for index, name in enumerate(candidates):
+            start = time.monotonic()
+            started = False
+            try:
+                async for stream_event in stream(name):
+                    if not started:
+                        started = True
+                        yield AIStreamEvent(event="provider", data={"provider": name})
+                    yield stream_event
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if not isinstance(e, AdmissionRejectedError):
+                    self.health[kind][name].record_failure()
+                last = index == len(candidates) - 1
+                if started or last or not is_failover_error(e):
+                    raise
+                logger.warning(
+                    "ai_router_failover",
+                    kind=kind,
+                    failed_provider=name,
+                    next_provider=candidates[index + 1],
+                    error_type=type(e).__name__,
+                    error=str(e),
+                )
+                continue
+
+            self.health[kind][name].record_success(time.monotonic() - start)
+            return
@@ -1,40 +1,144 @@
-from langchain.prompts import HumanMessagePromptTemplate, ChatPromptTemplate
+from langchain.prompts import (
+    HumanMessagePromptTemplate,
+    ChatPromptTemplate,
+    MessagesPlaceholder,
+)
 from langchain.output_parsers import PydanticOutputParser
-from langchain.agents import create_tool_calling_agent, AgentExecutor
-from prompts.nextjs_prompt import NEXTJS_PROMPT
-from prompts.query_prompt import QUERY_PROMPT
+from langchain.agents.format_scratchpad.tools import format_to_tool_messages
+from langchain.agents.output_parsers.tools import ToolsAgentOutputParser
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.messages.ai import UsageMetadata, add_usage
+from langchain_core.runnables import RunnablePassthrough
+from prompts.nextjs_prompt import NEXTJS_SYSTEM_PROMPT, NEXTJS_TASK_PROMPT
+from prompts.query_prompt import QUERY_PROMPT, QUERY_PROMPT_VERSION
 from services.models.ai_models import (
     AIClient,
     LLMQueryResult,
     CodeAgentResult,
     CodeAgentData,
+    CodeAgentBudget,
+    LLMQueryData,
+    AIStreamEvent,
 )
+from services.models.usage_models import LLMUsage
 from services.sandbox_service import SandboxService
+from services.sandbox_lock import InMemorySandboxLock, SandboxLock
 from services.agent_callback_service import CodeAgentCallBack
+from services.agent_executor import CodeAgentExecutor
+from services.admission_controller import (
+    AdmissionController,
+    admission_scope,
+    estimate_tokens,
+)
+from api.config import settings
+from services.component_index import ComponentIndexService
+from services.scratchpad_compactor import ScratchpadCompactor
+from services.response_cache import ResponseCache, make_cache_key
+from services.single_flight import SingleFlight
+from services.usage_callback_service import UsageCallBack
+from services.usage_tracker import UsageTracker
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional, Set
 from utils.logging import logger
+from utils.metrics import record_cache_lookup
+import asyncio
 
 """
-Ai Service service (sends requests to llm). 
+Ai Service service (sends requests to llm).
 Can handle coding with tools and will execute them in the sandbox.
 Can handle general queries as well.
+Both can also stream tokens (and tool events for the code agent) as they are generated.
 """
 
 
+# no provider limits, nothing waits or is shed
+def unlimited_admission() -> AdmissionController:
+    return AdmissionController({}, settings.llm_admission_max_wait_seconds)
+
+
+# text of a streamed chunk, anthropic sends a list of content blocks instead of a string
+def chunk_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            block.get("text", "")
+            for block in content
+            if isinstance(block, dict) and block.get("type") == "text"
+        )
+    return ""
+
+
+# every run holds the sandbox lock, is held to a CodeAgentBudget (a run past it returns
+# what it did with the stop reason) and is traced as a code_agent_run span
 class CodeAgentService:
-    def __init__(self, llm: AIClient, sandbox_service: SandboxService) -> None:
+    def __init__(
+        self,
+        llm: AIClient,
+        sandbox_service: SandboxService,
+        admission: Optional[AdmissionController] = None,
+        component_index: Optional[ComponentIndexService] = None,
+        budget: Optional[CodeAgentBudget] = None,
+        scratchpad: Optional[ScratchpadCompactor] = None,
+        usage_tracker: Optional[UsageTracker] = None,
+        sandbox_lock: Optional[SandboxLock] = None,
+        snapshot_after_run: bool = False,
+    ) -> None:
         try:
             self.llm = llm.get_client()
+            self.sandbox_service = sandbox_service
+            self.snapshot_after_run = snapshot_after_run
+            self._snapshot_tasks: Set[asyncio.Task] = set()
+            # the fallbacks are for a single process (benchmarks), the app injects them
+            self.sandbox_lock = sandbox_lock or InMemorySandboxLock(
+                ttl_seconds=settings.code_agent_sandbox_lock_ttl_seconds,
+                poll_interval_seconds=settings.code_agent_sandbox_lock_poll_seconds,
+            )
+            self.provider = llm.get_provider()
+            self.model_name = llm.get_model_name()
+            self.usage_tracker = usage_tracker or UsageTracker()
+            self.budget = budget or CodeAgentBudget()
+            self.admission = admission or unlimited_admission()
             code_agent_tools = sandbox_service.get_tools()
+            if component_index:
+                code_agent_tools = [*code_agent_tools, component_index.get_tool()]
             self.parser = PydanticOutputParser(pydantic_object=CodeAgentResult)
-            prompt = ChatPromptTemplate.from_template(template=NEXTJS_PROMPT)
-            prompt_formatted = prompt.partial(
+
+            # static system prefix first (cacheable by the provider), task and steps after it
+            system_prompt = NEXTJS_SYSTEM_PROMPT.format(
                 format_instructions=self.parser.get_format_instructions()
             )
-            code_agent = create_tool_calling_agent(
-                llm=self.llm, prompt=prompt_formatted, tools=code_agent_tools
+            prompt = ChatPromptTemplate.from_messages(
+                messages=[
+                    llm.get_system_message(system_prompt),
+                    ("human", "{input}"),
+                    MessagesPlaceholder(variable_name="agent_scratchpad"),
+                ]
+            )
+            # create_tool_calling_agent, with the llm step gated by the admission controller
+            code_agent = (
+                RunnablePassthrough.assign(
+                    agent_scratchpad=lambda x: (
+                        scratchpad.format(x["intermediate_steps"])
+                        if scratchpad
+                        else format_to_tool_messages(x["intermediate_steps"])
+                    )
+                )
+                | prompt
+                | self.admission.gate(
+                    llm.get_provider(), self.llm.bind_tools(code_agent_tools)
+                )
+                | ToolsAgentOutputParser()
             )
-            self.agent = AgentExecutor(
-                agent=code_agent, tools=code_agent_tools, verbose=False
+            # tool calls of one step run concurrently, conflicting ones in call order
+            self.agent = CodeAgentExecutor(
+                agent=code_agent,
+                tools=code_agent_tools,
+                verbose=False,
+                budget=self.budget,
+                max_iterations=self.budget.max_steps,
+                max_execution_time=self.budget.max_run_seconds,
+                early_stopping_method="force",
             )
 
         except Exception as e:
@@ -46,80 +150,356 @@ class CodeAgentService:
             )
             raise
 
+    # callbacks: extra langchain callback handlers for this run
     async def process_code_request(
-        self, sandbox_id: str, user_message: str
+        self,
+        sandbox_id: str,
+        user_message: str,
+        callbacks: Optional[List[BaseCallbackHandler]] = None,
     ) -> CodeAgentData:
+        callback = CodeAgentCallBack(provider=self.provider, model=self.model_name)
         try:
-            contextual_input = f"Sandbox ID: {sandbox_id}\nTask: {user_message}"
-            callback = CodeAgentCallBack()
+            contextual_input = NEXTJS_TASK_PROMPT.format(
+                sandbox_id=sandbox_id, user_message=user_message
+            )
 
             logger.debug("calling_llm_agent")
 
-            result = await self.agent.ainvoke(
-                {"input": contextual_input}, config={"callbacks": [callback]}
+            async with self.sandbox_lock.hold(sandbox_id):
+                with self.agent.run(
+                    **self._span_attributes(sandbox_id)
+                ) as run, admission_scope():
+                    result = await self.agent.ainvoke(
+                        {"input": contextual_input},
+                        config={"callbacks": [callback, *(callbacks or [])]},
+                    )
+
+            self._snapshot_later(sandbox_id, callback)
+            return self._build_result(
+                result.get("output", ""), callback, run.stop_reason
+            )
+
+        except asyncio.CancelledError:
+            self._log_cancelled(callback, user_message)
+            raise
+        except Exception as e:
+            logger.error(
+                "code_agent_processing_failed",
+                message_length=len(user_message),
+                error_type=type(e).__name__,
+                error=str(e),
+                exc_info=True,
             )
+            raise
+        finally:
+            self.usage_tracker.record("code", self._usage(callback))
 
-            # Validate output before parsing
-            output = result.get("output", "")
-            if not output:
-                logger.warning("llm_returned_empty_output", using_fallback_summary=True)
+    async def stream_code_request(
+        self, sandbox_id: str, user_message: str
+    ) -> AsyncIterator[AIStreamEvent]:
+        contextual_input = NEXTJS_TASK_PROMPT.format(
+            sandbox_id=sandbox_id, user_message=user_message
+        )
+        events: asyncio.Queue = asyncio.Queue()
+        callback = CodeAgentCallBack(
+            provider=self.provider, model=self.model_name, event_queue=events
+        )
 
-                agent_actions = callback.get_result()
-                code_result = CodeAgentData(
-                    summary="Task completed successfully",
-                    commands=agent_actions.commands_executed,
-                    files=agent_actions.updated_files,
-                )
-            else:
-                logger.debug("parsing_llm_output")
-                parsed_result: CodeAgentResult = self.parser.parse(result["output"])
-                agent_actions = callback.get_result()
-                code_result = CodeAgentData(
-                    summary=parsed_result.summary,
-                    commands=agent_actions.commands_executed,
-                    files=agent_actions.updated_files,
-                )
+        # the agent runs in its own task, tokens and tool events share one queue
+        async def run_agent() -> None:
+            output = ""
+            async with self.sandbox_lock.hold(sandbox_id):
+                with self.agent.run(
+                    **self._span_attributes(sandbox_id)
+                ) as run, admission_scope():
+                    async for event in self.agent.astream_events(
+                        {"input": contextual_input},
+                        config={"callbacks": [callback]},
+                        version="v2",
+                    ):
+                        if event["event"] == "on_chat_model_stream":
+                            token = chunk_text(event["data"]["chunk"].content)
+                            if token:
+                                events.put_nowait(
+                                    AIStreamEvent(event="token", data={"token": token})
+                                )
+                        elif (
+                            event["event"] == "on_chain_end" and not event["parent_ids"]
+                        ):
+                            output = event["data"]["output"].get("output", "")
 
-            return code_result
+            self._snapshot_later(sandbox_id, callback)
+            code_result = self._build_result(output, callback, run.stop_reason)
+            events.put_nowait(
+                AIStreamEvent(event="final", data=code_result.model_dump())
+            )
 
+        logger.debug("streaming_llm_agent")
+        agent_task = asyncio.create_task(run_agent())
+        agent_task.add_done_callback(lambda _: events.put_nowait(None))
+        try:
+            while (stream_event := await events.get()) is not None:
+                yield stream_event
+            await agent_task  # surface agent errors to the caller
         except Exception as e:
             logger.error(
-                "code_agent_processing_failed",
+                "code_agent_streaming_failed",
                 message_length=len(user_message),
                 error_type=type(e).__name__,
                 error=str(e),
                 exc_info=True,
             )
             raise
+        finally:
+            # consumer left (disconnect or deadline) while the agent was still working
+            if not agent_task.done():
+                self._log_cancelled(callback, user_message)
+            agent_task.cancel()
+            self.usage_tracker.record("code", self._usage(callback))
+
+    def _usage(self, callback: UsageCallBack) -> LLMUsage:
+        return self.usage_tracker.price(callback.get_usage())
 
+    # the response does not wait for it, the task takes the sandbox lock itself so it
+    # archives a consistent tree even when the next run already started
+    def _snapshot_later(self, sandbox_id: str, callback: CodeAgentCallBack) -> None:
+        if not self.snapshot_after_run or not (
+            callback.updated_files or callback.commands_executed
+        ):
+            return
+        task = asyncio.create_task(self._snapshot(sandbox_id))
+        self._snapshot_tasks.add(task)
+        task.add_done_callback(self._snapshot_tasks.discard)
 
+    async def _snapshot(self, sandbox_id: str) -> None:
+        try:
+            async with self.sandbox_lock.hold(sandbox_id):
+                await self.sandbox_service.snapshot(sandbox_id=sandbox_id)
+        except Exception as e:
+            logger.warning(
+                "code_agent_snapshot_failed",
+                sandbox_id=sandbox_id,
+                error_type=type(e).__name__,
+                error=str(e),
+            )
+
+    def _span_attributes(self, sandbox_id: str) -> Dict[str, str]:
+        return {
+            "gen_ai.system": self.provider,
+            "gen_ai.request.model": self.model_name,
+            "sandbox.id": sandbox_id,
+        }
+
+    # caller gone or deadline passed, the tokens spent so far were wasted
+    def _log_cancelled(self, callback: CodeAgentCallBack, user_message: str) -> None:
+        logger.warning(
+            "code_agent_cancelled",
+            message_length=len(user_message),
+            llm_steps=callback.llm_steps,
+            commands_executed=len(callback.commands_executed),
+            files_modified=len(callback.updated_files),
+            wasted_input_tokens=callback.input_tokens,
+            wasted_output_tokens=callback.output_tokens,
+            # prompt of the interrupted step, usually billed even though cancelled
+            wasted_in_flight_tokens_estimate=callback.in_flight_prompt_tokens,
+        )
+
+    def _build_result(
+        self,
+        output: str,
+        callback: CodeAgentCallBack,
+        stop_reason: Optional[str] = None,
+    ) -> CodeAgentData:
+        agent_actions = callback.get_result()
+        logger.info(
+            "code_agent_prompt_usage",
+            input_tokens=agent_actions.input_tokens,
+            cache_read_tokens=agent_actions.cache_read_tokens,
+            cache_creation_tokens=agent_actions.cache_creation_tokens,
+        )
+
+        # stopped by a budget, the output is langchain's stop message, not the json result
+        if stop_reason:
+            logger.warning(
+                "code_agent_stopped_early",
+                stop_reason=stop_reason,
+                llm_steps=callback.llm_steps,
+                commands_executed=len(agent_actions.commands_executed),
+                files_modified=len(agent_actions.updated_files),
+            )
+            summary = f"The task was stopped before it was finished ({stop_reason.replace('_', ' ')} reached), the files and commands listed were applied"
+        elif not output:
+            logger.warning("llm_returned_empty_output", using_fallback_summary=True)
+            summary = "Task completed successfully"
+        else:
+            logger.debug("parsing_llm_output")
+            parsed_result: CodeAgentResult = self.parser.parse(output)
+            summary = parsed_result.summary
+
+        return CodeAgentData(
+            summary=summary,
+            commands=agent_actions.commands_executed,
+            files=agent_actions.updated_files,
+            stop_reason=stop_reason,
+            usage=self._usage(callback),
+        )
+
+
+# answers repeated questions from the response cache, identical queries in flight
+# share one llm call
 class GeneralAIService:
-    def __init__(self, llm: AIClient) -> None:
+    def __init__(
+        self,
+        llm: AIClient,
+        response_cache: Optional[ResponseCache] = None,
+        admission: Optional[AdmissionController] = None,
+        usage_tracker: Optional[UsageTracker] = None,
+    ) -> None:
         self.llm = llm.get_client()
+        self.provider = llm.get_provider()
+        self.model_name = llm.get_model_name()
+        self.response_cache = response_cache
+        self.admission = admission or unlimited_admission()
+        self.usage_tracker = usage_tracker or UsageTracker()
+        self.in_flight = SingleFlight("llm_query")
+
+        # compiled once, only user_message is substituted per request
+        self.parser = PydanticOutputParser(pydantic_object=LLMQueryResult)
+        message = HumanMessagePromptTemplate.from_template(template=QUERY_PROMPT)
+        self.prompt = ChatPromptTemplate.from_messages(messages=[message]).partial(
+            format_instructions=self.parser.get_format_instructions()
+        )
 
-    async def process_query_request(self, user_message: str) -> str:
+    async def process_query_request(
+        self, user_message: str, use_cache: bool = True
+    ) -> LLMQueryData:
         try:
-            parser = PydanticOutputParser(pydantic_object=LLMQueryResult)
-            message = HumanMessagePromptTemplate.from_template(template=QUERY_PROMPT)
-            chat_prompt = ChatPromptTemplate.from_messages(messages=[message])
+            cached = await self._get_cached(user_message, use_cache)
+            if cached is not None:
+                return LLMQueryData(content=cached, usage=self._free_usage())
+
+            started = False
 
-            chat_prompt_with_values = chat_prompt.format_prompt(
-                user_message=user_message,
-                format_instructions=parser.get_format_instructions(),
+            def query() -> Awaitable[LLMQueryData]:
+                nonlocal started
+                started = True
+                return self._query_llm(user_message)
+
+            data = await self.in_flight.do(self._cache_key(user_message), query)
+            # callers that joined an in-flight query share its answer, not its cost:
+            # the caller that started it carries the whole usage, the others zero
+            if not started:
+                data = data.model_copy(update={"usage": self._free_usage()})
+            return data
+        except Exception as e:
+            logger.error(
+                "general_query_processing_failed",
+                message_length=len(user_message),
+                error_type=type(e).__name__,
+                error=str(e),
+                exc_info=True,
             )
+            raise
 
-            response = await self.llm.ainvoke(chat_prompt_with_values.to_messages())
+    async def _query_llm(self, user_message: str) -> LLMQueryData:
+        callback = UsageCallBack(provider=self.provider, model=self.model_name)
+        messages = self._build_messages(user_message)
+        try:
+            async with self.admission.admit(
+                self.provider, estimate_tokens(messages)
+            ) as ticket:
+                response = await self.llm.ainvoke(
+                    messages, config={"callbacks": [callback]}
+                )
+            ticket.record_usage(response.usage_metadata)
+        finally:
+            usage = self._usage(callback)
+            self.usage_tracker.record("query", usage)
+
+        content = str(response.content)
+
+        data: LLMQueryResult = self.parser.parse(content)
+        await self._set_cached(user_message, data.response)
+        return LLMQueryData(content=data.response, usage=usage)
+
+    async def stream_query_request(
+        self, user_message: str, use_cache: bool = True
+    ) -> AsyncIterator[AIStreamEvent]:
+        try:
+            cached = await self._get_cached(user_message, use_cache)
+            if cached is not None:
+                final = LLMQueryData(content=cached, usage=self._free_usage())
+                yield AIStreamEvent(event="final", data=final.model_dump())
+                return
 
-            content = str(response.content)
+            content = ""
+            usage: Optional[UsageMetadata] = None
+            callback = UsageCallBack(provider=self.provider, model=self.model_name)
+            messages = self._build_messages(user_message)
+            try:
+                async with self.admission.admit(
+                    self.provider, estimate_tokens(messages)
+                ) as ticket:
+                    async for chunk in self.llm.astream(
+                        messages, config={"callbacks": [callback]}
+                    ):
+                        if chunk.usage_metadata:
+                            usage = add_usage(usage, chunk.usage_metadata)
+                        token = chunk_text(chunk.content)
+                        if token:
+                            content += token
+                            yield AIStreamEvent(event="token", data={"token": token})
+                ticket.record_usage(usage)
+            finally:
+                request_usage = self._usage(callback)
+                self.usage_tracker.record("query", request_usage)
 
-            data: LLMQueryResult = parser.parse(content)
-            return data.response
+            data: LLMQueryResult = self.parser.parse(content)
+            await self._set_cached(user_message, data.response)
+            final = LLMQueryData(content=data.response, usage=request_usage)
+            yield AIStreamEvent(event="final", data=final.model_dump())
         except Exception as e:
             logger.error(
-                "general_query_processing_failed",
+                "general_query_streaming_failed",
                 message_length=len(user_message),
                 error_type=type(e).__name__,
                 error=str(e),
                 exc_info=True,
             )
             raise
+
+    def _usage(self, callback: UsageCallBack) -> LLMUsage:
+        return self.usage_tracker.price(callback.get_usage())
+
+    # usage of an answer that cost no llm call (cache hit or coalesced), still a request:
+    # zero tokens and cost, so summing the usage of every response gives the real spend
+    def _free_usage(self) -> LLMUsage:
+        usage = self.usage_tracker.price(
+            LLMUsage(provider=self.provider, model=self.model_name)
+        )
+        self.usage_tracker.record("query", usage)
+        return usage
+
+    def _build_messages(self, user_message: str) -> List[BaseMessage]:
+        return self.prompt.format_messages(user_message=user_message)
+
+    def _cache_key(self, user_message: str) -> str:
+        return make_cache_key(
+            provider=self.provider,
+            model=self.model_name,
+            prompt_version=QUERY_PROMPT_VERSION,
+            message=user_message,
+        )
+
+    async def _get_cached(self, user_message: str, use_cache: bool) -> Optional[str]:
+        if not self.response_cache or not use_cache:
+            return None
+
+        cached = await self.response_cache.get(self._cache_key(user_message))
+        logger.debug("response_cache_lookup", hit=cached is not None)
+        record_cache_lookup("llm_response", hit=cached is not None)
+        return cached
+
+    async def _set_cached(self, user_message: str, response: str) -> None:
+        if self.response_cache:
+            await self.response_cache.set(self._cache_key(user_message), response)
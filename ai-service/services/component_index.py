@@ -0,0 +1,264 @@
+from e2b_code_interpreter import AsyncSandbox, CommandResult
+from langchain.tools import BaseTool
+from pydantic import BaseModel, Field
+from services.models.component_models import (
+    ComponentApi,
+    ComponentIndex,
+    ComponentIndexStats,
+)
+from api.config import settings
+from typing import Dict, List, Optional, Type
+from utils.component_extractor import extract_component_api
+from utils.logging import logger
+import asyncio
+import os
+import re
+import tempfile
+import time
+
+"""
+ComponentIndexService: the api of the Shadcn components baked into the sandbox
+template (exports, cva variants, props), served to the code agent by a local
+lookup tool so it does not read component sources inside the sandbox.
+The index is a json file next to the template (component_index_path), built once
+per template id: `python -m services.component_index` after `e2b template build`,
+or at startup in the background when the file is missing, older than the
+extractor (INDEX_VERSION) or for another template id.
+"""
+
+INDEX_VERSION = 1
+
+# one command prints every component source, each behind a "==> name <==" header
+SOURCE_COMMAND = "cd /home/user/components/ui && tail -n +1 -- *.tsx"
+FILE_HEADER = re.compile(r"^==> (.+?) <==$", re.MULTILINE)
+
+
+def parse_sources(output: str) -> Dict[str, str]:
+    sources: Dict[str, str] = {}
+    headers = list(FILE_HEADER.finditer(output))
+    for index, header in enumerate(headers):
+        end = headers[index + 1].start() if index + 1 < len(headers) else len(output)
+        sources[header.group(1)] = output[header.end() : end].strip("\n")
+    return sources
+
+
+def format_component(component: ComponentApi) -> str:
+    lines = [
+        f'{component.name} (import from "{component.import_path}"): {", ".join(component.exports)}'
+    ]
+    for cva_name, options in component.variants.items():
+        defaults = component.default_variants.get(cva_name, {})
+        for prop, values in options.items():
+            default = f", default={defaults[prop]}" if prop in defaults else ""
+            lines.append(f"  {prop} ({cva_name}): {' | '.join(values)}{default}")
+    for name, props in component.props.items():
+        if props:
+            lines.append(f"  <{name}> props: {props}")
+    return "\n".join(lines)
+
+
+class ComponentIndexService:
+    def __init__(self, template_id: str, path: str, build_timeout_seconds: int) -> None:
+        self.template_id = template_id
+        self.path = path
+        self.build_timeout_seconds = build_timeout_seconds
+
+        self.index: Optional[ComponentIndex] = None
+        self.lookups = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if not self.template_id:
+            logger.info("component_index_disabled")
+            return
+        self.index = self.load()
+        if self.index is None:
+            self._task = asyncio.create_task(self._rebuild_in_background())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    # None unless the file matches the current template and extractor version
+    def load(self) -> Optional[ComponentIndex]:
+        try:
+            with open(self.path) as file:
+                index = ComponentIndex.model_validate_json(file.read())
+        except FileNotFoundError:
+            logger.info("component_index_missing", path=self.path)
+            return None
+        except Exception as e:
+            logger.warning(
+                "component_index_load_failed",
+                path=self.path,
+                error_type=type(e).__name__,
+                error=str(e),
+            )
+            return None
+
+        if index.version != INDEX_VERSION or index.template_id != self.template_id:
+            logger.info(
+                "component_index_stale",
+                index_template_id=index.template_id,
+                index_version=index.version,
+                template_id=self.template_id,
+                version=INDEX_VERSION,
+            )
+            return None
+        logger.info("component_index_loaded", components=len(index.components))
+        return index
+
+    async def rebuild(self) -> ComponentIndex:
+        start = time.monotonic()
+        sbx = await AsyncSandbox.create(
+            template=self.template_id, timeout=self.build_timeout_seconds
+        )
+        try:
+            result: CommandResult = await sbx.commands.run(
+                cmd=SOURCE_COMMAND, timeout=self.build_timeout_seconds
+            )
+        finally:
+            await sbx.kill()
+
+        components = {
+            component.name: component
+            for component in (
+                extract_component_api(file_name, source)
+                for file_name, source in parse_sources(result.stdout).items()
+            )
+        }
+        index = ComponentIndex(
+            version=INDEX_VERSION,
+            template_id=self.template_id,
+            built_at=time.time(),
+            components=dict(sorted(components.items())),
+        )
+
+        self._write(index)
+
+        self.index = index
+        logger.info(
+            "component_index_built",
+            template_id=self.template_id,
+            components=len(components),
+            duration_seconds=round(time.monotonic() - start, 2),
+        )
+        return index
+
+    # written next to the old file first so a crash never leaves half an index, under
+    # a name of its own: every uvicorn worker may be rebuilding the same index at startup
+    def _write(self, index: ComponentIndex) -> None:
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w",
+            dir=directory,
+            prefix=f"{os.path.basename(self.path)}.",
+            suffix=".tmp",
+            delete=False,
+        ) as file:
+            file.write(index.model_dump_json(indent=1))
+        try:
+            os.replace(file.name, self.path)
+        except BaseException:
+            os.unlink(file.name)
+            raise
+
+    async def _rebuild_in_background(self) -> None:
+        try:
+            await self.rebuild()
+        except Exception as e:
+            logger.error(
+                "component_index_build_failed",
+                template_id=self.template_id,
+                error_type=type(e).__name__,
+                error=str(e),
+                exc_info=True,
+            )
+
+    def lookup(self, names: List[str]) -> str:
+        self.lookups += 1
+        if self.index is None:
+            return "the component index is not available, use search_sandbox or read the files under /home/user/components/ui/ instead"
+
+        components = self.index.components
+        if not names:
+            listing = "\n".join(
+                f"{name}: {', '.join(component.exports)}"
+                for name, component in components.items()
+            )
+            return f"{len(components)} Shadcn components (import from @/components/ui/<file>):\n{listing}"
+
+        # file names, import paths or exported names, case insensitive
+        by_export = {
+            export.lower(): component.name
+            for component in components.values()
+            for export in component.exports
+        }
+        found: List[str] = []
+        missing: List[str] = []
+        for name in names:
+            key = name.strip().removeprefix("@/components/ui/").removesuffix(".tsx")
+            file_name = key if key in components else by_export.get(key.lower())
+            if file_name is None:
+                missing.append(name)
+            elif file_name not in found:
+                found.append(file_name)
+
+        sections = [format_component(components[file_name]) for file_name in found]
+        if missing:
+            sections.append(
+                f"no component named {', '.join(missing)}, call with no names to list all components"
+            )
+        return "\n\n".join(sections)
+
+    def stats(self) -> ComponentIndexStats:
+        return ComponentIndexStats(
+            template_id=self.index.template_id if self.index else None,
+            version=self.index.version if self.index else None,
+            components=len(self.index.components) if self.index else 0,
+            building=self._task is not None and not self._task.done(),
+            lookups=self.lookups,
+        )
+
+    def get_tool(self) -> BaseTool:
+        return ComponentLookupTool(index_service=self)
+
+
+class ComponentLookupInput(BaseModel):
+    names: List[str] = Field(
+        default_factory=list,
+        description="component files or exported names (e.g. button, DialogContent), empty lists every component",
+    )
+
+
+# answered from memory, no sandbox round trip
+class ComponentLookupTool(BaseTool):
+    name: str = "lookup_ui_components"
+    description: str = "Look up the api of the pre-installed Shadcn components: exports, variant values and props types. Provide component file names or exported names (e.g. button, DialogContent), or no names to list every component. Instant, use it instead of reading component files."
+    args_schema: Type[BaseModel] = ComponentLookupInput
+    index_service: ComponentIndexService = Field(exclude=True)
+
+    def _run(self, names: Optional[List[str]] = None) -> str:
+        return self.index_service.lookup(names or [])
+
+    async def _arun(self, names: Optional[List[str]] = None) -> str:
+        return self.index_service.lookup(names or [])
+
+
+# build time: python -m services.component_index [template_id]
+if __name__ == "__main__":
+    import sys
+
+    service = ComponentIndexService(
+        template_id=(
+            sys.argv[1]
+            if len(sys.argv) > 1
+            else settings.e2b_sandbox_nextjs_template_id
+        ),
+        path=settings.component_index_path,
+        build_timeout_seconds=settings.component_index_build_timeout_seconds,
+    )
+    asyncio.run(service.rebuild())
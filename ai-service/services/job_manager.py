@@ -0,0 +1,280 @@
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Set
+from services.ai_router import AIRouter
+from services.job_store import JobStore
+from services.models.ai_models import AIStreamEvent, CodeAgentData
+from services.models.job_models import CodeAgentJob, CodeAgentJobStats, JobStatus
+from utils.logging import logger
+import asyncio
+import time
+import uuid
+
+"""
+CodeAgentJobManager: runs code agent requests in the background so the http
+request only submits the job and polls or streams it.
+A fixed pool of workers takes jobs in submit order, but only one job per sandbox
+runs at a time (two agents writing the same files would overwrite each other):
+jobs are queued per sandbox and a sandbox is handed to a worker only while it has
+queued jobs and no running one, so workers never block on a busy sandbox of their
+own process. Runs started by other workers or the sync code routes are kept apart
+by the shared sandbox lock every code agent run holds.
+Progress is the provider and tool events of the run, appended to the job store one
+at a time. Tokens are left out, they are only useful live, and tool inputs are
+summarized (file contents and patches are cut), the job keeps what the agent did,
+not every byte it wrote.
+"""
+
+
+MAX_INPUT_CHARS = 200
+
+
+# long strings (file contents, diffs) shortened to their start and length
+def summarize_tool_input(value: Any) -> Any:
+    if isinstance(value, str) and len(value) > MAX_INPUT_CHARS:
+        return f"{value[:MAX_INPUT_CHARS]}... ({len(value)} chars)"
+    if isinstance(value, dict):
+        return {key: summarize_tool_input(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [summarize_tool_input(item) for item in value]
+    return value
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+class JobNotFoundError(Exception):
+    pass
+
+
+class CodeAgentJobManager:
+    def __init__(
+        self,
+        ai_router: AIRouter,
+        job_store: JobStore,
+        workers: int,
+        max_queued: int,
+        poll_interval_seconds: float,
+    ) -> None:
+        self.ai_router = ai_router
+        self.job_store = job_store
+        self.workers = workers
+        self.max_queued = max_queued
+        self.poll_interval_seconds = poll_interval_seconds
+
+        self.pending: Dict[str, Deque[CodeAgentJob]] = {}
+        self.scheduled: Set[str] = set()  # sandboxes waiting for or held by a worker
+        self.ready: asyncio.Queue = asyncio.Queue()
+        self.queued = 0
+        self.running = 0
+        self.submitted = 0
+        self.rejected = 0
+
+        self._updated: Dict[str, asyncio.Event] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        logger.info("code_agent_jobs_started", workers=self.workers)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        # jobs that never started are failed so pollers do not wait forever
+        pending = [job for jobs in self.pending.values() for job in jobs]
+        self.pending.clear()
+        self.scheduled.clear()
+        self.ready = asyncio.Queue()
+        self.queued = 0
+        for job in pending:
+            self._fail(job, "service stopped before the job started")
+            await self._save(job)
+        logger.info("code_agent_jobs_stopped", dropped=len(pending))
+
+    async def submit(
+        self, provider: str, sandbox_id: str, user_message: str
+    ) -> CodeAgentJob:
+        self.ai_router.validate_provider("code", provider)
+        if self.queued >= self.max_queued:
+            self.rejected += 1
+            raise JobQueueFullError(f"{self.queued} code agent jobs are already queued")
+
+        job = CodeAgentJob(
+            job_id=uuid.uuid4().hex,
+            provider=provider,
+            sandbox_id=sandbox_id,
+            message=user_message,
+            created_at=time.time(),
+        )
+        await self.job_store.save(job)
+
+        self.submitted += 1
+        self.queued += 1
+        self.pending.setdefault(sandbox_id, deque()).append(job)
+        if sandbox_id not in self.scheduled:
+            self.scheduled.add(sandbox_id)
+            self.ready.put_nowait(sandbox_id)
+
+        logger.info(
+            "code_agent_job_submitted",
+            job_id=job.job_id,
+            provider=provider,
+            sandbox_id=sandbox_id,
+            queued=self.queued,
+        )
+        return job
+
+    async def get(self, job_id: str, include_progress: bool = True) -> CodeAgentJob:
+        job = await self.job_store.get(job_id, include_progress=include_progress)
+        if job is None:
+            raise JobNotFoundError(f"job {job_id} not found")
+        return job
+
+    # progress events as they are saved, then a final or error event
+    async def stream(self, job_id: str) -> AsyncIterator[AIStreamEvent]:
+        sent = 0
+        while True:
+            # subscribe before reading so a save in between is not missed
+            updated = self._updated.setdefault(job_id, asyncio.Event())
+            job = await self.get(job_id, include_progress=False)
+
+            # read after the state, a finished job's last events are all there
+            for stream_event in await self.job_store.get_progress(job_id, sent):
+                sent += 1
+                yield stream_event
+
+            if job.is_finished():
+                self._updated.pop(job_id, None)
+                if job.result is not None and job.status == JobStatus.succeeded:
+                    yield AIStreamEvent(event="final", data=job.result.model_dump())
+                else:
+                    yield AIStreamEvent(event="error", data={"detail": job.error})
+                return
+
+            # local saves wake us up, the timeout covers jobs run by another worker process
+            try:
+                await asyncio.wait_for(
+                    updated.wait(), timeout=self.poll_interval_seconds
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    # a stream client left, its wake up event is dropped (a job run by another worker
+    # process is never saved here, nothing else would remove it)
+    def unsubscribe(self, job_id: str) -> None:
+        self._updated.pop(job_id, None)
+
+    def stats(self) -> CodeAgentJobStats:
+        return CodeAgentJobStats(
+            workers=len(self._tasks),
+            queued=self.queued,
+            running=self.running,
+            sandboxes=len(self.scheduled),
+            submitted=self.submitted,
+            rejected=self.rejected,
+        )
+
+    async def _work(self) -> None:
+        while True:
+            sandbox_id = await self.ready.get()
+            job = self.pending[sandbox_id].popleft()
+            try:
+                await self._run(job)
+            finally:
+                if self.pending.get(sandbox_id):
+                    self.ready.put_nowait(sandbox_id)
+                else:
+                    self.pending.pop(sandbox_id, None)
+                    self.scheduled.discard(sandbox_id)
+
+    async def _run(self, job: CodeAgentJob) -> None:
+        self.queued -= 1
+        self.running += 1
+        job.status = JobStatus.running
+        job.started_at = time.time()
+        await self._save(job)
+        logger.info("code_agent_job_started", job_id=job.job_id)
+
+        try:
+            async for stream_event in self.ai_router.stream_code_request(
+                provider=job.provider,
+                sandbox_id=job.sandbox_id,
+                user_message=job.message,
+            ):
+                if stream_event.event == "token":
+                    continue
+                if stream_event.event == "final":
+                    job.result = CodeAgentData(**stream_event.data)
+                    continue
+                if stream_event.event == "provider":
+                    job.served_by = stream_event.data["provider"]
+                    await self._save(job)
+                await self._append(job, stream_event)
+
+            job.status = JobStatus.succeeded
+            job.finished_at = time.time()
+            logger.info(
+                "code_agent_job_succeeded",
+                job_id=job.job_id,
+                provider=job.served_by,
+                duration_seconds=round(job.finished_at - job.started_at, 2),
+            )
+        except asyncio.CancelledError:
+            self._fail(job, "service stopped while the job was running")
+            await self._save(job)
+            raise
+        except Exception as e:
+            logger.error(
+                "code_agent_job_failed",
+                job_id=job.job_id,
+                error_type=type(e).__name__,
+                error=str(e),
+                exc_info=True,
+            )
+            self._fail(job, f"ai code agent failed: {str(e)}")
+        finally:
+            self.running -= 1
+
+        await self._save(job)
+
+    def _fail(self, job: CodeAgentJob, error: str) -> None:
+        job.status = JobStatus.failed
+        job.error = error
+        job.finished_at = time.time()
+
+    async def _append(self, job: CodeAgentJob, stream_event: AIStreamEvent) -> None:
+        if stream_event.event == "tool_start":
+            stream_event = AIStreamEvent(
+                event=stream_event.event,
+                data=summarize_tool_input(stream_event.data),
+            )
+        try:
+            await self.job_store.append_progress(job.job_id, stream_event)
+        except Exception as e:
+            logger.warning(
+                "code_agent_job_progress_save_failed",
+                job_id=job.job_id,
+                error_type=type(e).__name__,
+                error=str(e),
+            )
+        self._notify(job.job_id)
+
+    async def _save(self, job: CodeAgentJob) -> None:
+        try:
+            await self.job_store.save(job)
+        except Exception as e:
+            logger.warning(
+                "code_agent_job_save_failed",
+                job_id=job.job_id,
+                error_type=type(e).__name__,
+                error=str(e),
+            )
+        self._notify(job.job_id)
+
+    def _notify(self, job_id: str) -> None:
+        updated = self._updated.pop(job_id, None)
+        if updated:
+            updated.set()
@@ -0,0 +1,108 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from redis.asyncio import Redis
+from services.models.ai_models import AIStreamEvent
+from services.models.job_models import CodeAgentJob
+
+"""
+Job store for background code agent runs.
+Two backends: in-process (per uvicorn worker, oldest jobs evicted past max size)
+and redis (shared, so a job can be polled from any worker, expires after a ttl).
+A job is only ever written by the worker that runs it.
+Progress events are appended one at a time next to the job (a redis list), saving
+the job writes its state only, so a long run costs one small write per event.
+"""
+
+
+class JobStore(ABC):
+    backend: str = ""
+
+    # with its progress unless include_progress is False
+    @abstractmethod
+    async def get(
+        self, job_id: str, include_progress: bool = True
+    ) -> Optional[CodeAgentJob]: ...
+
+    # the job state, its progress is left as stored
+    @abstractmethod
+    async def save(self, job: CodeAgentJob) -> None: ...
+
+    @abstractmethod
+    async def append_progress(self, job_id: str, event: AIStreamEvent) -> None: ...
+
+    # progress events from index start on
+    @abstractmethod
+    async def get_progress(
+        self, job_id: str, start: int = 0
+    ) -> List[AIStreamEvent]: ...
+
+
+class InMemoryJobStore(JobStore):
+    backend = "memory"
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.jobs: OrderedDict[str, CodeAgentJob] = OrderedDict()
+        self.progress: Dict[str, List[AIStreamEvent]] = {}
+
+    async def get(
+        self, job_id: str, include_progress: bool = True
+    ) -> Optional[CodeAgentJob]:
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        progress = list(self.progress.get(job_id, [])) if include_progress else []
+        return job.model_copy(update={"progress": progress})
+
+    async def save(self, job: CodeAgentJob) -> None:
+        self.jobs[job.job_id] = job.model_copy(update={"progress": []})
+        self.progress.setdefault(job.job_id, [])
+        while len(self.jobs) > self.max_size:
+            evicted, _ = self.jobs.popitem(last=False)
+            self.progress.pop(evicted, None)
+
+    # events are never changed once appended, they are shared, not copied
+    async def append_progress(self, job_id: str, event: AIStreamEvent) -> None:
+        if job_id in self.jobs:
+            self.progress[job_id].append(event)
+
+    async def get_progress(self, job_id: str, start: int = 0) -> List[AIStreamEvent]:
+        return self.progress.get(job_id, [])[start:]
+
+
+class RedisJobStore(JobStore):
+    backend = "redis"
+
+    def __init__(self, url: str, ttl_seconds: int) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.redis = Redis.from_url(url, decode_responses=True)
+
+    async def get(
+        self, job_id: str, include_progress: bool = True
+    ) -> Optional[CodeAgentJob]:
+        data = await self.redis.get(f"ai-service:job:{job_id}")
+        if not data:
+            return None
+        job = CodeAgentJob.model_validate_json(data)
+        if include_progress:
+            job.progress = await self.get_progress(job_id)
+        return job
+
+    async def save(self, job: CodeAgentJob) -> None:
+        await self.redis.set(
+            f"ai-service:job:{job.job_id}",
+            job.model_dump_json(exclude={"progress"}),
+            ex=self.ttl_seconds,
+        )
+
+    async def append_progress(self, job_id: str, event: AIStreamEvent) -> None:
+        key = f"ai-service:job:{job_id}:progress"
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.rpush(key, event.model_dump_json())
+            pipe.expire(key, self.ttl_seconds)
+            await pipe.execute()
+
+    async def get_progress(self, job_id: str, start: int = 0) -> List[AIStreamEvent]:
+        events = await self.redis.lrange(f"ai-service:job:{job_id}:progress", start, -1)
+        return [AIStreamEvent.model_validate_json(event) for event in events]
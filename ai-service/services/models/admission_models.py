@@ -0,0 +1,22 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+
+
+class ProviderLimits(BaseModel):
+    requests_per_minute: int = Field(..., description="0 disables the limit")
+    tokens_per_minute: int = Field(..., description="0 disables the limit")
+    max_concurrency: int = Field(..., description="0 disables the limit")
+
+
+class AdmissionStats(BaseModel):
+    provider: str = Field(..., description="llm provider")
+    in_flight: int = Field(..., description="llm calls currently running")
+    waiting: int = Field(..., description="llm calls queued for admission")
+    admitted: int = Field(..., description="llm calls admitted")
+    rejected: int = Field(..., description="llm calls shed with a 429")
+    available_requests: Optional[float] = Field(
+        None, description="requests left in the bucket, None when unlimited"
+    )
+    available_tokens: Optional[float] = Field(
+        None, description="tokens left in the bucket, None when unlimited"
+    )
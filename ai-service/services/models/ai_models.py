@@ -1,8 +1,11 @@
 from pydantic import BaseModel, Field, model_validator
-from typing import List, Dict, Optional
+from langchain_core.messages import SystemMessage
+from typing import Any, List, Dict, Optional
 from clients.openai_client import OpenAIClient
 from clients.google_client import GoogleClient
 from clients.anthropic_client import AnthropicClient
+from api.config import settings
+from services.models.usage_models import LLMUsage
 
 
 # Create AI Per LLM Type
@@ -33,6 +36,34 @@ class AIClient(BaseModel):
         else:
             raise ValueError("No client available")
 
+    def get_provider(self) -> str:
+        if self.openai_client:
+            return "openai"
+        elif self.google_client:
+            return "google"
+        elif self.anthropic_client:
+            return "anthropic"
+        else:
+            raise ValueError("No client available")
+
+    def get_model_name(self) -> str:
+        return {
+            "openai": settings.openai_model,
+            "google": settings.google_model,
+            "anthropic": settings.anthropic_model,
+        }[self.get_provider()]
+
+    # system message marked for the provider's prompt caching
+    def get_system_message(self, content: str) -> SystemMessage:
+        if self.openai_client:
+            return self.openai_client.get_system_message(content)
+        elif self.google_client:
+            return self.google_client.get_system_message(content)
+        elif self.anthropic_client:
+            return self.anthropic_client.get_system_message(content)
+        else:
+            raise ValueError("No client available")
+
 
 # response of ai agent after executing code in a sandbox
 class CodeAgentResult(BaseModel):
@@ -47,8 +78,44 @@ class CodeAgentData(BaseModel):
     files: Dict[str, str] = Field(
         ..., description="all modified files with respective paths"
     )
+    stop_reason: Optional[str] = Field(
+        None,
+        description="budget that ended the run before the agent finished (partial result), None when it finished",
+    )
+    usage: Optional[LLMUsage] = Field(None, description="llm usage of the run")
+
+
+# per request limits of a code agent run, None disables a limit
+class CodeAgentBudget(BaseModel):
+    max_steps: Optional[int] = None
+    max_run_seconds: Optional[float] = None
+    max_tokens: Optional[int] = None
+    # identical tool calls answered from the run's memo before the run is stopped
+    max_duplicate_calls: Optional[int] = None
+
+
+class LLMQueryData(BaseModel):
+    content: str = Field(..., description="answer to the query")
+    usage: LLMUsage = Field(..., description="llm usage of the query")
 
 
 # response of llm after sending a regualr query
 class LLMQueryResult(BaseModel):
     response: str = Field(description="LLM Query Response")
+
+
+# event emitted while streaming a query or code agent response
+class AIStreamEvent(BaseModel):
+    event: str = Field(..., description="token, tool_start, tool_end, final or error")
+    data: Dict[str, Any] = Field(..., description="event payload")
+
+
+class ProviderHealthStats(BaseModel):
+    provider: str = Field(..., description="openai, google or anthropic")
+    kind: str = Field(..., description="query or code requests")
+    score: float = Field(..., description="routing score, lower is preferred")
+    latency_ewma: float = Field(..., description="recent latency in seconds")
+    error_rate_ewma: float = Field(..., description="recent error rate (0-1)")
+    cooling_down: bool = Field(..., description="recently failed, tried last")
+    successes: int = Field(..., description="successful requests")
+    failures: int = Field(..., description="failed requests")
@@ -0,0 +1,8 @@
+from pydantic import BaseModel, Field
+
+
+class ResponseCacheStats(BaseModel):
+    backend: str = Field(..., description="memory or redis")
+    hits: int = Field(..., description="queries answered from the cache")
+    misses: int = Field(..., description="queries that had to call the llm")
+    errors: int = Field(..., description="cache backend failures, treated as misses")
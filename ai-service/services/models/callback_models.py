@@ -5,3 +5,9 @@ from typing import Dict, List
 class CodeAgentCallBackResult(BaseModel):
     updated_files: Dict[str, str]
     commands_executed: List[str]
+
+    # token usage across all llm steps of the run
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_creation_tokens: int = 0
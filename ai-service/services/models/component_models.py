@@ -0,0 +1,40 @@
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
+
+
+# api of one components/ui/<name>.tsx file
+class ComponentApi(BaseModel):
+    name: str = Field(..., description="file name without .tsx")
+    import_path: str = Field(..., description="module to import from")
+    exports: List[str] = Field(..., description="exported components and helpers")
+    variants: Dict[str, Dict[str, List[str]]] = Field(
+        default_factory=dict,
+        description="cva name -> variant prop -> allowed values",
+    )
+    default_variants: Dict[str, Dict[str, str]] = Field(
+        default_factory=dict, description="cva name -> variant prop -> default value"
+    )
+    props: Dict[str, str] = Field(
+        default_factory=dict, description="exported component -> props type"
+    )
+
+
+class ComponentIndex(BaseModel):
+    version: int = Field(..., description="extractor format version")
+    template_id: str = Field(
+        ..., description="sandbox template the index was built from"
+    )
+    built_at: float = Field(..., description="unix time the index was built")
+    components: Dict[str, ComponentApi] = Field(
+        ..., description="file name -> component api"
+    )
+
+
+class ComponentIndexStats(BaseModel):
+    template_id: Optional[str] = Field(..., description="template of the loaded index")
+    version: Optional[int] = Field(
+        ..., description="format version of the loaded index"
+    )
+    components: int = Field(..., description="component files indexed")
+    building: bool = Field(..., description="a rebuild is running")
+    lookups: int = Field(..., description="lookup tool calls served")
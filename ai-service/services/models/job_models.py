@@ -0,0 +1,41 @@
+from pydantic import BaseModel, Field
+from enum import Enum
+from typing import List, Optional
+from services.models.ai_models import AIStreamEvent, CodeAgentData
+
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+
+
+# background code agent run, progress holds the provider and tool events of the run
+class CodeAgentJob(BaseModel):
+    job_id: str = Field(..., description="id used to poll or stream the job")
+    provider: str = Field(..., description="requested provider or auto")
+    sandbox_id: str = Field(..., description="sandbox the agent works in")
+    message: str = Field(..., description="human message to code agent")
+    status: JobStatus = Field(JobStatus.queued, description="current job state")
+    served_by: Optional[str] = Field(None, description="provider that ran the job")
+    progress: List[AIStreamEvent] = Field(
+        default_factory=list, description="provider and tool events, in order"
+    )
+    result: Optional[CodeAgentData] = Field(None, description="set once succeeded")
+    error: Optional[str] = Field(None, description="set once failed")
+    created_at: float = Field(..., description="unix time the job was submitted")
+    started_at: Optional[float] = Field(None, description="unix time the run began")
+    finished_at: Optional[float] = Field(None, description="unix time the run ended")
+
+    def is_finished(self) -> bool:
+        return self.status in (JobStatus.succeeded, JobStatus.failed)
+
+
+class CodeAgentJobStats(BaseModel):
+    workers: int = Field(..., description="size of the worker pool")
+    queued: int = Field(..., description="jobs waiting for a worker")
+    running: int = Field(..., description="jobs currently running")
+    sandboxes: int = Field(..., description="sandboxes with queued or running jobs")
+    submitted: int = Field(..., description="jobs accepted since start")
+    rejected: int = Field(..., description="jobs refused because the queue was full")
@@ -1,11 +1,22 @@
 from pydantic import BaseModel, Field
-from typing import List
+from e2b_code_interpreter import AsyncSandbox, WriteInfo
+from services.sandbox_manifest import SandboxManifest
+from typing import List, Optional
 
 
 # Extract relevant terminal output
 class TerminalInfo(BaseModel):
     stdout: str = Field(..., description="output of successful command")
     stderr: str = Field(..., description="output of failed command")
+    exit_code: Optional[int] = Field(
+        default=None, description="None when the command was killed"
+    )
+    timed_out: bool = Field(
+        default=False, description="killed after running past its timeout"
+    )
+    truncated_bytes: int = Field(
+        default=0, description="output dropped from the middle of stdout and stderr"
+    )
 
 
 # overwrite the e2b write entry data type, import is confilcting with pydantic
@@ -23,6 +34,16 @@ class ReadToolInput(BaseModel):
 class ListToolInput(BaseModel):
     sandbox_id: str = Field(..., description="id used to connect to sandbox")
     path: str = Field(..., description="directory path to list files from")
+    depth: int = Field(
+        default=1,
+        ge=1,
+        le=10,
+        description="directory levels to list, use 3-5 to see a whole project in one call",
+    )
+    ignore: Optional[List[str]] = Field(
+        default=None,
+        description="file or directory name globs to skip, defaults to node_modules, .next and .git",
+    )
 
 
 class WriteToolInput(BaseModel):
@@ -32,6 +53,164 @@ class WriteToolInput(BaseModel):
     )
 
 
+class PatchEdit(BaseModel):
+    search: str = Field(
+        ..., description="exact text to find, must be unique in the file"
+    )
+    replace: str = Field(..., description="text that replaces the search text")
+
+
+class PatchEntry(BaseModel):
+    path: str = Field(..., description="path of the existing file to patch")
+    diff: Optional[str] = Field(
+        None, description="unified diff hunks (@@ ... @@ with ' ', '-', '+' lines)"
+    )
+    edits: Optional[List[PatchEdit]] = Field(
+        None, description="search/replace edits, applied in order"
+    )
+
+
+class PatchToolInput(BaseModel):
+    sandbox_id: str = Field(..., description="id used to connect to sandbox")
+    patches: List[PatchEntry] = Field(
+        ..., description="list of files to patch, each with a diff or edits"
+    )
+
+
 class CommandToolInput(BaseModel):
     sandbox_id: str = Field(..., description="id used to connect to sandbox")
     command: str = Field(..., description="terminal command to execute")
+    timeout_seconds: Optional[int] = Field(
+        default=None,
+        ge=1,
+        le=1800,
+        description="kill the command after this many seconds, long installs or builds may need more than the default",
+    )
+
+
+class SearchToolInput(BaseModel):
+    sandbox_id: str = Field(..., description="id used to connect to sandbox")
+    pattern: str = Field(
+        ...,
+        description="regular expression (or literal text with fixed_strings) to search for",
+    )
+    path: str = Field(
+        default="/home/user/", description="directory or file to search in"
+    )
+    glob: Optional[str] = Field(
+        default=None, description="only search files matching this glob, e.g. *.tsx"
+    )
+    context: int = Field(
+        default=0, ge=0, le=5, description="lines of context around each match"
+    )
+    ignore_case: bool = Field(default=False, description="case insensitive search")
+    fixed_strings: bool = Field(
+        default=False, description="treat the pattern as literal text"
+    )
+
+
+class SandboxSearchResult(BaseModel):
+    pattern: str = Field(..., description="searched pattern")
+    path: str = Field(..., description="searched directory or file")
+    output: str = Field(
+        ..., description="path:line:text for matches, path-line-text for context lines"
+    )
+    lines: int = Field(..., description="output lines returned")
+    truncated: bool = Field(
+        default=False, description="output was cut at the line limit"
+    )
+
+
+class SandboxTreeEntry(BaseModel):
+    path: str = Field(..., description="path relative to the listed directory")
+    type: str = Field(..., description="file, dir or symlink")
+    size: int = Field(..., description="size in bytes")
+    modified_at: float = Field(..., description="unix time of the last modification")
+
+
+class SandboxTree(BaseModel):
+    path: str = Field(..., description="listed directory")
+    entries: List[SandboxTreeEntry] = Field(..., description="entries, parents first")
+    truncated: bool = Field(
+        default=False, description="more entries exist than the listing limit"
+    )
+
+
+# connection held by the sandbox connection cache
+class SandboxConnection(BaseModel):
+    model_config = {"arbitrary_types_allowed": True}
+
+    sandbox: AsyncSandbox
+    last_used_at: float = Field(..., description="unix time of the last cache hit")
+    expires_at: Optional[float] = Field(
+        default=None, description="unix time the sandbox itself times out"
+    )
+    manifest: Optional[SandboxManifest] = Field(
+        default=None,
+        description="content hashes of the sandbox files, None until built or after a command ran",
+    )
+
+
+class SandboxConnectionCacheStats(BaseModel):
+    size: int = Field(..., description="connections currently cached")
+    max_size: int = Field(..., description="maximum connections kept")
+    hits: int = Field(..., description="lookups served from the cache")
+    misses: int = Field(..., description="lookups that had to connect")
+    evictions: int = Field(..., description="connections dropped (idle, expiry, error)")
+
+
+# idle sandbox waiting in the warm pool
+class PooledSandbox(BaseModel):
+    model_config = {"arbitrary_types_allowed": True}
+
+    sandbox: AsyncSandbox
+    expires_at: float = Field(..., description="unix time the sandbox times out")
+    idle_since: float = Field(..., description="unix time it joined the pool")
+
+
+class SandboxPoolStats(BaseModel):
+    idle: int = Field(..., description="warm sandboxes ready to hand out")
+    creating: int = Field(..., description="sandboxes currently being created")
+    target_size: int = Field(..., description="current refill target")
+    min_size: int = Field(..., description="configured minimum pool size")
+    max_size: int = Field(..., description="configured maximum pool size")
+    hits: int = Field(..., description="checkouts served from the pool")
+    misses: int = Field(..., description="checkouts that created a sandbox inline")
+    renewed: int = Field(..., description="idle sandbox timeouts extended")
+    retired: int = Field(
+        ..., description="idle sandboxes killed (unused too long or not renewable)"
+    )
+
+
+# outcome of patching one file, content stays out of the tool output
+class PatchResult(BaseModel):
+    path: str
+    hunks: int = 0
+    sha256: Optional[str] = None
+    error: Optional[str] = None
+    content: Optional[str] = Field(None, exclude=True)
+
+
+class SandboxWriteResult(BaseModel):
+    model_config = {"arbitrary_types_allowed": True}
+
+    written: List[WriteInfo] = Field(..., description="files uploaded to the sandbox")
+    skipped: List[str] = Field(
+        default_factory=list,
+        description="paths skipped, content already in the sandbox",
+    )
+    skipped_bytes: int = Field(default=0, description="bytes not uploaded")
+
+
+# project files changed since the sandbox booted, the archive is kept by the snapshot store
+class SandboxSnapshot(BaseModel):
+    sandbox_id: str = Field(..., description="sandbox the snapshot was taken from")
+    created_at: float = Field(..., description="unix time the snapshot was taken")
+    files: List[str] = Field(
+        ..., description="paths in the archive, relative to /home/user"
+    )
+    size_bytes: int = Field(..., description="compressed archive size")
+    packages_changed: bool = Field(
+        ...,
+        description="package.json or the lockfile changed, restore runs npm install",
+    )
@@ -0,0 +1,47 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+
+
+class ModelPrice(BaseModel):
+    input: float = Field(..., description="usd per million uncached input tokens")
+    output: float = Field(..., description="usd per million output tokens")
+    cache_read: float = Field(0, description="usd per million cache read tokens")
+    cache_write: float = Field(0, description="usd per million cache write tokens")
+
+
+# usage of one request, zero llm calls when it was served from the cache or coalesced
+class LLMUsage(BaseModel):
+    provider: str = Field(..., description="llm provider")
+    model: str = Field(..., description="llm model")
+    llm_calls: int = Field(0, description="llm calls (agent steps) made")
+    input_tokens: int = Field(0, description="prompt tokens, cached ones included")
+    output_tokens: int = Field(0, description="completion tokens")
+    cache_read_tokens: int = Field(0, description="prompt tokens read from cache")
+    cache_creation_tokens: int = Field(0, description="prompt tokens written to cache")
+    llm_seconds: float = Field(0, description="time spent in llm calls")
+    tool_calls: int = Field(0, description="agent tool calls made")
+    tool_seconds: float = Field(
+        0, description="time spent in tool calls, summed (they may overlap)"
+    )
+    estimated_cost_usd: Optional[float] = Field(
+        None, description="estimated from llm_prices, None when the model has no price"
+    )
+
+
+class UsageStats(BaseModel):
+    provider: str = Field(..., description="llm provider")
+    model: str = Field(..., description="llm model")
+    kind: str = Field(..., description="query or code")
+    requests: int = Field(..., description="requests recorded")
+    llm_calls: int = Field(..., description="llm calls made")
+    input_tokens: int = Field(..., description="prompt tokens, cached ones included")
+    output_tokens: int = Field(..., description="completion tokens")
+    cache_read_tokens: int = Field(..., description="prompt tokens read from cache")
+    cache_creation_tokens: int = Field(
+        ..., description="prompt tokens written to cache"
+    )
+    llm_seconds: float = Field(..., description="time spent in llm calls")
+    tool_seconds: float = Field(..., description="time spent in tool calls")
+    estimated_cost_usd: float = Field(
+        ..., description="estimated cost, models without a price count as 0"
+    )
@@ -0,0 +1,124 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional, Tuple
+from redis.asyncio import Redis
+from services.models.cache_models import ResponseCacheStats
+from utils.logging import logger
+import hashlib
+import re
+import time
+import unicodedata
+
+"""
+Response cache for general /query requests.
+Keys are built from the provider, model, prompt version and the normalized user
+message, so the same question asked with different casing or spacing is a hit.
+Two backends: an in-process LRU (per uvicorn worker) and redis (shared by all
+workers, size bounded by the redis maxmemory policy).
+Backend failures are logged and treated as misses, the llm is the fallback.
+"""
+
+
+def normalize_message(message: str) -> str:
+    message = unicodedata.normalize("NFKC", message)
+    return re.sub(r"\s+", " ", message).strip().casefold()
+
+
+def make_cache_key(provider: str, model: str, prompt_version: str, message: str) -> str:
+    digest = hashlib.sha256(normalize_message(message).encode()).hexdigest()
+    return f"query:{provider}:{model}:{prompt_version}:{digest}"
+
+
+class ResponseCache(ABC):
+    backend: str = ""
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        try:
+            value = await self._get(key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(
+                "response_cache_get_failed",
+                backend=self.backend,
+                error_type=type(e).__name__,
+                error=str(e),
+            )
+            value = None
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: str) -> None:
+        try:
+            await self._set(key, value)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(
+                "response_cache_set_failed",
+                backend=self.backend,
+                error_type=type(e).__name__,
+                error=str(e),
+            )
+
+    def stats(self) -> ResponseCacheStats:
+        return ResponseCacheStats(
+            backend=self.backend, hits=self.hits, misses=self.misses, errors=self.errors
+        )
+
+    @abstractmethod
+    async def _get(self, key: str) -> Optional[str]: ...
+
+    @abstractmethod
+    async def _set(self, key: str, value: str) -> None: ...
+
+
+class InMemoryResponseCache(ResponseCache):
+    backend = "memory"
+
+    def __init__(self, max_size: int, ttl_seconds: float) -> None:
+        super().__init__()
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.entries: OrderedDict[str, Tuple[float, str]] = OrderedDict()
+
+    async def _get(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return value
+
+    async def _set(self, key: str, value: str) -> None:
+        self.entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+class RedisResponseCache(ResponseCache):
+    backend = "redis"
+
+    def __init__(self, url: str, ttl_seconds: int) -> None:
+        super().__init__()
+        self.ttl_seconds = ttl_seconds
+        self.redis = Redis.from_url(url, decode_responses=True)
+
+    async def _get(self, key: str) -> Optional[str]:
+        return await self.redis.get(f"ai-service:{key}")
+
+    async def _set(self, key: str, value: str) -> None:
+        await self.redis.set(f"ai-service:{key}", value, ex=self.ttl_seconds)
@@ -0,0 +1,137 @@
+from e2b_code_interpreter import (
+    AsyncSandbox,
+    SandboxNotFoundException,
+    SandboxNotRunningException,
+    SandboxUnreachableException,
+)
+from collections import OrderedDict
+from typing import Optional
+from services.models.sandbox_models import (
+    SandboxConnection,
+    SandboxConnectionCacheStats,
+)
+from services.sandbox_manifest import SandboxManifest
+from services.single_flight import SingleFlight
+from utils.logging import logger
+from utils.metrics import record_cache_lookup, time_sandbox_operation
+from utils.tracing import sandbox_span
+import httpx
+import time
+
+"""
+SandboxConnectionCache: keeps AsyncSandbox connections keyed by sandbox id.
+A single code agent run makes dozens of tool calls against the same sandbox,
+reconnecting for each one costs a round trip to the e2b control plane.
+Entries are evicted when idle, when the sandbox itself times out, or when
+the owner reports a connection error (is_connection_error: transport failures,
+sandbox gone, not a command timeout or a missing file). Least recently used entries are
+dropped once the cache is full. Concurrent misses for one sandbox share a single
+connect (SingleFlight).
+Each entry also carries the sandbox's file manifest, it is dropped with the
+connection so a reconnect starts from a fresh manifest.
+"""
+
+# the connection (or the sandbox behind it) is gone, a retry needs a new one.
+# plain TimeoutException (a slow command or request) keeps the connection
+CONNECTION_ERRORS = (
+    SandboxNotRunningException,
+    SandboxUnreachableException,
+    SandboxNotFoundException,
+    httpx.TransportError,
+    ConnectionError,
+)
+
+
+def is_connection_error(error: BaseException) -> bool:
+    return isinstance(error, CONNECTION_ERRORS)
+
+
+class SandboxConnectionCache:
+    def __init__(self, max_size: int, idle_ttl_seconds: float) -> None:
+        self.max_size = max_size
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.connections: OrderedDict[str, SandboxConnection] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.connecting = SingleFlight("sandbox_connect")
+
+    async def get(self, sandbox_id: str) -> AsyncSandbox:
+        now = time.time()
+        connection = self.connections.get(sandbox_id)
+
+        if connection:
+            if connection.expires_at and now >= connection.expires_at:
+                self.invalidate(sandbox_id, reason="expired")
+            elif now - connection.last_used_at > self.idle_ttl_seconds:
+                self.invalidate(sandbox_id, reason="idle")
+            else:
+                self.hits += 1
+                record_cache_lookup("sandbox_connection", hit=True)
+                connection.last_used_at = now
+                self.connections.move_to_end(sandbox_id)
+                return connection.sandbox
+
+        self.misses += 1
+        record_cache_lookup("sandbox_connection", hit=False)
+        return await self.connecting.do(sandbox_id, lambda: self._connect(sandbox_id))
+
+    async def _connect(self, sandbox_id: str) -> AsyncSandbox:
+        with time_sandbox_operation("connect"), sandbox_span("connect", sandbox_id):
+            sbx = await AsyncSandbox.connect(sandbox_id=sandbox_id)
+            expires_at = await self._get_expiry(sbx)
+        self.put(sbx, expires_at=expires_at)
+        return sbx
+
+    def put(self, sbx: AsyncSandbox, expires_at: Optional[float] = None) -> None:
+        self.connections[sbx.sandbox_id] = SandboxConnection(
+            sandbox=sbx, last_used_at=time.time(), expires_at=expires_at
+        )
+        self.connections.move_to_end(sbx.sandbox_id)
+
+        while len(self.connections) > self.max_size:
+            oldest_id = next(iter(self.connections))
+            self.invalidate(oldest_id, reason="capacity")
+
+    def invalidate(self, sandbox_id: str, reason: str) -> None:
+        if self.connections.pop(sandbox_id, None) is None:
+            return
+        self.evictions += 1
+        logger.debug("sandbox_connection_evicted", sandbox_id=sandbox_id, reason=reason)
+
+    def get_manifest(self, sandbox_id: str) -> Optional[SandboxManifest]:
+        connection = self.connections.get(sandbox_id)
+        return connection.manifest if connection else None
+
+    # no-op without a cached connection, the manifest would outlive what it describes
+    def set_manifest(
+        self, sandbox_id: str, manifest: Optional[SandboxManifest]
+    ) -> None:
+        connection = self.connections.get(sandbox_id)
+        if connection:
+            connection.manifest = manifest
+
+    def stats(self) -> SandboxConnectionCacheStats:
+        return SandboxConnectionCacheStats(
+            size=len(self.connections),
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+        )
+
+    async def _get_expiry(self, sbx: AsyncSandbox) -> Optional[float]:
+        # best effort, without an expiry the entry is still bounded by the idle ttl
+        try:
+            info = await sbx.get_info()
+            return info.end_at.timestamp()
+        except Exception as e:
+            logger.warning(
+                "sandbox_expiry_lookup_failed",
+                sandbox_id=sbx.sandbox_id,
+                error_type=type(e).__name__,
+                error=str(e),
+            )
+            return None
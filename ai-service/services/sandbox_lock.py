@@ -0,0 +1,160 @@
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Tuple
+from redis.asyncio import Redis
+from utils.logging import logger
+import asyncio
+import time
+import uuid
+
+"""
+Sandbox lock: at most one code agent run per sandbox, whichever route or worker
+process starts it (two agents writing the same files would overwrite each other).
+Held as a lease: it expires after ttl_seconds unless the holder refreshes it, so a
+crashed worker does not keep a sandbox locked, the holder refreshes it every third
+of the ttl while the run goes on. Waiters poll for it.
+Same backends as the job store: in-process (one worker) or redis (shared).
+"""
+
+
+class SandboxLock(ABC):
+    backend: str = ""
+
+    def __init__(self, ttl_seconds: float, poll_interval_seconds: float) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+
+    @abstractmethod
+    async def _acquire(self, sandbox_id: str, token: str) -> bool: ...
+
+    # False when the lease was lost (expired and taken by another run)
+    @abstractmethod
+    async def _refresh(self, sandbox_id: str, token: str) -> bool: ...
+
+    @abstractmethod
+    async def _release(self, sandbox_id: str, token: str) -> None: ...
+
+    # waits until the sandbox is free, holds it for the block
+    @asynccontextmanager
+    async def hold(self, sandbox_id: str) -> AsyncIterator[None]:
+        token = uuid.uuid4().hex
+        started = time.monotonic()
+        while not await self._acquire(sandbox_id, token):
+            await asyncio.sleep(self.poll_interval_seconds)
+        waited = time.monotonic() - started
+        if waited >= self.poll_interval_seconds:
+            logger.info(
+                "sandbox_lock_acquired_after_wait",
+                sandbox_id=sandbox_id,
+                waited_seconds=round(waited, 2),
+            )
+
+        keeper = asyncio.create_task(self._keep(sandbox_id, token))
+        try:
+            yield
+        finally:
+            keeper.cancel()
+            try:
+                # released even when the run was cancelled
+                await asyncio.shield(self._release(sandbox_id, token))
+            except Exception as e:
+                # the lease expires on its own
+                logger.warning(
+                    "sandbox_lock_release_failed",
+                    sandbox_id=sandbox_id,
+                    error_type=type(e).__name__,
+                    error=str(e),
+                )
+
+    async def _keep(self, sandbox_id: str, token: str) -> None:
+        while True:
+            await asyncio.sleep(self.ttl_seconds / 3)
+            try:
+                if not await self._refresh(sandbox_id, token):
+                    logger.warning("sandbox_lock_lost", sandbox_id=sandbox_id)
+                    return
+            except Exception as e:
+                logger.warning(
+                    "sandbox_lock_refresh_failed",
+                    sandbox_id=sandbox_id,
+                    error_type=type(e).__name__,
+                    error=str(e),
+                )
+
+
+class InMemorySandboxLock(SandboxLock):
+    backend = "memory"
+
+    def __init__(self, ttl_seconds: float, poll_interval_seconds: float) -> None:
+        super().__init__(ttl_seconds, poll_interval_seconds)
+        self.holders: Dict[str, Tuple[str, float]] = {}  # token, expires at
+
+    async def _acquire(self, sandbox_id: str, token: str) -> bool:
+        holder = self.holders.get(sandbox_id)
+        if holder is not None and holder[1] > time.monotonic():
+            return False
+        self.holders[sandbox_id] = (token, time.monotonic() + self.ttl_seconds)
+        return True
+
+    async def _refresh(self, sandbox_id: str, token: str) -> bool:
+        holder = self.holders.get(sandbox_id)
+        if holder is None or holder[0] != token:
+            return False
+        self.holders[sandbox_id] = (token, time.monotonic() + self.ttl_seconds)
+        return True
+
+    async def _release(self, sandbox_id: str, token: str) -> None:
+        holder = self.holders.get(sandbox_id)
+        if holder is not None and holder[0] == token:
+            del self.holders[sandbox_id]
+
+
+# only the holder's token may extend or delete the key
+REFRESH_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisSandboxLock(SandboxLock):
+    backend = "redis"
+
+    def __init__(
+        self, url: str, ttl_seconds: float, poll_interval_seconds: float
+    ) -> None:
+        super().__init__(ttl_seconds, poll_interval_seconds)
+        self.redis = Redis.from_url(url, decode_responses=True)
+        self.refresh_script = self.redis.register_script(REFRESH_SCRIPT)
+        self.release_script = self.redis.register_script(RELEASE_SCRIPT)
+
+    def _key(self, sandbox_id: str) -> str:
+        return f"ai-service:sandbox-lock:{sandbox_id}"
+
+    async def _acquire(self, sandbox_id: str, token: str) -> bool:
+        return bool(
+            await self.redis.set(
+                self._key(sandbox_id),
+                token,
+                nx=True,
+                px=int(self.ttl_seconds * 1000),
+            )
+        )
+
+    async def _refresh(self, sandbox_id: str, token: str) -> bool:
+        return bool(
+            await self.refresh_script(
+                keys=[self._key(sandbox_id)],
+                args=[token, int(self.ttl_seconds * 1000)],
+            )
+        )
+
+    async def _release(self, sandbox_id: str, token: str) -> None:
+        await self.release_script(keys=[self._key(sandbox_id)], args=[token])
@@ -0,0 +1,84 @@
+from typing import Dict, Iterable, Optional, Set
+import hashlib
+import posixpath
+
+"""
+SandboxManifest: path -> sha256 of the files this service has seen in a sandbox.
+Kept up to date on reads, writes and patches so a write of byte-identical
+content can be dropped before it is uploaded. The manifest lives on the cached
+connection: a reconnect starts without one and it is rebuilt from a single
+sha256sum over the project (MANIFEST_COMMAND). Commands can change any file, so
+running one marks the manifest stale: its hashes are kept as hints and a path
+counts again once it was read, written or re-hashed. A write only re-hashes the
+stale paths it could skip (same content as the hint), other writes go through.
+"""
+
+MANIFEST_ROOT = "/home/user"
+
+# dependencies and build output are never written by the agent
+MANIFEST_COMMAND = (
+    f"cd {MANIFEST_ROOT} && find . "
+    "\\( -name node_modules -o -name .next -o -name .git \\) -prune "
+    "-o -type f -print0 | xargs -0 -r sha256sum"
+)
+
+
+# relative paths resolve against the project root like the e2b files api does
+def normalize_path(path: str) -> str:
+    if not path.startswith("/"):
+        path = f"{MANIFEST_ROOT}/{path}"
+    return posixpath.normpath(path)
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class SandboxManifest:
+    def __init__(self, hashes: Optional[Dict[str, str]] = None) -> None:
+        self.hashes: Dict[str, str] = hashes or {}
+        # paths seen since the manifest went stale, None while it is not stale
+        self.verified: Optional[Set[str]] = None
+
+    # parses "<sha256>  ./path" lines, escaped names (leading "\") are skipped
+    @classmethod
+    def from_sha256sum(cls, output: str) -> "SandboxManifest":
+        hashes: Dict[str, str] = {}
+        for line in output.splitlines():
+            digest, _, path = line.partition("  ")
+            if path and not digest.startswith("\\"):
+                hashes[normalize_path(posixpath.join(MANIFEST_ROOT, path))] = digest
+        return cls(hashes)
+
+    def record(self, path: str, content: str) -> None:
+        path = normalize_path(path)
+        self.hashes[path] = content_hash(content)
+        if self.verified is not None:
+            self.verified.add(path)
+
+    # a command ran, any file may have changed
+    def mark_stale(self) -> None:
+        self.verified = set()
+
+    def is_current(self, path: str) -> bool:
+        return self.verified is None or normalize_path(path) in self.verified
+
+    # hashes just read from the sandbox for paths, the missing ones no longer exist
+    def refresh(self, paths: Iterable[str], hashes: Dict[str, str]) -> None:
+        for path in map(normalize_path, paths):
+            if path in hashes:
+                self.hashes[path] = hashes[path]
+            else:
+                self.hashes.pop(path, None)
+            if self.verified is not None:
+                self.verified.add(path)
+
+    # same content as the last known hash, current or not
+    def matches(self, path: str, content: str) -> bool:
+        return self.hashes.get(normalize_path(path)) == content_hash(content)
+
+    def is_unchanged(self, path: str, content: str) -> bool:
+        return self.is_current(path) and self.matches(path, content)
+
+    def __len__(self) -> int:
+        return len(self.hashes)
@@ -0,0 +1,253 @@
+from e2b_code_interpreter import AsyncSandbox
+from collections import deque
+from typing import Deque, Optional, Set
+from services.sandbox_service import SandboxService
+from services.models.sandbox_models import PooledSandbox, SandboxPoolStats
+from api.config import settings
+from utils.logging import logger
+from utils.metrics import record_cache_lookup
+import asyncio
+import time
+
+"""
+SandboxPool: keeps pre-created sandboxes of the nextjs template warm so that
+creating a sandbox for a user is a hand out instead of a full template boot.
+A background task refills the pool after every checkout and extends the timeout
+(set_timeout) of idle sandboxes before they reach it, so a warm sandbox is not
+thrown away and booted again every few minutes. One that cannot be extended (gone,
+or past e2b's maximum lifetime) is retired and replaced. The refill target starts
+at the min size, grows toward the max size when checkouts miss, and shrinks back
+when sandboxes above the min size stay idle for max_idle_seconds.
+Sizes are per process, the dependency splits the deployment's sizes between the
+uvicorn workers (pool_share).
+"""
+
+
+# this worker's share of a deployment wide pool size, rounded up
+def pool_share(size: int, workers: int) -> int:
+    return -(-size // max(workers, 1))
+
+
+class SandboxPool:
+    def __init__(
+        self,
+        sandbox_service: SandboxService,
+        template_id: str,
+        min_size: int,
+        max_size: int,
+        renew_before_seconds: float,
+        max_idle_seconds: float,
+        refill_interval_seconds: float,
+    ) -> None:
+        self.sandbox_service = sandbox_service
+        self.template_id = template_id
+        self.min_size = min_size
+        self.max_size = max(min_size, max_size)
+        self.renew_before_seconds = renew_before_seconds
+        self.max_idle_seconds = max_idle_seconds
+        self.refill_interval_seconds = refill_interval_seconds
+
+        self.idle: Deque[PooledSandbox] = deque()
+        self.target_size = min_size
+        self.creating = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.renewed = 0
+        self.retired = 0
+
+        self._refill_needed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._kill_tasks: Set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        if not self.template_id or self.max_size <= 0:
+            logger.info("sandbox_pool_disabled")
+            return
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            "sandbox_pool_started", min_size=self.min_size, max_size=self.max_size
+        )
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        # warm sandboxes are billed while alive, do not leave them behind
+        idle = list(self.idle)
+        self.idle.clear()
+        await asyncio.gather(
+            *[pooled.sandbox.kill() for pooled in idle], return_exceptions=True
+        )
+        logger.info("sandbox_pool_stopped", killed=len(idle))
+
+    async def checkout(self) -> AsyncSandbox:
+        self._retire_unused()
+
+        while self.idle:
+            pooled = self.idle.popleft()
+            self._refill_needed.set()
+            try:
+                # restart the timeout so the user gets the full sandbox lifetime
+                timeout = settings.e2b_sandbox_timeout_seconds
+                await pooled.sandbox.set_timeout(timeout)
+                self.sandbox_service.connections.put(
+                    pooled.sandbox, expires_at=time.time() + timeout
+                )
+                self.hits += 1
+                record_cache_lookup("sandbox_pool", hit=True)
+                logger.debug(
+                    "sandbox_pool_hit",
+                    sandbox_id=pooled.sandbox.sandbox_id,
+                    idle=len(self.idle),
+                )
+                return pooled.sandbox
+            except Exception as e:
+                logger.warning(
+                    "sandbox_pool_checkout_failed",
+                    sandbox_id=pooled.sandbox.sandbox_id,
+                    error_type=type(e).__name__,
+                    error=str(e),
+                )
+
+        self.misses += 1
+        record_cache_lookup("sandbox_pool", hit=False)
+        self.target_size = min(self.target_size + 1, self.max_size)
+        self._refill_needed.set()
+        logger.info("sandbox_pool_miss", target_size=self.target_size)
+        return await self.sandbox_service.create(template_id=self.template_id)
+
+    # a checked out sandbox left unusable (failed restore), killed now instead of
+    # billed until its timeout
+    async def discard(self, sbx: AsyncSandbox) -> None:
+        self.sandbox_service.connections.invalidate(
+            sbx.sandbox_id, reason="pool_discarded"
+        )
+        await self._kill(sbx)
+
+    def stats(self) -> SandboxPoolStats:
+        return SandboxPoolStats(
+            idle=len(self.idle),
+            creating=self.creating,
+            target_size=self.target_size,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses,
+            renewed=self.renewed,
+            retired=self.retired,
+        )
+
+    async def _run(self) -> None:
+        while True:
+            self._refill_needed.clear()
+            self._retire_unused()
+            await self._renew_expiring()
+            await self._refill()
+
+            try:
+                await asyncio.wait_for(
+                    self._refill_needed.wait(), timeout=self.refill_interval_seconds
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def _refill(self) -> None:
+        missing = self.target_size - len(self.idle) - self.creating
+        if missing <= 0:
+            return
+
+        self.creating += missing
+        results = await asyncio.gather(
+            *[self._create_one() for _ in range(missing)], return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                logger.error(
+                    "sandbox_pool_refill_failed",
+                    error_type=type(result).__name__,
+                    error=str(result),
+                )
+
+    async def _create_one(self) -> None:
+        try:
+            sbx = await self.sandbox_service.create(template_id=self.template_id)
+            self.idle.append(
+                PooledSandbox(
+                    sandbox=sbx,
+                    expires_at=time.time() + settings.e2b_sandbox_timeout_seconds,
+                    idle_since=time.time(),
+                )
+            )
+        finally:
+            self.creating -= 1
+
+    # timed out already, or idle too long while the pool is above its min size
+    def _retire_unused(self) -> None:
+        now = time.time()
+        surplus = len(self.idle) - self.min_size
+        keep: Deque[PooledSandbox] = deque()
+        for pooled in self.idle:
+            expired = pooled.expires_at <= now
+            unused = surplus > 0 and now - pooled.idle_since >= self.max_idle_seconds
+            if not expired and not unused:
+                keep.append(pooled)
+                continue
+
+            surplus -= 1
+            if unused:
+                self.target_size = max(self.target_size - 1, self.min_size)
+            self._retire(pooled)
+        self.idle = keep
+
+    async def _renew_expiring(self) -> None:
+        cutoff = time.time() + self.renew_before_seconds
+        await asyncio.gather(
+            *[
+                self._renew(pooled)
+                for pooled in list(self.idle)
+                if pooled.expires_at <= cutoff
+            ]
+        )
+
+    async def _renew(self, pooled: PooledSandbox) -> None:
+        timeout = settings.e2b_sandbox_timeout_seconds
+        try:
+            await pooled.sandbox.set_timeout(timeout)
+            pooled.expires_at = time.time() + timeout
+            self.renewed += 1
+        except Exception as e:
+            logger.warning(
+                "sandbox_pool_renew_failed",
+                sandbox_id=pooled.sandbox.sandbox_id,
+                error_type=type(e).__name__,
+                error=str(e),
+            )
+            # checked out meanwhile, the checkout set its timeout itself
+            if pooled in self.idle:
+                self.idle.remove(pooled)
+                self._retire(pooled)
+                self._refill_needed.set()
+
+    def _retire(self, pooled: PooledSandbox) -> None:
+        self.retired += 1
+        self.sandbox_service.connections.invalidate(
+            pooled.sandbox.sandbox_id, reason="pool_retired"
+        )
+        kill_task = asyncio.create_task(self._kill(pooled.sandbox))
+        self._kill_tasks.add(kill_task)
+        kill_task.add_done_callback(self._kill_tasks.discard)
+
+    async def _kill(self, sbx: AsyncSandbox) -> None:
+        try:
+            await sbx.kill()
+            logger.debug("sandbox_pool_retired", sandbox_id=sbx.sandbox_id)
+        except Exception as e:
+            logger.warning(
+                "sandbox_pool_retire_failed",
+                sandbox_id=sbx.sandbox_id,
+                error_type=type(e).__name__,
+                error=str(e),
+            )
@@ -1,5 +1,13 @@
-from e2b_code_interpreter import Sandbox, WriteInfo, EntryInfo, CommandResult
+from e2b_code_interpreter import (
+    AsyncSandbox,
+    WriteInfo,
+    EntryInfo,
+    CommandResult,
+    CommandExitException,
+    AsyncCommandHandle,
+)
 from langchain.tools import BaseTool
+from langchain_core.callbacks.manager import adispatch_custom_event
 from services.models.sandbox_models import (
     TerminalInfo,
     WriteEntry,
@@ -7,27 +15,101 @@ from services.models.sandbox_models import (
     ListToolInput,
     WriteToolInput,
     CommandToolInput,
+    PatchEntry,
+    PatchResult,
+    PatchToolInput,
+    SearchToolInput,
+    SandboxSearchResult,
+    SandboxSnapshot,
+    SandboxTree,
+    SandboxTreeEntry,
+    SandboxWriteResult,
+)
+from services.models.ai_models import AIStreamEvent
+from services.sandbox_connection_cache import (
+    SandboxConnectionCache,
+    is_connection_error,
+)
+from services.snapshot_store import SnapshotStore
+from services.sandbox_manifest import (
+    MANIFEST_COMMAND,
+    SandboxManifest,
+    content_hash,
+    normalize_path,
 )
+from api.config import settings
 from pydantic import BaseModel, Field
-from typing import List, Type
+from contextlib import asynccontextmanager
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Type,
+)
+import shlex
 from utils.logging import logger
+from utils.metrics import time_sandbox_operation
+from utils.tracing import sandbox_span
+from utils.output_capture import OutputCapture
+from utils.patch import PatchError, apply_search_replace, apply_unified_diff
+import asyncio
+import time
 
 """
 SandboxService: Handles E2B code execution sandbox operations
 Creates secure sandboxes for running untrusted code
 Manages sandbox lifecycle and file operations
-Provides custom tools for agents to interact with the sandbox 
-None of these are async, forces the llm to do one action at a time.
+Provides custom tools for agents to interact with the sandbox, all async (AsyncSandbox)
+so a slow command never blocks the event loop for other requests.
 """
 
+FORBIDDEN_PATHS = ["/", "/root", "/etc", "/sys", "/proc"]
+DEFAULT_LIST_IGNORE = ["node_modules", ".next", ".git"]
+TREE_TYPES = {"f": "file", "d": "dir", "l": "symlink"}
+
+SNAPSHOT_ARCHIVE = "/tmp/vulx-snapshot.tgz"
+
+# -v lists the archived paths on stdout
+SNAPSHOT_COMMAND = (
+    "cd /home/user && find . "
+    "\\( -name node_modules -o -name .next -o -name .git \\) -prune "
+    "-o -type f -newermt @{since} -print0 "
+    "| tar --null --no-recursion -czvf {archive} -T -"
+)
+
+# -m stamps extracted files with the current time so the next snapshot includes them
+RESTORE_COMMAND = "cd /home/user && tar -xzmf {archive} && rm -f {archive}"
+NPM_INSTALL_COMMAND = "npm install --no-audit --no-fund --prefer-offline"
+PACKAGE_FILES = ("./package.json", "./package-lock.json")
+
+
+class SnapshotNotFoundError(Exception):
+    pass
+
+
+class SnapshotTooLargeError(Exception):
+    pass
+
 
 class SandboxService:
-    def __init__(self) -> None:
+    def __init__(self, snapshot_store: SnapshotStore) -> None:
         try:
+            self.snapshot_store = snapshot_store
+            # connections are reused per sandbox id
+            self.connections = SandboxConnectionCache(
+                max_size=settings.sandbox_connection_cache_size,
+                idle_ttl_seconds=settings.sandbox_connection_idle_ttl_seconds,
+            )
             self.tools: List[BaseTool] = [
                 self.SandboxListTool(sandbox_service=self),
+                self.SandboxSearchTool(sandbox_service=self),
                 self.SandboxReadTool(sandbox_service=self),
                 self.SandboxWriteTool(sandbox_service=self),
+                self.SandboxPatchTool(sandbox_service=self),
                 self.SandboxCommandTool(sandbox_service=self),
             ]
 
@@ -43,20 +125,39 @@ class SandboxService:
     def get_tools(self) -> List[BaseTool]:
         return self.tools
 
-    def create(self, template_id: str) -> Sandbox:
-        sbx = Sandbox.create(
-            template=template_id
-        )  # By default the sandbox is alive for 5 minutes
+    async def create(self, template_id: str) -> AsyncSandbox:
+        timeout = settings.e2b_sandbox_timeout_seconds
+        with time_sandbox_operation("create"), sandbox_span("create") as span:
+            sbx = await AsyncSandbox.create(template=template_id, timeout=timeout)
+            span.set_attribute("sandbox.id", sbx.sandbox_id)
+        self.connections.put(sbx, expires_at=time.time() + timeout)
         return sbx
 
-    def list_files(self, sandbox_id: str, path: str = "/home/user/") -> List[WriteInfo]:
+    # yields a cached connection, a call failing on the connection itself drops it so
+    # the next call reconnects (a missing file or a failed command keeps it),
+    # the whole block is timed and traced as one sandbox operation
+    @asynccontextmanager
+    async def _connect(
+        self, sandbox_id: str, operation: str
+    ) -> AsyncIterator[AsyncSandbox]:
+        with time_sandbox_operation(operation), sandbox_span(operation, sandbox_id):
+            sbx = await self.connections.get(sandbox_id)
+            try:
+                yield sbx
+            except Exception as e:
+                if is_connection_error(e):
+                    self.connections.invalidate(sandbox_id, reason=type(e).__name__)
+                raise
+
+    async def list_files(
+        self, sandbox_id: str, path: str = "/home/user/"
+    ) -> List[WriteInfo]:
         # path check
-        forbidden_paths = ["/", "/root", "/etc", "/sys", "/proc"]
-        if path in forbidden_paths:
+        if path in FORBIDDEN_PATHS:
             raise Exception(f"do not access the following path: {path} in the sandbox")
 
-        sbx = Sandbox.connect(sandbox_id=sandbox_id)
-        sandbox_files: List[EntryInfo] = sbx.files.list(path)
+        async with self._connect(sandbox_id, "list") as sbx:
+            sandbox_files: List[EntryInfo] = await sbx.files.list(path)
         files: List[WriteInfo] = []
         for sandbox_file in sandbox_files:
             files.append(
@@ -68,35 +169,533 @@ class SandboxService:
             )
         return files
 
-    def read_file(self, sandbox_id: str, path: str) -> str:
-        sbx = Sandbox.connect(sandbox_id=sandbox_id)
-        file_content: str = sbx.files.read(path=path)
+    # one find command (depth limited, node_modules, .next and .git skipped by default)
+    # instead of one list call per directory
+    async def list_tree(
+        self,
+        sandbox_id: str,
+        path: str = "/home/user/",
+        depth: int = 3,
+        ignore: Optional[List[str]] = None,
+    ) -> SandboxTree:
+        if path in FORBIDDEN_PATHS:
+            raise Exception(f"do not access the following path: {path} in the sandbox")
+
+        ignore = DEFAULT_LIST_IGNORE if ignore is None else ignore
+        prune = ""
+        if ignore:
+            names = " -o ".join(f"-name {shlex.quote(name)}" for name in ignore)
+            prune = f"\\( {names} \\) -prune -o "
+        # one extra line tells a truncated listing apart from an exact fit
+        limit = settings.sandbox_list_max_entries
+        command = (
+            f"cd {shlex.quote(path)} && find . -mindepth 1 -maxdepth {depth} {prune}"
+            f"-printf '%y\\t%s\\t%T@\\t%P\\n' | head -n {limit + 1}"
+        )
+        async with self._connect(sandbox_id, "list") as sbx:
+            result: CommandResult = await sbx.commands.run(cmd=command)
+
+        entries: List[SandboxTreeEntry] = []
+        for line in result.stdout.splitlines():
+            parts = line.split("\t", 3)
+            if len(parts) != 4:
+                continue
+            kind, size, modified_at, entry_path = parts
+            entries.append(
+                SandboxTreeEntry(
+                    path=entry_path,
+                    type=TREE_TYPES.get(kind, "other"),
+                    size=int(size),
+                    modified_at=float(modified_at),
+                )
+            )
+        entries.sort(key=lambda entry: entry.path.split("/"))
+        return SandboxTree(
+            path=path, entries=entries[:limit], truncated=len(entries) > limit
+        )
+
+    # ripgrep, or grep when the template lacks it, only the matching lines come back
+    async def search(
+        self,
+        sandbox_id: str,
+        pattern: str,
+        path: str = "/home/user/",
+        glob: Optional[str] = None,
+        context: int = 0,
+        ignore_case: bool = False,
+        fixed_strings: bool = False,
+    ) -> SandboxSearchResult:
+        if path in FORBIDDEN_PATHS:
+            raise Exception(f"do not access the following path: {path} in the sandbox")
+
+        # both print path:line:text for matches and path-line-text for context
+        rg = [
+            "rg",
+            "--no-heading",
+            "--line-number",
+            "--color",
+            "never",
+            "-C",
+            str(context),
+        ]
+        grep = ["grep", "-rnI", "-C", str(context), "-F" if fixed_strings else "-E"]
+        if ignore_case:
+            rg.append("-i")
+            grep.append("-i")
+        if fixed_strings:
+            rg.append("-F")
+        for name in DEFAULT_LIST_IGNORE:
+            rg += ["--glob", f"!{name}"]
+            grep.append(f"--exclude-dir={name}")
+        if glob:
+            rg += ["--glob", glob]
+            grep.append(f"--include={glob}")
+        rg += ["-e", pattern, "."]
+        grep += ["-e", pattern, "."]
+
+        # one extra line tells a truncated result apart from an exact fit
+        limit = settings.sandbox_search_max_lines
+        command = (
+            f"cd {shlex.quote(path)} && "
+            f"{{ if command -v rg >/dev/null 2>&1; then {shlex.join(rg)}; "
+            f"else {shlex.join(grep)}; fi; }} "
+            f"| cut -c1-{settings.sandbox_search_max_columns} | head -n {limit + 1}"
+        )
+        async with self._connect(sandbox_id, "search") as sbx:
+            result: CommandResult = await sbx.commands.run(cmd=command)
+
+        # no matches and an error (bad regex) instead of just an empty result
+        if not result.stdout and result.stderr:
+            raise Exception(result.stderr.strip())
+
+        lines = [line.removeprefix("./") for line in result.stdout.splitlines()]
+        return SandboxSearchResult(
+            pattern=pattern,
+            path=path,
+            output="\n".join(lines[:limit]),
+            lines=min(len(lines), limit),
+            truncated=len(lines) > limit,
+        )
+
+    async def read_file(self, sandbox_id: str, path: str) -> str:
+        async with self._connect(sandbox_id, "read") as sbx:
+            file_content: str = await sbx.files.read(path=path)
+        self._record_in_manifest(sandbox_id, {path: file_content})
         return file_content
 
-    def write_files(
+    # files whose content hash matches the sandbox manifest are skipped, agents often
+    # rewrite files they did not change
+    async def write_files(
         self, sandbox_id: str, write_data: List[WriteEntry]
-    ) -> List[WriteInfo]:
-        sbx = Sandbox.connect(sandbox_id)
+    ) -> SandboxWriteResult:
+        manifest = await self._get_manifest(sandbox_id)
+        if manifest:
+            # a command ran since these were seen, only those that could be skipped
+            unverified = [
+                item.path
+                for item in write_data
+                if not manifest.is_current(item.path)
+                and manifest.matches(item.path, item.data)
+            ]
+            if unverified:
+                await self._rehash(sandbox_id, manifest, unverified)
+        changed: List[WriteEntry] = []
+        skipped: List[str] = []
+        skipped_bytes = 0
+        for item in write_data:
+            if manifest and manifest.is_unchanged(item.path, item.data):
+                skipped.append(item.path)
+                skipped_bytes += len(item.data.encode())
+            else:
+                changed.append(item)
+
+        if skipped:
+            logger.info(
+                "sandbox_write_skipped_unchanged",
+                sandbox_id=sandbox_id,
+                files_skipped=len(skipped),
+                bytes_skipped=skipped_bytes,
+                files_written=len(changed),
+            )
+        if not changed:
+            return SandboxWriteResult(
+                written=[], skipped=skipped, skipped_bytes=skipped_bytes
+            )
+
         dict_data = [
-            item.model_dump() for item in write_data
+            item.model_dump() for item in changed
         ]  # converts pydantic model into a proper dict data structure for the sandbox api
-        result: List[WriteInfo] = sbx.files.write_files(files=dict_data)  # type: ignore
-        return result
+        async with self._connect(sandbox_id, "write") as sbx:
+            result: List[WriteInfo] = await sbx.files.write_files(files=dict_data)  # type: ignore
+        self._record_in_manifest(sandbox_id, {item.path: item.data for item in changed})
+        return SandboxWriteResult(
+            written=result, skipped=skipped, skipped_bytes=skipped_bytes
+        )
 
-    def execute_terminal_command(self, sandbox_id: str, command: str) -> TerminalInfo:
-        sbx = Sandbox.connect(sandbox_id)
-        result: CommandResult = sbx.commands.run(cmd=command)
-        return TerminalInfo(stdout=result.stdout, stderr=result.stderr)
+    # one sha256sum over the project instead of a read per file
+    async def rebuild_manifest(self, sandbox_id: str) -> SandboxManifest:
+        try:
+            async with self._connect(sandbox_id, "manifest") as sbx:
+                result: CommandResult = await sbx.commands.run(
+                    cmd=MANIFEST_COMMAND,
+                    timeout=settings.sandbox_manifest_build_timeout_seconds,
+                )
+            output = result.stdout
+        except CommandExitException as e:
+            output = e.stdout  # unreadable files, the rest was still hashed
+        except Exception as e:
+            # an empty manifest still fills up from reads and writes
+            logger.warning(
+                "sandbox_manifest_build_failed",
+                sandbox_id=sandbox_id,
+                error_type=type(e).__name__,
+                error=str(e),
+            )
+            output = ""
 
-    class SandboxListTool(BaseTool):
-        name: str = "list_sandbox_files"
-        description: str = "List all files and directories in a sandbox directory. Provide sandbox_id and optional directory path."
+        manifest = SandboxManifest.from_sha256sum(output)
+        self.connections.set_manifest(sandbox_id, manifest)
+        logger.debug(
+            "sandbox_manifest_built", sandbox_id=sandbox_id, files=len(manifest)
+        )
+        return manifest
+
+    # sha256sum of a few paths, they stay unverified (and are written) when it fails
+    async def _rehash(
+        self, sandbox_id: str, manifest: SandboxManifest, paths: List[str]
+    ) -> None:
+        command = "sha256sum -- " + " ".join(
+            shlex.quote(normalize_path(path)) for path in paths
+        )
+        try:
+            async with self._connect(sandbox_id, "manifest") as sbx:
+                result: CommandResult = await sbx.commands.run(
+                    cmd=command,
+                    timeout=settings.sandbox_manifest_build_timeout_seconds,
+                )
+            output = result.stdout
+        except CommandExitException as e:
+            output = e.stdout  # missing files, the others were still hashed
+        except Exception as e:
+            logger.warning(
+                "sandbox_manifest_rehash_failed",
+                sandbox_id=sandbox_id,
+                error_type=type(e).__name__,
+                error=str(e),
+            )
+            return
+        manifest.refresh(paths, SandboxManifest.from_sha256sum(output).hashes)
+        logger.debug(
+            "sandbox_manifest_rehashed", sandbox_id=sandbox_id, files=len(paths)
+        )
+
+    async def _get_manifest(self, sandbox_id: str) -> Optional[SandboxManifest]:
+        if not settings.sandbox_write_manifest_enabled:
+            return None
+        manifest = self.connections.get_manifest(sandbox_id)
+        if manifest is None:
+            manifest = await self.rebuild_manifest(sandbox_id)
+        return manifest
+
+    def _mark_manifest_stale(self, sandbox_id: str) -> None:
+        manifest = self.connections.get_manifest(sandbox_id)
+        if manifest is not None:
+            manifest.mark_stale()
+
+    def _record_in_manifest(self, sandbox_id: str, files: Dict[str, str]) -> None:
+        manifest = self.connections.get_manifest(sandbox_id)
+        if manifest is None:
+            return
+        for path, content in files.items():
+            manifest.record(path, content)
+
+    # diffs or search/replace edits, the agent does not send whole files back for small
+    # changes. patches are applied in order (several may target one file), a file is
+    # only written when at least one of its patches applied
+    async def apply_patches(
+        self, sandbox_id: str, patches: List[PatchEntry]
+    ) -> List[PatchResult]:
+        paths = list(dict.fromkeys(patch.path for patch in patches))
+        async with self._connect(sandbox_id, "patch") as sbx:
+            originals = await asyncio.gather(
+                *[sbx.files.read(path=path) for path in paths], return_exceptions=True
+            )
+
+        contents: Dict[str, str] = {}
+        read_errors: Dict[str, str] = {}
+        for path, original in zip(paths, originals):
+            if isinstance(original, BaseException):
+                read_errors[path] = f"could not read the file: {str(original)}"
+            else:
+                contents[path] = original
+        self._record_in_manifest(sandbox_id, contents)
+
+        results: List[PatchResult] = []
+        patched_paths: List[str] = []
+        for patch in patches:
+            if patch.path in read_errors:
+                results.append(
+                    PatchResult(path=patch.path, error=read_errors[patch.path])
+                )
+                continue
+            try:
+                content, hunks = self._apply_patch(contents[patch.path], patch)
+            except PatchError as e:
+                results.append(PatchResult(path=patch.path, error=str(e)))
+                continue
+
+            contents[patch.path] = content
+            patched_paths.append(patch.path)
+            results.append(
+                PatchResult(
+                    path=patch.path,
+                    hunks=hunks,
+                    sha256=content_hash(content),
+                    content=content,
+                )
+            )
+
+        writes = [
+            WriteEntry(path=path, data=contents[path])
+            for path in dict.fromkeys(patched_paths)
+        ]
+        if writes:
+            await self.write_files(sandbox_id=sandbox_id, write_data=writes)
+        return results
+
+    # the project files changed since boot (the template files are older) as one
+    # tarball, deleted template files are not tracked
+    async def snapshot(self, sandbox_id: str) -> SandboxSnapshot:
+        async with self._connect(sandbox_id, "snapshot") as sbx:
+            info = await sbx.get_info()
+            result: CommandResult = await sbx.commands.run(
+                cmd=SNAPSHOT_COMMAND.format(
+                    since=int(info.started_at.timestamp()), archive=SNAPSHOT_ARCHIVE
+                ),
+                timeout=settings.sandbox_snapshot_timeout_seconds,
+            )
+            archive = bytes(await sbx.files.read(SNAPSHOT_ARCHIVE, format="bytes"))
+
+        if len(archive) > settings.sandbox_snapshot_max_bytes:
+            raise SnapshotTooLargeError(
+                f"snapshot of sandbox {sandbox_id} is {len(archive)} bytes, the limit is {settings.sandbox_snapshot_max_bytes}"
+            )
+
+        files = [line for line in result.stdout.splitlines() if line]
+        snapshot = SandboxSnapshot(
+            sandbox_id=sandbox_id,
+            created_at=time.time(),
+            files=[file.removeprefix("./") for file in files],
+            size_bytes=len(archive),
+            packages_changed=any(file in PACKAGE_FILES for file in files),
+        )
+        await self.snapshot_store.save(snapshot, archive)
+        logger.info(
+            "sandbox_snapshot_created",
+            sandbox_id=sandbox_id,
+            files=len(files),
+            size_bytes=len(archive),
+            packages_changed=snapshot.packages_changed,
+        )
+        return snapshot
+
+    # restores the latest snapshot of source_sandbox_id into sandbox_id (a fresh sandbox):
+    # one upload, one extract and one npm install when the dependencies changed
+    async def restore(self, sandbox_id: str, source_sandbox_id: str) -> SandboxSnapshot:
+        stored = await self.snapshot_store.get_archive(source_sandbox_id)
+        if stored is None:
+            raise SnapshotNotFoundError(f"no snapshot for sandbox {source_sandbox_id}")
+        snapshot, archive = stored
+
+        command = RESTORE_COMMAND.format(archive=SNAPSHOT_ARCHIVE)
+        if snapshot.packages_changed:
+            command = f"{command} && {NPM_INSTALL_COMMAND}"
+
+        start = time.monotonic()
+        self.connections.set_manifest(sandbox_id, None)
+        async with self._connect(sandbox_id, "restore") as sbx:
+            await sbx.files.write(SNAPSHOT_ARCHIVE, archive)
+            await sbx.commands.run(
+                cmd=command, timeout=settings.sandbox_restore_timeout_seconds
+            )
+
+        # the new sandbox starts out with the same snapshot in case it expires unchanged
+        restored = snapshot.model_copy(update={"sandbox_id": sandbox_id})
+        await self.snapshot_store.save(restored, archive)
+        logger.info(
+            "sandbox_snapshot_restored",
+            sandbox_id=sandbox_id,
+            source_sandbox_id=source_sandbox_id,
+            files=len(snapshot.files),
+            npm_install=snapshot.packages_changed,
+            duration_seconds=round(time.monotonic() - start, 2),
+        )
+        return restored
+
+    def _apply_patch(self, content: str, patch: PatchEntry) -> Tuple[str, int]:
+        if patch.diff and patch.edits:
+            raise PatchError("give either a diff or edits, not both")
+        if patch.diff:
+            return apply_unified_diff(content, patch.diff)
+        if patch.edits:
+            return apply_search_replace(content, patch.edits)
+        raise PatchError("patch has neither a diff nor edits")
+
+    # a non-zero exit is a result (exit_code), not an error, so is a timeout (timed_out),
+    # the command is killed when the caller is cancelled, only the head and tail of its
+    # output is kept (OutputCapture)
+    async def execute_terminal_command(
+        self,
+        sandbox_id: str,
+        command: str,
+        timeout_seconds: Optional[float] = None,
+        on_output: Optional[Callable[[str, str], Awaitable[None]]] = None,
+    ) -> TerminalInfo:
+        timeout = min(
+            timeout_seconds or settings.sandbox_command_timeout_seconds,
+            settings.sandbox_command_max_timeout_seconds,
+        )
+        captures = {
+            stream: OutputCapture(
+                head_bytes=settings.sandbox_command_output_head_bytes,
+                tail_bytes=settings.sandbox_command_output_tail_bytes,
+            )
+            for stream in ("stdout", "stderr")
+        }
+
+        def output_handler(stream: str) -> Callable[[str], Awaitable[None]]:
+            async def handle_output(chunk: str) -> None:
+                captures[stream].append(chunk)
+                if on_output:
+                    await on_output(stream, chunk)
+
+            return handle_output
+
+        exit_code: Optional[int] = None
+        timed_out = False
+        # any command can change files, the next writes re-hash what they would skip
+        self._mark_manifest_stale(sandbox_id)
+        try:
+            async with self._connect(sandbox_id, "command") as sbx:
+                # timeout=0 lifts the e2b connection limit (60s), the deadline is enforced here
+                handle = await sbx.commands.run(
+                    cmd=command,
+                    background=True,
+                    on_stdout=output_handler("stdout"),
+                    on_stderr=output_handler("stderr"),
+                    timeout=0,
+                )
+                try:
+                    result: CommandResult = await asyncio.wait_for(
+                        handle.wait(), timeout=timeout
+                    )
+                    exit_code = result.exit_code
+                except CommandExitException as e:
+                    exit_code = e.exit_code
+                except asyncio.TimeoutError:
+                    timed_out = True
+                    await self._kill_command(sandbox_id, handle, reason="timeout")
+                except asyncio.CancelledError:
+                    # the agent run was cancelled, do not leave the command running in the sandbox
+                    await self._kill_command(sandbox_id, handle, reason="cancelled")
+                    raise
+        finally:
+            self._mark_manifest_stale(sandbox_id)
+
+        return TerminalInfo(
+            stdout=captures["stdout"].text(),
+            stderr=captures["stderr"].text(),
+            exit_code=exit_code,
+            timed_out=timed_out,
+            truncated_bytes=sum(capture.dropped_bytes for capture in captures.values()),
+        )
+
+    # output chunks as "stdout" / "stderr" events while the command runs, then a "result"
+    async def stream_terminal_command(
+        self, sandbox_id: str, command: str, timeout_seconds: Optional[float] = None
+    ) -> AsyncIterator[AIStreamEvent]:
+        events: asyncio.Queue[AIStreamEvent] = asyncio.Queue()
+
+        async def on_output(stream: str, chunk: str) -> None:
+            await events.put(AIStreamEvent(event=stream, data={"text": chunk}))
+
+        command_task = asyncio.create_task(
+            self.execute_terminal_command(
+                sandbox_id=sandbox_id,
+                command=command,
+                timeout_seconds=timeout_seconds,
+                on_output=on_output,
+            )
+        )
+        try:
+            while not command_task.done():
+                next_event = asyncio.ensure_future(events.get())
+                await asyncio.wait(
+                    {next_event, command_task}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if next_event.done():
+                    yield next_event.result()
+                else:
+                    next_event.cancel()
+            while not events.empty():
+                yield events.get_nowait()
+
+            result: TerminalInfo = command_task.result()
+            yield AIStreamEvent(event="result", data=result.model_dump())
+        finally:
+            # client gone, the cancelled command is killed in the sandbox
+            command_task.cancel()
+            await asyncio.gather(command_task, return_exceptions=True)
+
+    async def _kill_command(
+        self, sandbox_id: str, handle: AsyncCommandHandle, reason: str
+    ) -> None:
+        try:
+            await handle.kill()
+            logger.info(
+                "sandbox_command_killed",
+                sandbox_id=sandbox_id,
+                pid=handle.pid,
+                reason=reason,
+            )
+        except Exception as e:
+            logger.warning(
+                "sandbox_command_kill_failed",
+                sandbox_id=sandbox_id,
+                pid=handle.pid,
+                error_type=type(e).__name__,
+                error=str(e),
+            )
+
+    # shared base for the agent tools, the agent executor only calls the async path
+    class SandboxTool(BaseTool):
         sandbox_service: "SandboxService" = Field(exclude=True)
+
+        # BaseTool requires a sync entry point, these tools cannot have one: the cached
+        # AsyncSandbox connections belong to the server's event loop, running a tool on
+        # another loop (what a sync wrapper would do) would break them
+        def _run(self, *args, **kwargs) -> str:
+            raise RuntimeError(
+                f"{self.name} is async only, call it with ainvoke / arun "
+                "(the code agent runs through AgentExecutor.ainvoke or astream_events)"
+            )
+
+    class SandboxListTool(SandboxTool):
+        name: str = "list_sandbox_files"
+        description: str = "List files and directories in a sandbox directory. Provide sandbox_id and directory path, set depth to list nested directories in one call (node_modules, .next and .git are skipped unless ignore is given)."
         args_schema: Type[BaseModel] = ListToolInput
 
-        def _run(self, sandbox_id: str, path: str) -> str:
+        async def _arun(
+            self,
+            sandbox_id: str,
+            path: str,
+            depth: int = 1,
+            ignore: Optional[List[str]] = None,
+        ) -> str:
+            if depth > 1 or ignore is not None:
+                return await self._list_tree(sandbox_id, path, depth, ignore)
             try:
-                files: List[WriteInfo] = self.sandbox_service.list_files(
+                files: List[WriteInfo] = await self.sandbox_service.list_files(
                     sandbox_id=sandbox_id, path=path
                 )
 
@@ -109,58 +708,188 @@ class SandboxService:
             except Exception as e:
                 return f"failed to list files in '{path}' from sandbox {sandbox_id}. error: {str(e)}"
 
-    class SandboxReadTool(BaseTool):
+        # indented tree, directories end with "/", files show their size
+        async def _list_tree(
+            self,
+            sandbox_id: str,
+            path: str,
+            depth: int,
+            ignore: Optional[List[str]],
+        ) -> str:
+            try:
+                tree: SandboxTree = await self.sandbox_service.list_tree(
+                    sandbox_id=sandbox_id, path=path, depth=depth, ignore=ignore
+                )
+            except Exception as e:
+                return f"failed to list files in '{path}' from sandbox {sandbox_id}. error: {str(e)}"
+
+            lines = []
+            for entry in tree.entries:
+                parts = entry.path.split("/")
+                indent = "  " * (len(parts) - 1)
+                if entry.type == "dir":
+                    lines.append(f"{indent}{parts[-1]}/")
+                else:
+                    lines.append(f"{indent}{parts[-1]} ({entry.size} B)")
+            if tree.truncated:
+                lines.append(
+                    f"... listing stopped at {len(tree.entries)} entries, list a subdirectory or lower the depth"
+                )
+
+            tree_text = "\n".join(lines)
+            return f"Successfully listed files from sandbox {sandbox_id}\nDirectory: {path} (depth {depth})\nTotal items: {len(tree.entries)}\n{tree_text}"
+
+    class SandboxSearchTool(SandboxTool):
+        name: str = "search_sandbox"
+        description: str = "Search file contents in the sandbox (like ripgrep) and get only the matching lines as path:line:text. Provide sandbox_id and a regex pattern, optionally a path, a file glob (e.g. *.tsx) and context lines. Use it to find props, exports or usages instead of reading whole files."
+        args_schema: Type[BaseModel] = SearchToolInput
+
+        async def _arun(
+            self,
+            sandbox_id: str,
+            pattern: str,
+            path: str = "/home/user/",
+            glob: Optional[str] = None,
+            context: int = 0,
+            ignore_case: bool = False,
+            fixed_strings: bool = False,
+        ) -> str:
+            try:
+                result: SandboxSearchResult = await self.sandbox_service.search(
+                    sandbox_id=sandbox_id,
+                    pattern=pattern,
+                    path=path,
+                    glob=glob,
+                    context=context,
+                    ignore_case=ignore_case,
+                    fixed_strings=fixed_strings,
+                )
+            except Exception as e:
+                return f"failed to search '{pattern}' in '{path}' in sandbox {sandbox_id}. error: {str(e)}"
+
+            if not result.output:
+                return f"No matches for '{pattern}' in {path}"
+            truncated = (
+                f"\n... output stopped at {result.lines} lines, narrow the path, glob or pattern"
+                if result.truncated
+                else ""
+            )
+            return (
+                f"Search results for '{pattern}' in {path}\n{result.output}{truncated}"
+            )
+
+    class SandboxReadTool(SandboxTool):
         name: str = "read_sandbox_file"
         description: str = "Read a single file in the sandbox. To access the sandbox, the first parameter must be the sandbox_id and the second must be the path of the file."
-        sandbox_service: "SandboxService" = Field(exclude=True)
         args_schema: Type[BaseModel] = ReadToolInput
 
-        def _run(self, sandbox_id: str, path: str) -> str:
+        async def _arun(self, sandbox_id: str, path: str) -> str:
             try:
-                file_content: str = self.sandbox_service.read_file(
+                file_content: str = await self.sandbox_service.read_file(
                     sandbox_id=sandbox_id, path=path
                 )
                 return f"Successfully read file from sandbox {sandbox_id}\nPath: {path}\nContent: {file_content}"
             except Exception as e:
                 return f"failed to read file '{path}' from sandbox {sandbox_id}. error: {str(e)}"
 
-    class SandboxWriteTool(BaseTool):
+    class SandboxWriteTool(SandboxTool):
         name: str = "write_sandbox_files"
         description: str = "Write one or more files to the sandbox. Provide sandbox_id and a list of files with their paths and content."
-        sandbox_service: "SandboxService" = Field(exclude=True)
         args_schema: Type[BaseModel] = WriteToolInput
 
-        def _run(self, sandbox_id: str, write_data: List[WriteEntry]) -> str:
+        async def _arun(self, sandbox_id: str, write_data: List[WriteEntry]) -> str:
             try:
-                result: List[WriteInfo] = self.sandbox_service.write_files(
+                result: SandboxWriteResult = await self.sandbox_service.write_files(
                     sandbox_id=sandbox_id, write_data=write_data
                 )
 
                 written_files = []
-                for file in result:
+                for file in result.written:
                     written_files.append(
                         f"Successfully wrote {file.type}: {file.name} to: {file.path}"
                     )
+                for path in result.skipped:
+                    written_files.append(f"Unchanged, not rewritten: {path}")
 
                 files_text = "\n".join(written_files)
-                return f"Successfully wrote {len(result)} file(s) to sandbox {sandbox_id}\nFiles written:\n{files_text}"
+                return f"Successfully wrote {len(result.written)} file(s) to sandbox {sandbox_id} ({len(result.skipped)} unchanged)\nFiles written:\n{files_text}"
             except Exception as e:
                 return f"failed to write files to sandbox {sandbox_id}. error: {str(e)}"
 
-    class SandboxCommandTool(BaseTool):
+    class SandboxPatchTool(SandboxTool):
+        name: str = "apply_sandbox_patch"
+        description: str = "Edit existing files in the sandbox without rewriting them. Provide sandbox_id and a list of patches, each with the file path and either a unified diff (@@ hunks with context lines) or search/replace edits (search text must be unique in the file). Returns the sha256 of each patched file."
+        args_schema: Type[BaseModel] = PatchToolInput
+
+        async def _arun(self, sandbox_id: str, patches: List[PatchEntry]) -> str:
+            try:
+                results: List[PatchResult] = await self.sandbox_service.apply_patches(
+                    sandbox_id=sandbox_id, patches=patches
+                )
+            except Exception as e:
+                return f"failed to patch files in sandbox {sandbox_id}. error: {str(e)}"
+
+            # the callback records the patched content, the llm only gets the hashes
+            patched = {
+                result.path: result.content
+                for result in results
+                if result.content is not None
+            }
+            if patched:
+                await adispatch_custom_event(
+                    "sandbox_files_patched", {"files": patched}
+                )
+
+            lines = []
+            for result in results:
+                if result.error:
+                    lines.append(
+                        f"failed to patch {result.path}: {result.error}. Re-read the file and retry."
+                    )
+                else:
+                    lines.append(
+                        f"Patched {result.path} ({result.hunks} change(s), sha256 {result.sha256})"
+                    )
+
+            patched_count = len([result for result in results if not result.error])
+            results_text = "\n".join(lines)
+            return f"Applied {patched_count} of {len(results)} patch(es) in sandbox {sandbox_id}\n{results_text}"
+
+    class SandboxCommandTool(SandboxTool):
         name: str = "execute_sandbox_command"
-        description: str = "Execute a terminal command in the sandbox. Provide sandbox_id and the command to run."
-        sandbox_service: "SandboxService" = Field(exclude=True)
+        description: str = "Execute a terminal command in the sandbox. Provide sandbox_id, the command to run and optionally timeout_seconds. Long output is cut to its head and tail."
         args_schema: Type[BaseModel] = CommandToolInput
 
-        def _run(self, sandbox_id: str, command: str) -> str:
+        async def _arun(
+            self,
+            sandbox_id: str,
+            command: str,
+            timeout_seconds: Optional[int] = None,
+        ) -> str:
             try:
-                result: TerminalInfo = self.sandbox_service.execute_terminal_command(
-                    sandbox_id=sandbox_id, command=command
+                result: TerminalInfo = (
+                    await self.sandbox_service.execute_terminal_command(
+                        sandbox_id=sandbox_id,
+                        command=command,
+                        timeout_seconds=timeout_seconds,
+                    )
                 )
 
-                output_parts = [f"Successfully executed in sandbox {sandbox_id}"]
+                if result.timed_out:
+                    output_parts = [
+                        f"Command timed out and was killed in sandbox {sandbox_id}, retry with a larger timeout_seconds if it needs more time"
+                    ]
+                elif result.exit_code:
+                    output_parts = [
+                        f"Command failed with exit code {result.exit_code} in sandbox {sandbox_id}"
+                    ]
+                else:
+                    output_parts = [f"Successfully executed in sandbox {sandbox_id}"]
                 output_parts.append(f"Command: {command}")
+                if result.truncated_bytes:
+                    output_parts.append(
+                        f"Output truncated, {result.truncated_bytes} bytes omitted from the middle"
+                    )
 
                 if result.stdout:
                     output_parts.append(f"\nStdout:\n{result.stdout}")
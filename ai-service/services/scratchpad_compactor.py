@@ -0,0 +1,156 @@
+from langchain.agents.format_scratchpad.tools import format_to_tool_messages
+from langchain_core.agents import AgentAction
+from langchain_core.messages import BaseMessage
+from services.admission_controller import estimate_tokens
+from services.agent_executor import ALL_PATHS, READ, WRITE, tool_access
+from services.sandbox_manifest import MANIFEST_ROOT, content_hash, normalize_path
+from typing import Any, List, Sequence, Tuple
+from utils.logging import logger
+import posixpath
+import re
+
+"""
+ScratchpadCompactor: builds the code agent scratchpad (the tool calls and results
+of the run so far) with old tool results shortened, every llm step resends it whole.
+Only the steps below a cut-off are compacted, the cut-off keeps at least
+keep_recent_steps untouched and moves in blocks of block_steps, and what happens below
+it depends on those steps alone. Between two moves the compacted part is byte
+identical from step to step, so the provider prompt cache (static system prefix)
+keeps covering the scratchpad too, a move invalidates it once per block.
+Two passes over the steps below the cut-off:
+- stale results are always replaced: a read of a file that was read again, or
+  written, patched or named by a command (the file or a folder above it) after it,
+  a build or install that does not name the file leaves the read alone
+- when those steps are still over max_tokens, the largest remaining results
+  (command logs, listings, reads) are replaced, oldest first among equals, the
+  recent steps come on top of the ceiling
+A replaced result keeps its size and content hash so the agent knows what it had
+and reads the file again when it needs it. The tool calls themselves are kept.
+"""
+
+MIN_COMPACT_TOKENS = 50
+READ_TOOL = "read_sandbox_file"
+
+
+def observation_tokens(observation: Any) -> int:
+    return len(str(observation)) // 4 + 1
+
+
+def summarize(action: AgentAction, observation: Any, reason: str) -> str:
+    text = str(observation)
+    first_line = text.strip().split("\n", 1)[0][:120]
+    return (
+        f"[{action.tool} result removed to save context ({reason}): "
+        f"{text.count(chr(10)) + 1} lines, ~{observation_tokens(text)} tokens, "
+        f"sha256 {content_hash(text)[:12]}, started with {first_line!r}]"
+    )
+
+
+# words of a shell command that could be paths (split on whitespace and operators)
+COMMAND_WORD = re.compile(r"[^\s;&|<>()'\"`=]+")
+
+
+# the command names the file or a folder above it (the sandbox root itself excluded)
+def command_touches(command: str, path: str) -> bool:
+    for word in COMMAND_WORD.findall(command):
+        if word.startswith("-"):
+            continue
+        named = normalize_path(word)
+        if named == path or (
+            named != MANIFEST_ROOT and posixpath.commonpath([named, path]) == named
+        ):
+            return True
+    return False
+
+
+class ScratchpadCompactor:
+    def __init__(
+        self, max_tokens: int, keep_recent_steps: int, block_steps: int
+    ) -> None:
+        self.max_tokens = max_tokens
+        self.keep_recent_steps = keep_recent_steps
+        self.block_steps = max(block_steps, 1)
+
+    # last cut-off at a block boundary that leaves keep_recent_steps after it
+    def cutoff(self, steps: int) -> int:
+        compactable = max(steps - self.keep_recent_steps, 0)
+        return compactable - compactable % self.block_steps
+
+    def format(
+        self, intermediate_steps: Sequence[Tuple[AgentAction, Any]]
+    ) -> List[BaseMessage]:
+        steps = list(intermediate_steps)
+        compactable = self.cutoff(len(steps))
+        if compactable == 0:
+            return format_to_tool_messages(steps)
+
+        replaced = set()
+        tokens_saved = 0
+
+        def replace(index: int, reason: str) -> None:
+            nonlocal tokens_saved
+            action, observation = steps[index]
+            summary = summarize(action, observation, reason)
+            tokens_saved += observation_tokens(observation) - observation_tokens(
+                summary
+            )
+            steps[index] = (action, summary)
+            replaced.add(index)
+
+        for index in range(compactable):
+            if observation_tokens(steps[index][1]) >= MIN_COMPACT_TOKENS and (
+                self._is_stale(steps[:compactable], index)
+            ):
+                replace(index, "the file changed or was read again later")
+
+        tokens = estimate_tokens(format_to_tool_messages(steps[:compactable]))
+        if self.max_tokens and tokens > self.max_tokens:
+            # biggest results first, the fewest replacements get under the ceiling
+            candidates = sorted(
+                (
+                    index
+                    for index in range(compactable)
+                    if index not in replaced
+                    and observation_tokens(steps[index][1]) >= MIN_COMPACT_TOKENS
+                ),
+                key=lambda index: (-observation_tokens(steps[index][1]), index),
+            )
+            for index in candidates:
+                if tokens <= self.max_tokens:
+                    break
+                before = observation_tokens(steps[index][1])
+                replace(index, "old result, over the context budget")
+                tokens -= before - observation_tokens(steps[index][1])
+
+        messages = format_to_tool_messages(steps)
+        if replaced:
+            logger.info(
+                "agent_scratchpad_compacted",
+                steps=len(steps),
+                compacted_results=len(replaced),
+                tokens_saved=tokens_saved,
+                scratchpad_tokens=estimate_tokens(messages),
+            )
+        return messages
+
+    # a later read, write or patch of the same file or a command naming it
+    def _is_stale(self, steps: List[Tuple[AgentAction, Any]], index: int) -> bool:
+        action = steps[index][0]
+        access = tool_access(action.tool, action.tool_input)
+        if action.tool != READ_TOOL or access.mode != READ:
+            return False
+        (path,) = access.paths
+        for later, _ in steps[index + 1 :]:
+            later_access = tool_access(later.tool, later.tool_input)
+            if later.tool == READ_TOOL and later_access.paths == access.paths:
+                return True
+            if later_access.mode != WRITE:
+                continue
+            if ALL_PATHS not in later_access.paths:
+                if path in later_access.paths:
+                    return True
+            elif isinstance(later.tool_input, dict) and command_touches(
+                str(later.tool_input.get("command", "")), path
+            ):
+                return True
+        return False
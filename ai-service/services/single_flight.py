@@ -0,0 +1,60 @@
+from typing import Any, Awaitable, Callable, Dict
+from utils.logging import logger
+from utils.metrics import SINGLE_FLIGHT_COALESCED
+import asyncio
+
+"""
+SingleFlight: concurrent calls with the same key share one in-flight task.
+The first caller starts the work, later callers await the same task and get
+the same result (or exception). Each caller awaits through asyncio.shield, so
+a caller that disconnects does not cancel the work for the others; the shared
+task is only cancelled once every caller waiting on it is gone.
+Callers that joined a task are counted per name (ai_service_single_flight_coalesced).
+"""
+
+
+class SingleFlight:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.waiters: Dict[str, int] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self.tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.tasks[key] = task
+            self.waiters[key] = 0
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            SINGLE_FLIGHT_COALESCED.labels(self.name).inc()
+            logger.debug(
+                "single_flight_coalesced",
+                name=self.name,
+                waiters=self.waiters[key] + 1,
+            )
+
+        self.waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._release(key, task)
+
+    def _release(self, key: str, task: asyncio.Task) -> None:
+        if self.tasks.get(key) is not task:
+            return
+        self.waiters[key] -= 1
+        if self.waiters[key] == 0 and not task.done():
+            # nobody is waiting for the result anymore, forgotten right away so a
+            # caller arriving before the cancellation lands starts a new task
+            del self.tasks[key]
+            del self.waiters[key]
+            task.cancel()
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self.tasks.get(key) is task:
+            del self.tasks[key]
+            del self.waiters[key]
+        # mark the exception as retrieved when every waiter already left
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,90 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional, Tuple
+from redis.asyncio import Redis
+from services.models.sandbox_models import SandboxSnapshot
+
+"""
+Snapshot store for sandbox project snapshots, keyed by the sandbox id they were
+taken from (the id the golang service already stores), only the latest is kept.
+Same two backends as the job store: in-process with the oldest snapshots evicted
+past max size or max bytes (archives are up to sandbox_snapshot_max_bytes each), or redis so a snapshot survives restarts, expiring after a ttl.
+"""
+
+
+class SnapshotStore(ABC):
+    backend: str = ""
+
+    @abstractmethod
+    async def get(self, sandbox_id: str) -> Optional[SandboxSnapshot]: ...
+
+    @abstractmethod
+    async def get_archive(
+        self, sandbox_id: str
+    ) -> Optional[Tuple[SandboxSnapshot, bytes]]: ...
+
+    @abstractmethod
+    async def save(self, snapshot: SandboxSnapshot, archive: bytes) -> None: ...
+
+
+class InMemorySnapshotStore(SnapshotStore):
+    backend = "memory"
+
+    def __init__(self, max_size: int, max_bytes: int) -> None:
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.snapshots: OrderedDict[str, Tuple[SandboxSnapshot, bytes]] = OrderedDict()
+        self.total_bytes = 0
+
+    async def get(self, sandbox_id: str) -> Optional[SandboxSnapshot]:
+        entry = self.snapshots.get(sandbox_id)
+        return entry[0].model_copy() if entry else None
+
+    async def get_archive(
+        self, sandbox_id: str
+    ) -> Optional[Tuple[SandboxSnapshot, bytes]]:
+        entry = self.snapshots.get(sandbox_id)
+        return (entry[0].model_copy(), entry[1]) if entry else None
+
+    # the newest snapshot is always kept, even alone over max_bytes
+    async def save(self, snapshot: SandboxSnapshot, archive: bytes) -> None:
+        previous = self.snapshots.pop(snapshot.sandbox_id, None)
+        if previous is not None:
+            self.total_bytes -= len(previous[1])
+        self.snapshots[snapshot.sandbox_id] = (snapshot.model_copy(), archive)
+        self.total_bytes += len(archive)
+        while len(self.snapshots) > 1 and (
+            len(self.snapshots) > self.max_size or self.total_bytes > self.max_bytes
+        ):
+            _, (_, evicted) = self.snapshots.popitem(last=False)
+            self.total_bytes -= len(evicted)
+
+
+class RedisSnapshotStore(SnapshotStore):
+    backend = "redis"
+
+    def __init__(self, url: str, ttl_seconds: int) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.redis = Redis.from_url(url)  # archives are binary, no decoding
+
+    async def get(self, sandbox_id: str) -> Optional[SandboxSnapshot]:
+        data = await self.redis.get(f"ai-service:snapshot:{sandbox_id}")
+        return SandboxSnapshot.model_validate_json(data) if data else None
+
+    async def get_archive(
+        self, sandbox_id: str
+    ) -> Optional[Tuple[SandboxSnapshot, bytes]]:
+        data, archive = await self.redis.mget(
+            f"ai-service:snapshot:{sandbox_id}",
+            f"ai-service:snapshot:{sandbox_id}:archive",
+        )
+        if not data or archive is None:
+            return None
+        return SandboxSnapshot.model_validate_json(data), archive
+
+    async def save(self, snapshot: SandboxSnapshot, archive: bytes) -> None:
+        key = f"ai-service:snapshot:{snapshot.sandbox_id}"
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(key, snapshot.model_dump_json(), ex=self.ttl_seconds)
+            pipe.set(f"{key}:archive", archive, ex=self.ttl_seconds)
+            await pipe.execute()
@@ -0,0 +1,151 @@
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from opentelemetry.trace import Span, SpanKind
+from services.models.usage_models import LLMUsage
+from typing import Any, Dict
+from uuid import UUID
+from utils.logging import logger
+from utils.metrics import LLM_CALL_SECONDS, LLM_IN_FLIGHT
+from utils.tracing import set_span_error, tracer
+import time
+
+"""
+Usage of one request (a query or a whole code agent run), made per request.
+Token counts come from the usage metadata of every llm call, prompt tokens served
+from (or written to) the provider's prompt cache are counted apart. Time is split
+between llm calls and tool calls, each timed from its start to its end callback by
+run id (tool calls of one agent step overlap, their times are summed).
+Each llm call is also observed in the llm latency and in-flight metrics, and traced
+as a span (child of the current agent step or request) with its token counts.
+CodeAgentCallBack builds on it.
+"""
+
+
+class UsageCallBack(BaseCallbackHandler):
+    # run on the event loop thread, the timers are plain dicts
+    run_inline = True
+
+    def __init__(self, provider: str, model: str) -> None:
+        self.provider = provider
+        self.model = model
+
+        self.llm_steps = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_creation_tokens = 0
+        self.llm_seconds = 0.0
+
+        self.tool_calls = 0
+        self.tool_seconds = 0.0
+
+        self._started: Dict[UUID, float] = {}
+        self._spans: Dict[UUID, Span] = {}
+
+    def on_chat_model_start(
+        self, serialized: Dict[str, Any], messages: Any, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._started[run_id] = time.monotonic()
+        LLM_IN_FLIGHT.labels(self.provider).inc()
+        # not made current, the callback returns before the call is made
+        self._spans[run_id] = tracer.start_span(
+            f"chat {self.model}",
+            kind=SpanKind.CLIENT,
+            attributes={
+                "gen_ai.operation.name": "chat",
+                "gen_ai.system": self.provider,
+                "gen_ai.request.model": self.model,
+            },
+        )
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        self.llm_steps += 1
+        self.llm_seconds += self._observe_llm_call(run_id, "ok")
+        span = self._spans.pop(run_id, None)
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None)
+                if not usage:
+                    continue
+
+                details = usage.get("input_token_details", {})
+                self.input_tokens += usage.get("input_tokens", 0)
+                self.output_tokens += usage.get("output_tokens", 0)
+                self.cache_read_tokens += details.get("cache_read", 0)
+                self.cache_creation_tokens += details.get("cache_creation", 0)
+                if span is not None:
+                    span.set_attributes(
+                        {
+                            "gen_ai.usage.input_tokens": usage.get("input_tokens", 0),
+                            "gen_ai.usage.output_tokens": usage.get("output_tokens", 0),
+                            "gen_ai.usage.cache_read_tokens": details.get(
+                                "cache_read", 0
+                            ),
+                            "gen_ai.usage.cache_creation_tokens": details.get(
+                                "cache_creation", 0
+                            ),
+                        }
+                    )
+
+                logger.debug(
+                    "agent_llm_step_completed",
+                    input_tokens=usage.get("input_tokens", 0),
+                    cache_read_tokens=details.get("cache_read", 0),
+                    cache_creation_tokens=details.get("cache_creation", 0),
+                )
+        if span is not None:
+            span.end()
+
+    def on_llm_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        # cancelled calls end here too
+        outcome = "error" if isinstance(error, Exception) else "cancelled"
+        self.llm_seconds += self._observe_llm_call(run_id, outcome)
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            set_span_error(span, error)
+            span.end()
+
+    def on_tool_start(
+        self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._started[run_id] = time.monotonic()
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self.tool_calls += 1
+        self.tool_seconds += self._elapsed(run_id)
+
+    def on_tool_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self.tool_calls += 1
+        self.tool_seconds += self._elapsed(run_id)
+
+    def _observe_llm_call(self, run_id: UUID, outcome: str) -> float:
+        if run_id not in self._started:
+            return 0.0
+        elapsed = self._elapsed(run_id)
+        LLM_IN_FLIGHT.labels(self.provider).dec()
+        LLM_CALL_SECONDS.labels(self.provider, self.model, outcome).observe(elapsed)
+        return elapsed
+
+    def _elapsed(self, run_id: UUID) -> float:
+        started = self._started.pop(run_id, None)
+        return 0.0 if started is None else time.monotonic() - started
+
+    # without the cost, UsageTracker.price fills it in
+    def get_usage(self) -> LLMUsage:
+        return LLMUsage(
+            provider=self.provider,
+            model=self.model,
+            llm_calls=self.llm_steps,
+            input_tokens=self.input_tokens,
+            output_tokens=self.output_tokens,
+            cache_read_tokens=self.cache_read_tokens,
+            cache_creation_tokens=self.cache_creation_tokens,
+            llm_seconds=round(self.llm_seconds, 3),
+            tool_calls=self.tool_calls,
+            tool_seconds=round(self.tool_seconds, 3),
+        )
@@ -0,0 +1,109 @@
+from services.models.usage_models import LLMUsage, ModelPrice, UsageStats
+from typing import Dict, List, Optional, Tuple
+from utils.logging import logger
+from utils.metrics import AGENT_STEPS, LLM_COST_USD, LLM_REQUESTS, LLM_TOKENS
+
+"""
+UsageTracker: llm usage totals per provider, model and request kind (query / code)
+since the process started, served by GET /ai/usage. Every request is also logged
+(llm_request_usage) with its own usage, so expensive prompts can be found in the logs,
+and counted in the token, cost and agent step metrics.
+Costs are estimates from the llm_prices setting (usd per million tokens by model
+name prefix), cached prompt tokens are billed at the cache prices.
+"""
+
+
+class PriceTable:
+    def __init__(self, prices: Dict[str, Dict[str, float]]) -> None:
+        self.prices = {
+            prefix: ModelPrice.model_validate(price) for prefix, price in prices.items()
+        }
+
+    # longest prefix wins, "gpt-4o-mini" is not priced as "gpt-4o"
+    def price_of(self, model: str) -> Optional[ModelPrice]:
+        matches = [prefix for prefix in self.prices if model.startswith(prefix)]
+        if not matches:
+            return None
+        return self.prices[max(matches, key=len)]
+
+    def estimate_cost(self, usage: LLMUsage) -> Optional[float]:
+        price = self.price_of(usage.model)
+        if price is None:
+            return None
+        # input_tokens includes the cached ones, they are billed at their own price
+        uncached = max(
+            usage.input_tokens - usage.cache_read_tokens - usage.cache_creation_tokens,
+            0,
+        )
+        cost = (
+            uncached * price.input
+            + usage.output_tokens * price.output
+            + usage.cache_read_tokens * price.cache_read
+            + usage.cache_creation_tokens * price.cache_write
+        ) / 1_000_000
+        return round(cost, 6)
+
+
+class UsageTracker:
+    def __init__(self, prices: Optional[PriceTable] = None) -> None:
+        self.prices = prices or PriceTable({})
+        self.totals: Dict[Tuple[str, str, str], UsageStats] = {}
+
+    # fills in the estimated cost
+    def price(self, usage: LLMUsage) -> LLMUsage:
+        return usage.model_copy(
+            update={"estimated_cost_usd": self.prices.estimate_cost(usage)}
+        )
+
+    def record(self, kind: str, usage: LLMUsage) -> None:
+        logger.info("llm_request_usage", kind=kind, **usage.model_dump())
+        self._record_metrics(kind, usage)
+
+        key = (usage.provider, usage.model, kind)
+        totals = self.totals.get(key)
+        if totals is None:
+            totals = UsageStats(
+                provider=usage.provider,
+                model=usage.model,
+                kind=kind,
+                requests=0,
+                llm_calls=0,
+                input_tokens=0,
+                output_tokens=0,
+                cache_read_tokens=0,
+                cache_creation_tokens=0,
+                llm_seconds=0,
+                tool_seconds=0,
+                estimated_cost_usd=0,
+            )
+            self.totals[key] = totals
+
+        totals.requests += 1
+        totals.llm_calls += usage.llm_calls
+        totals.input_tokens += usage.input_tokens
+        totals.output_tokens += usage.output_tokens
+        totals.cache_read_tokens += usage.cache_read_tokens
+        totals.cache_creation_tokens += usage.cache_creation_tokens
+        totals.llm_seconds += usage.llm_seconds
+        totals.tool_seconds += usage.tool_seconds
+        totals.estimated_cost_usd += usage.estimated_cost_usd or 0
+
+    def _record_metrics(self, kind: str, usage: LLMUsage) -> None:
+        LLM_REQUESTS.labels(usage.provider, usage.model, kind).inc()
+        for token_type, tokens in (
+            ("input", usage.input_tokens),
+            ("output", usage.output_tokens),
+            ("cache_read", usage.cache_read_tokens),
+            ("cache_creation", usage.cache_creation_tokens),
+        ):
+            if tokens:
+                LLM_TOKENS.labels(usage.provider, usage.model, token_type).inc(tokens)
+        if usage.estimated_cost_usd:
+            LLM_COST_USD.labels(usage.provider, usage.model, kind).inc(
+                usage.estimated_cost_usd
+            )
+        if kind == "code":
+            AGENT_STEPS.labels(usage.provider).observe(usage.llm_calls)
+
+    def stats(self) -> List[UsageStats]:
+        return [totals.model_copy() for totals in self.totals.values()]
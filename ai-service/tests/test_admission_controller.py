@@ -0,0 +1,55 @@
+from langchain_core.messages import AIMessage
+from langchain_core.prompt_values import StringPromptValue
+from langchain_core.runnables import RunnableLambda
+from services.admission_controller import (
+    AdmissionController,
+    AdmissionRejectedError,
+    admission_scope,
+)
+from services.models.admission_models import ProviderLimits
+import asyncio
+import pytest
+
+
+def make_gate(controller: AdmissionController) -> RunnableLambda:
+    return controller.gate("openai", RunnableLambda(lambda _: AIMessage(content="ok")))
+
+
+# one request per minute: the bucket is empty after the first call
+def make_controller() -> AdmissionController:
+    return AdmissionController(
+        {
+            "openai": ProviderLimits(
+                requests_per_minute=1, tokens_per_minute=0, max_concurrency=0
+            )
+        },
+        max_wait_seconds=0.1,
+    )
+
+
+def test_later_call_without_scope_is_shed() -> None:
+    controller = make_controller()
+    gate = make_gate(controller)
+
+    async def invoke() -> None:
+        await gate.ainvoke(StringPromptValue(text="first"))
+        await gate.ainvoke(StringPromptValue(text="second"))
+
+    with pytest.raises(AdmissionRejectedError):
+        asyncio.run(invoke())
+
+
+def test_later_step_of_admitted_run_waits_for_capacity() -> None:
+    controller = make_controller()
+    controller.providers["openai"].requests.rate = 20  # refill in 50ms
+    gate = make_gate(controller)
+
+    async def invoke() -> None:
+        with admission_scope():
+            await gate.ainvoke(StringPromptValue(text="first"))
+            controller.max_wait_seconds = 0  # a first call would be shed now
+            await gate.ainvoke(StringPromptValue(text="second"))
+
+    asyncio.run(invoke())
+    assert controller.providers["openai"].admitted == 2
+    assert controller.providers["openai"].rejected == 0
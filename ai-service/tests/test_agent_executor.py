@@ -0,0 +1,117 @@
+from langchain.agents.output_parsers.tools import ToolsAgentOutputParser
+from langchain.tools import BaseTool
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+from services.agent_executor import CodeAgentExecutor
+from services.models.ai_models import CodeAgentBudget
+from typing import Any, Dict, List, Tuple
+import asyncio
+
+READ = ("read_sandbox_file", {"path": "app/page.tsx"})
+WRITE = (
+    "write_sandbox_files",
+    {"write_data": [{"path": "/home/user/app/page.tsx", "data": "x"}]},
+)
+BUILD = ("execute_sandbox_command", {"command": "npm run build"})
+
+
+def make_tool(
+    name: str, calls: List[Tuple[str, Dict[str, Any]]], output: str = ""
+) -> BaseTool:
+    class RecordingTool(BaseTool):
+        def _run(self, **kwargs: Any) -> str:
+            raise RuntimeError("async only")
+
+        async def _arun(self, **kwargs: Any) -> str:
+            calls.append((name, kwargs))
+            return output or f"{name} output {len(calls)}"
+
+    return RecordingTool(name=name, description=name)
+
+
+# one model turn per script entry, then a final answer
+def run_script(
+    script: List[List[Tuple[str, Dict[str, Any]]]], read_output: str = ""
+) -> Tuple[list, Any]:
+    calls: List[Tuple[str, Dict[str, Any]]] = []
+    step = [0]
+
+    def agent(_: Any) -> AIMessage:
+        index = step[0]
+        step[0] += 1
+        if index < len(script):
+            return AIMessage(
+                content="",
+                tool_calls=[
+                    {"name": name, "args": args, "id": f"{index}-{position}"}
+                    for position, (name, args) in enumerate(script[index])
+                ],
+            )
+        return AIMessage(content='{"summary": "done"}')
+
+    tools = [
+        make_tool("read_sandbox_file", calls, read_output),
+        make_tool("write_sandbox_files", calls),
+        make_tool("execute_sandbox_command", calls),
+    ]
+    budget = CodeAgentBudget(max_duplicate_calls=10)
+    executor = CodeAgentExecutor(
+        agent=RunnableLambda(agent) | ToolsAgentOutputParser(),
+        tools=tools,
+        budget=budget,
+        return_intermediate_steps=True,
+    )
+
+    async def invoke() -> Any:
+        with executor.run() as run:
+            await executor.ainvoke({"input": "task"})
+        return run
+
+    return calls, asyncio.run(invoke())
+
+
+def test_repeated_read_is_answered_from_memo() -> None:
+    calls, run = run_script([[READ], [READ]])
+    assert [name for name, _ in calls] == ["read_sandbox_file"]
+    assert run.duplicate_calls == 1
+
+
+def test_read_after_write_hits_the_sandbox() -> None:
+    calls, run = run_script([[READ], [WRITE], [READ]])
+    assert [name for name, _ in calls] == [
+        "read_sandbox_file",
+        "write_sandbox_files",
+        "read_sandbox_file",
+    ]
+    assert run.duplicate_calls == 0
+
+
+def test_command_rerun_after_write_is_executed_again() -> None:
+    calls, run = run_script([[BUILD], [WRITE], [BUILD]])
+    assert [name for name, _ in calls] == [
+        "execute_sandbox_command",
+        "write_sandbox_files",
+        "execute_sandbox_command",
+    ]
+    assert run.duplicate_calls == 0
+
+
+def test_commands_are_never_memoized() -> None:
+    calls, run = run_script([[BUILD], [BUILD]])
+    assert len(calls) == 2
+    assert run.duplicate_calls == 0
+
+
+def test_read_of_a_file_mentioning_error_is_memoized() -> None:
+    content = "Successfully read file\nContent: try {} catch (error) { throw error }"
+    calls, run = run_script([[READ], [READ]], read_output=content)
+    assert [name for name, _ in calls] == ["read_sandbox_file"]
+    assert run.duplicate_calls == 1
+
+
+def test_failed_read_is_not_memoized() -> None:
+    calls, run = run_script(
+        [[READ], [READ]], read_output="failed to read file 'app/page.tsx'"
+    )
+    assert len(calls) == 2
+    assert run.duplicate_calls == 0
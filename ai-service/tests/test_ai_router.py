@@ -0,0 +1,107 @@
+from typing import Any, List, Optional
+from uuid import uuid4
+from services.ai_router import AIRouter, ProviderHealth
+import asyncio
+import pytest
+
+
+class StatusError(Exception):
+    def __init__(self, status_code: int) -> None:
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+class FakeService:
+    def __init__(
+        self, name: str, calls: List[str], error: Optional[Exception] = None
+    ) -> None:
+        self.name = name
+        self.calls = calls
+        self.error = error
+        self.use_tool = False
+
+    async def process_query_request(self, user_message: str, use_cache: bool) -> str:
+        self.calls.append(self.name)
+        if self.error:
+            raise self.error
+        return f"{self.name}: {user_message}"
+
+    async def process_code_request(
+        self, sandbox_id: str, user_message: str, callbacks: List[Any]
+    ) -> str:
+        self.calls.append(self.name)
+        if self.use_tool:
+            callbacks[0].on_tool_start({}, "", run_id=uuid4())
+        if self.error:
+            raise self.error
+        return self.name
+
+
+def make_router(*services: FakeService) -> AIRouter:
+    by_name = {service.name: service for service in services}
+    return AIRouter(
+        query_services=by_name,
+        code_services=by_name,
+        query_timeout_seconds=5,
+        code_timeout_seconds=5,
+        hedge_enabled=False,
+        hedge_percentile=0.9,
+        hedge_min_samples=10,
+        failure_cooldown_seconds=60,
+    )
+
+
+def test_auto_fails_over_and_cools_down_the_failed_provider() -> None:
+    calls: List[str] = []
+    router = make_router(
+        FakeService("openai", calls, StatusError(503)), FakeService("google", calls)
+    )
+
+    provider, result = asyncio.run(router.process_query_request("auto", "hi"))
+
+    assert (provider, result) == ("google", "google: hi")
+    assert calls == ["openai", "google"]
+    assert router.health["query"]["openai"].cooling_down()
+    assert router._candidates("query", "auto") == ["google", "openai"]
+    # code requests are scored on their own
+    assert router._candidates("code", "auto") == ["openai", "google"]
+
+
+def test_client_errors_do_not_fail_over() -> None:
+    calls: List[str] = []
+    router = make_router(
+        FakeService("openai", calls, StatusError(400)), FakeService("google", calls)
+    )
+
+    with pytest.raises(StatusError):
+        asyncio.run(router.process_query_request("auto", "hi"))
+    assert calls == ["openai"]
+
+
+def test_code_request_fails_over_only_before_a_tool_ran() -> None:
+    calls: List[str] = []
+    router = make_router(
+        FakeService("openai", calls, StatusError(503)), FakeService("google", calls)
+    )
+    assert asyncio.run(router.process_code_request("auto", "sbx", "hi")) == (
+        "google",
+        "google",
+    )
+
+    calls.clear()
+    failing = FakeService("openai", calls, StatusError(503))
+    failing.use_tool = True
+    router = make_router(failing, FakeService("google", calls))
+    with pytest.raises(StatusError):
+        asyncio.run(router.process_code_request("auto", "sbx", "hi"))
+    assert calls == ["openai"]
+
+
+def test_provider_that_only_failed_scores_the_penalty() -> None:
+    health = ProviderHealth("openai", cooldown_seconds=0, failure_penalty_seconds=30)
+    assert health.score() == 0
+    health.record_failure()
+    assert health.score() == pytest.approx(30 * 1.8)
+
+    health.record_success(2.0)
+    assert health.score() == pytest.approx(2.0 * (1 + 4 * 0.16))
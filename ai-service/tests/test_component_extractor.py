@@ -0,0 +1,51 @@
+from pathlib import Path
+from utils.component_extractor import extract_component_api
+
+UI_COMPONENTS = Path(__file__).parents[2] / "app" / "src" / "components" / "ui"
+
+FORWARD_REF_INPUT = """
+import * as React from "react"
+
+// https://ui.shadcn.com/docs/components/input
+const Input = React.forwardRef<HTMLInputElement, React.ComponentProps<"input">>(
+  ({ className, type, ...props }, ref) => {
+    return <input type={type} className={className} ref={ref} {...props} />
+  }
+)
+Input.displayName = "Input"
+
+export { Input }
+"""
+
+
+def test_shadcn_button() -> None:
+    source = (UI_COMPONENTS / "button.tsx").read_text()
+    api = extract_component_api("button.tsx", source)
+
+    assert api.import_path == "@/components/ui/button"
+    assert api.exports == ["Button", "buttonVariants"]
+    assert api.variants["buttonVariants"] == {
+        "variant": ["default", "destructive", "outline", "secondary", "ghost", "link"],
+        "size": ["default", "sm", "lg", "icon"],
+    }
+    assert api.default_variants["buttonVariants"] == {
+        "variant": "default",
+        "size": "default",
+    }
+    assert api.props["Button"] == (
+        'React.ComponentProps<"button"> & VariantProps<typeof buttonVariants> '
+        "& {asChild?: boolean;}"
+    )
+
+
+def test_shadcn_card_has_no_variants() -> None:
+    api = extract_component_api("card.tsx", (UI_COMPONENTS / "card.tsx").read_text())
+    assert "CardContent" in api.exports
+    assert api.variants == {}
+    assert api.props["Card"] == 'React.ComponentProps<"div">'
+
+
+def test_forward_ref_component() -> None:
+    api = extract_component_api("input.tsx", FORWARD_REF_INPUT)
+    assert api.exports == ["Input"]
+    assert api.props == {"Input": 'React.ComponentProps<"input">'}
@@ -0,0 +1,129 @@
+from typing import AsyncIterator, List
+from services.job_manager import CodeAgentJobManager, JobQueueFullError
+from services.job_store import InMemoryJobStore
+from services.models.ai_models import AIStreamEvent, CodeAgentData
+from services.models.job_models import CodeAgentJob, JobStatus
+from services.sandbox_lock import InMemorySandboxLock
+import asyncio
+import pytest
+
+
+class FakeRouter:
+    def __init__(self) -> None:
+        self.running: List[str] = []
+        self.overlapped = False
+
+    def validate_provider(self, kind: str, provider: str) -> None:
+        pass
+
+    async def stream_code_request(
+        self, provider: str, sandbox_id: str, user_message: str
+    ) -> AsyncIterator[AIStreamEvent]:
+        self.overlapped = self.overlapped or sandbox_id in self.running
+        self.running.append(sandbox_id)
+        try:
+            yield AIStreamEvent(event="provider", data={"provider": "openai"})
+            yield AIStreamEvent(event="token", data={"text": "..."})
+            yield AIStreamEvent(
+                event="tool_start", data={"name": "write_files", "input": "x" * 500}
+            )
+            await asyncio.sleep(0.01)
+            data = CodeAgentData(summary=user_message, commands=[], files={})
+            yield AIStreamEvent(event="final", data=data.model_dump())
+        finally:
+            self.running.remove(sandbox_id)
+
+
+def make_manager(router: FakeRouter, max_queued: int = 10) -> CodeAgentJobManager:
+    return CodeAgentJobManager(
+        ai_router=router,
+        job_store=InMemoryJobStore(max_size=10),
+        workers=2,
+        max_queued=max_queued,
+        poll_interval_seconds=0.01,
+    )
+
+
+def test_jobs_of_one_sandbox_run_one_at_a_time() -> None:
+    router = FakeRouter()
+    manager = make_manager(router)
+
+    async def run() -> List[AIStreamEvent]:
+        await manager.start()
+        first = await manager.submit("auto", "sbx", "first")
+        second = await manager.submit("auto", "sbx", "second")
+        events = [event async for event in manager.stream(second.job_id)]
+        assert (await manager.get(first.job_id)).status == JobStatus.succeeded
+        await manager.stop()
+        return events
+
+    events = asyncio.run(run())
+    assert not router.overlapped
+    assert [event.event for event in events] == ["provider", "tool_start", "final"]
+    assert events[1].data["input"].endswith("... (500 chars)")
+    assert events[-1].data["summary"] == "second"
+    assert manager.stats().queued == 0
+
+
+def test_full_queue_rejects_and_stop_fails_queued_jobs() -> None:
+    manager = make_manager(FakeRouter(), max_queued=1)
+
+    async def run() -> None:
+        job = await manager.submit("auto", "sbx", "never started")
+        with pytest.raises(JobQueueFullError):
+            await manager.submit("auto", "sbx", "rejected")
+        await manager.stop()
+
+        stopped = await manager.get(job.job_id)
+        assert stopped.status == JobStatus.failed
+        assert manager.stats().queued == 0
+        assert manager.ready.empty()
+
+    asyncio.run(run())
+    assert manager.rejected == 1
+
+
+def test_memory_job_store_drops_the_oldest_job_with_its_progress() -> None:
+    store = InMemoryJobStore(max_size=1)
+    jobs = [
+        CodeAgentJob(
+            job_id=job_id, provider="auto", sandbox_id="sbx", message="", created_at=0
+        )
+        for job_id in ("first", "second")
+    ]
+
+    async def run() -> None:
+        await store.save(jobs[0])
+        await store.append_progress("first", AIStreamEvent(event="x", data={}))
+        assert len((await store.get("first")).progress) == 1
+        await store.save(jobs[1])
+        assert await store.get("first") is None
+        assert await store.get_progress("first") == []
+        assert await store.get("second") is not None
+
+    asyncio.run(run())
+
+
+def test_sandbox_lock_is_held_by_one_run_and_expires() -> None:
+    lock = InMemorySandboxLock(ttl_seconds=0.05, poll_interval_seconds=0.005)
+    order: List[str] = []
+
+    async def agent(name: str) -> None:
+        async with lock.hold("sbx"):
+            order.append(f"{name} start")
+            await asyncio.sleep(0.02)
+            order.append(f"{name} end")
+
+    async def run() -> None:
+        await asyncio.gather(agent("a"), agent("b"))
+        assert lock.holders == {}
+
+        # a crashed holder never releases, its lease expires
+        assert await lock._acquire("sbx", "crashed")
+        assert not await lock._acquire("sbx", "other")
+        await asyncio.sleep(0.06)
+        assert await lock._acquire("sbx", "other")
+        assert not await lock._refresh("sbx", "crashed")
+
+    asyncio.run(run())
+    assert order == ["a start", "a end", "b start", "b end"]
@@ -0,0 +1,25 @@
+from utils.output_capture import OutputCapture
+
+
+def test_short_output_is_kept_whole() -> None:
+    capture = OutputCapture(head_bytes=8, tail_bytes=8)
+    capture.append("hello ")
+    capture.append("world")
+    assert capture.dropped_bytes == 0
+    assert capture.text() == "hello world"
+
+
+def test_long_output_keeps_head_and_tail() -> None:
+    capture = OutputCapture(head_bytes=5, tail_bytes=4)
+    for chunk in ("start", "-middle-", "more-", "end!"):
+        capture.append(chunk)
+    assert capture.total_bytes == 22
+    assert capture.dropped_bytes == 13
+    assert capture.text() == "start\n... [13 bytes truncated] ...\nend!"
+
+
+def test_tail_cuts_the_oldest_partial_chunk() -> None:
+    capture = OutputCapture(head_bytes=0, tail_bytes=5)
+    capture.append("abcdef")
+    capture.append("gh")
+    assert capture.text() == "\n... [3 bytes truncated] ...\ndefgh"
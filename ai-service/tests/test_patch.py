@@ -0,0 +1,51 @@
+from utils.patch import PatchError, apply_unified_diff
+import pytest
+
+
+def test_applies_a_hunk() -> None:
+    content = "a\nb\nc\n"
+    diff = "@@ -1,3 +1,3 @@\n a\n-b\n+B\n c\n"
+    assert apply_unified_diff(content, diff) == ("a\nB\nc\n", 1)
+
+
+def test_skips_file_headers() -> None:
+    content = "a\nb\nc\n"
+    diff = "--- a/file.ts\n+++ b/file.ts\n@@ -1,3 +1,3 @@\n a\n-b\n+B\n c\n"
+    assert apply_unified_diff(content, diff) == ("a\nB\nc\n", 1)
+
+
+def test_removed_and_added_lines_looking_like_file_headers() -> None:
+    content = "x\n-- comment\ny\n"
+    diff = "@@ -1,3 +1,3 @@\n x\n--- comment\n+++ added\n y\n"
+    assert apply_unified_diff(content, diff) == ("x\n++ added\ny\n", 1)
+
+
+def test_diff_for_a_second_file_raises() -> None:
+    diff = (
+        "--- a/one.ts\n+++ b/one.ts\n@@ -1,2 +1,2 @@\n a\n-b\n+B\n"
+        "--- a/two.ts\n+++ b/two.ts\n@@ -1,1 +1,1 @@\n-a\n+A\n"
+    )
+    with pytest.raises(PatchError, match="more than one file"):
+        apply_unified_diff("a\nb\n", diff)
+
+
+def test_repeated_header_for_the_same_file_is_accepted() -> None:
+    diff = (
+        "--- a/one.ts\n+++ b/one.ts\n@@ -1,2 +1,2 @@\n a\n-b\n+B\n"
+        "--- a/one.ts\n+++ b/one.ts\n@@ -1,1 +1,1 @@\n-a\n+A\n"
+    )
+    assert apply_unified_diff("a\nb\n", diff) == ("A\nB\n", 2)
+
+
+def test_overstated_hunk_count_does_not_swallow_the_next_hunk() -> None:
+    content = "1\n2\n3\n4\n5\n6\n7\n8\n"
+    diff = "@@ -1,4 +1,4 @@\n 1\n-2\n+two\n" "@@ -6,4 +6,4 @@\n 6\n-7\n+seven\n"
+    assert apply_unified_diff(content, diff) == (
+        "1\ntwo\n3\n4\n5\n6\nseven\n8\n",
+        2,
+    )
+
+
+def test_mismatching_hunk_raises() -> None:
+    with pytest.raises(PatchError):
+        apply_unified_diff("a\nb\n", "@@ -1,1 +1,1 @@\n-missing\n+x\n")
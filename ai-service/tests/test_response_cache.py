@@ -0,0 +1,36 @@
+from services.response_cache import InMemoryResponseCache, make_cache_key
+import asyncio
+
+
+def test_key_ignores_case_and_spacing() -> None:
+    key = make_cache_key("openai", "gpt-4o", "v1", "What is  a Hook?")
+    assert key == make_cache_key("openai", "gpt-4o", "v1", "  what is a\nhook? ")
+    assert key != make_cache_key("openai", "gpt-4o", "v2", "what is a hook?")
+    assert key != make_cache_key("google", "gpt-4o", "v1", "what is a hook?")
+
+
+def test_memory_cache_evicts_least_recently_used() -> None:
+    cache = InMemoryResponseCache(max_size=2, ttl_seconds=60)
+
+    async def run() -> None:
+        await cache.set("a", "1")
+        await cache.set("b", "2")
+        assert await cache.get("a") == "1"
+        await cache.set("c", "3")
+        assert await cache.get("b") is None
+        assert await cache.get("a") == "1"
+        assert await cache.get("c") == "3"
+
+    asyncio.run(run())
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_memory_cache_expires_entries() -> None:
+    cache = InMemoryResponseCache(max_size=2, ttl_seconds=0)
+
+    async def run() -> None:
+        await cache.set("a", "1")
+        assert await cache.get("a") is None
+        assert "a" not in cache.entries
+
+    asyncio.run(run())
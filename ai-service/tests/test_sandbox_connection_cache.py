@@ -0,0 +1,17 @@
+from e2b_code_interpreter import (
+    SandboxNotFoundException,
+    SandboxNotRunningException,
+    TimeoutException,
+)
+from services.sandbox_connection_cache import is_connection_error
+import httpx
+
+
+def test_command_timeout_keeps_the_connection() -> None:
+    assert not is_connection_error(TimeoutException("command timed out"))
+
+
+def test_gone_sandbox_or_transport_failure_drops_the_connection() -> None:
+    assert is_connection_error(SandboxNotRunningException("sandbox was not found"))
+    assert is_connection_error(SandboxNotFoundException("sandbox not found"))
+    assert is_connection_error(httpx.ConnectError("connection refused"))
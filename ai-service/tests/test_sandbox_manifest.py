@@ -0,0 +1,38 @@
+from services.sandbox_manifest import SandboxManifest, content_hash
+
+
+def test_from_sha256sum_resolves_paths_against_the_project() -> None:
+    output = (
+        f"{content_hash('a')}  ./app/page.tsx\n"
+        f"\\{content_hash('b')}  ./odd\\nname\n"
+    )
+    manifest = SandboxManifest.from_sha256sum(output)
+    assert len(manifest) == 1
+    assert manifest.is_unchanged("app/page.tsx", "a")
+    assert manifest.is_unchanged("/home/user/app/../app/page.tsx", "a")
+    assert not manifest.is_unchanged("app/page.tsx", "b")
+
+
+def test_stale_manifest_needs_a_refresh_before_skipping() -> None:
+    manifest = SandboxManifest()
+    manifest.record("app/page.tsx", "old")
+    manifest.record("app/layout.tsx", "layout")
+    manifest.mark_stale()
+
+    assert manifest.matches("app/page.tsx", "old")
+    assert not manifest.is_unchanged("app/page.tsx", "old")
+
+    manifest.refresh(
+        ["app/page.tsx", "app/layout.tsx"],
+        {"/home/user/app/page.tsx": content_hash("new")},
+    )
+    assert manifest.is_unchanged("app/page.tsx", "new")
+    assert not manifest.matches("app/layout.tsx", "layout")
+    assert len(manifest) == 1
+
+
+def test_write_after_stale_counts_as_current() -> None:
+    manifest = SandboxManifest()
+    manifest.mark_stale()
+    manifest.record("app/page.tsx", "content")
+    assert manifest.is_unchanged("app/page.tsx", "content")
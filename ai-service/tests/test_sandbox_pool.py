@@ -0,0 +1,118 @@
+from typing import List
+from e2b_code_interpreter import AsyncSandbox
+from services.models.sandbox_models import PooledSandbox
+from services.sandbox_pool import SandboxPool, pool_share
+import asyncio
+import time
+
+
+# PooledSandbox only takes AsyncSandbox instances
+class FakeSandbox(AsyncSandbox):
+    def __init__(self, sandbox_id: str, renewable: bool = True) -> None:
+        self._sandbox_id = sandbox_id
+        self.renewable = renewable
+        self.timeouts: List[int] = []
+        self.killed = False
+
+    @property
+    def sandbox_id(self) -> str:
+        return self._sandbox_id
+
+    async def set_timeout(self, timeout: int) -> None:
+        if not self.renewable:
+            raise RuntimeError("sandbox reached its maximum lifetime")
+        self.timeouts.append(timeout)
+
+    async def kill(self) -> bool:
+        self.killed = True
+        return True
+
+
+class FakeConnections:
+    def __init__(self) -> None:
+        self.cached: List[str] = []
+
+    def put(self, sbx: AsyncSandbox, expires_at: float) -> None:
+        self.cached.append(sbx.sandbox_id)
+
+    def invalidate(self, sandbox_id: str, reason: str) -> None:
+        pass
+
+
+class FakeSandboxService:
+    def __init__(self) -> None:
+        self.connections = FakeConnections()
+        self.created = 0
+
+    async def create(self, template_id: str) -> AsyncSandbox:
+        self.created += 1
+        return FakeSandbox(f"new-{self.created}")
+
+
+def make_pool(min_size: int = 1, max_size: int = 4) -> SandboxPool:
+    return SandboxPool(
+        sandbox_service=FakeSandboxService(),
+        template_id="nextjs",
+        min_size=min_size,
+        max_size=max_size,
+        renew_before_seconds=60,
+        max_idle_seconds=1800,
+        refill_interval_seconds=15,
+    )
+
+
+def pooled(sbx: AsyncSandbox, expires_in: float, idle_for: float = 0) -> PooledSandbox:
+    now = time.time()
+    return PooledSandbox(
+        sandbox=sbx, expires_at=now + expires_in, idle_since=now - idle_for
+    )
+
+
+def test_pool_share_rounds_up() -> None:
+    assert pool_share(1, 4) == 1
+    assert pool_share(4, 4) == 1
+    assert pool_share(5, 2) == 3
+    assert pool_share(3, 0) == 3
+
+
+def test_checkout_hands_out_warm_sandboxes_then_grows_on_a_miss() -> None:
+    pool = make_pool()
+    warm = FakeSandbox("warm")
+    pool.idle.append(pooled(warm, expires_in=600))
+
+    async def run() -> None:
+        assert await pool.checkout() is warm
+        assert warm.timeouts
+        assert pool.sandbox_service.connections.cached == ["warm"]
+
+        created = await pool.checkout()
+        assert created.sandbox_id == "new-1"
+
+    asyncio.run(run())
+    assert (pool.hits, pool.misses, pool.target_size) == (1, 1, 2)
+
+
+def test_expiring_sandboxes_are_renewed_or_retired() -> None:
+    pool = make_pool()
+    renewable = FakeSandbox("renewable")
+    too_old = FakeSandbox("too-old", renewable=False)
+    surplus = FakeSandbox("surplus")
+    pool.idle.extend(
+        [
+            pooled(renewable, expires_in=30),
+            pooled(too_old, expires_in=30),
+            pooled(surplus, expires_in=600, idle_for=4000),
+        ]
+    )
+    pool.target_size = 3
+
+    async def run() -> None:
+        pool._retire_unused()
+        await pool._renew_expiring()
+        await asyncio.gather(*pool._kill_tasks)
+
+    asyncio.run(run())
+    assert [entry.sandbox.sandbox_id for entry in pool.idle] == ["renewable"]
+    assert renewable.timeouts and not renewable.killed
+    assert too_old.killed and surplus.killed
+    assert (pool.renewed, pool.retired, pool.target_size) == (1, 2, 2)
@@ -0,0 +1,69 @@
+from langchain.agents.output_parsers.tools import ToolAgentAction
+from langchain_core.messages import AIMessage
+from services.scratchpad_compactor import ScratchpadCompactor, command_touches
+from typing import Any, Dict, List, Tuple
+
+FILE = "x" * 400
+
+
+def step(tool: str, args: Dict[str, Any], index: int) -> Tuple[ToolAgentAction, str]:
+    call_id = f"call-{index}"
+    message = AIMessage(
+        content="", tool_calls=[{"name": tool, "args": args, "id": call_id}]
+    )
+    action = ToolAgentAction(
+        tool=tool,
+        tool_input=args,
+        log="",
+        message_log=[message],
+        tool_call_id=call_id,
+    )
+    return action, f"{FILE} {index}"
+
+
+def read(path: str, index: int) -> Tuple[ToolAgentAction, str]:
+    return step("read_sandbox_file", {"path": path}, index)
+
+
+def command(text: str, index: int) -> Tuple[ToolAgentAction, str]:
+    return step("execute_sandbox_command", {"command": text}, index)
+
+
+def rendered(messages: List[Any]) -> List[str]:
+    return [str(message.content) for message in messages]
+
+
+def compactor() -> ScratchpadCompactor:
+    return ScratchpadCompactor(max_tokens=0, keep_recent_steps=1, block_steps=2)
+
+
+def test_build_does_not_make_reads_stale() -> None:
+    steps = [read("app/page.tsx", 0), command("npm run build", 1), command("ls", 2)]
+    messages = rendered(compactor().format(steps))
+    assert messages[1] == steps[0][1]
+
+
+def test_command_naming_the_file_makes_the_read_stale() -> None:
+    steps = [
+        read("app/page.tsx", 0),
+        command("sed -i 's/a/b/' app/page.tsx", 1),
+        command("ls", 2),
+    ]
+    messages = rendered(compactor().format(steps))
+    assert messages[1].startswith("[read_sandbox_file result removed")
+
+
+def test_compacted_prefix_is_stable_within_a_block() -> None:
+    steps = [read("app/page.tsx", 0), command("ls", 1), command("ls", 2)]
+    before = rendered(compactor().format(steps))
+    # a later read of the same file falls above the cut-off until the next block
+    steps.append(read("app/page.tsx", 3))
+    after = rendered(compactor().format(steps))
+    assert after[: len(before)] == before
+
+
+def test_command_touches() -> None:
+    assert command_touches("rm -rf app", "/home/user/app/page.tsx")
+    assert command_touches("cat >/home/user/app/page.tsx", "/home/user/app/page.tsx")
+    assert not command_touches("cd /home/user && npm run build", "/home/user/app/x.ts")
+    assert not command_touches("rm app/page.tsx.bak", "/home/user/app/page.tsx")
@@ -0,0 +1,61 @@
+from services.single_flight import SingleFlight
+import asyncio
+
+
+def test_concurrent_callers_share_one_call() -> None:
+    flight = SingleFlight("test")
+    started = []
+
+    async def work() -> str:
+        started.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def run() -> list:
+        return await asyncio.gather(*[flight.do("key", work) for _ in range(3)])
+
+    assert asyncio.run(run()) == ["result"] * 3
+    assert len(started) == 1
+    assert flight.tasks == {}
+
+
+def test_caller_after_the_last_waiter_left_starts_a_new_call() -> None:
+    flight = SingleFlight("test")
+    started = []
+
+    async def work() -> str:
+        started.append(1)
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            await asyncio.sleep(0.01)  # cleanup keeps the cancelled task alive
+            raise
+        return "result"
+
+    async def run() -> str:
+        first = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        # the cancelled task is still unwinding, it must not be joined
+        return await flight.do("key", work)
+
+    assert asyncio.run(run()) == "result"
+    assert len(started) == 2
+
+
+def test_one_caller_leaving_does_not_cancel_the_others() -> None:
+    flight = SingleFlight("test")
+
+    async def work() -> str:
+        await asyncio.sleep(0.03)
+        return "result"
+
+    async def run() -> str:
+        first = asyncio.create_task(flight.do("key", work))
+        second = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == "result"
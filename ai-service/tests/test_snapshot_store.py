@@ -0,0 +1,39 @@
+from services.models.sandbox_models import SandboxSnapshot
+from services.snapshot_store import InMemorySnapshotStore
+import asyncio
+
+
+def snapshot(sandbox_id: str, size: int) -> SandboxSnapshot:
+    return SandboxSnapshot(
+        sandbox_id=sandbox_id,
+        created_at=0,
+        files=[],
+        size_bytes=size,
+        packages_changed=False,
+    )
+
+
+def test_memory_store_is_bounded_by_bytes() -> None:
+    store = InMemorySnapshotStore(max_size=10, max_bytes=25)
+
+    async def run() -> None:
+        for sandbox_id in ("a", "b", "c"):
+            await store.save(snapshot(sandbox_id, 10), b"x" * 10)
+        assert await store.get("a") is None
+        assert await store.get("c") is not None
+        # replacing a snapshot does not count its old archive twice
+        await store.save(snapshot("c", 10), b"y" * 10)
+        assert await store.get("b") is not None
+
+    asyncio.run(run())
+    assert store.total_bytes == 20
+
+
+def test_newest_snapshot_is_kept_even_over_the_limit() -> None:
+    store = InMemorySnapshotStore(max_size=10, max_bytes=5)
+
+    async def run() -> None:
+        await store.save(snapshot("a", 10), b"x" * 10)
+        assert await store.get_archive("a") is not None
+
+    asyncio.run(run())
@@ -0,0 +1,9 @@
+from typing import Optional
+
+
+# callers opt out of cached responses with "Cache-Control: no-cache" (or no-store)
+def use_response_cache(cache_control: Optional[str]) -> bool:
+    if not cache_control:
+        return True
+    directives = {directive.strip().lower() for directive in cache_control.split(",")}
+    return not directives & {"no-cache", "no-store"}
@@ -0,0 +1,92 @@
+from fastapi import Request
+from typing import AsyncGenerator, AsyncIterator, Awaitable, Optional, TypeVar
+from utils.logging import logger
+import asyncio
+import time
+
+"""
+Request scoped cancellation for the long running code agent routes (the code and
+code/stream routes of openai, google, anthropic and /ai).
+The caller can send "X-Request-Timeout: <seconds>", the work is cancelled once it
+runs past that deadline or as soon as the client disconnects. Cancelling the task
+raises CancelledError inside the agent executor, the in-flight llm call and any
+running sandbox command, so nothing keeps burning tokens or sandbox time.
+Streaming responses are already cancelled by starlette when the client leaves,
+they only need the deadline (stream_with_deadline).
+"""
+
+T = TypeVar("T")
+
+
+class RequestCancelledError(Exception):
+    def __init__(self, reason: str) -> None:
+        self.reason = reason
+        # 499 is the nginx "client closed request" code, nobody reads it anyway
+        self.status_code = 504 if reason == "deadline_exceeded" else 499
+        super().__init__(f"request cancelled: {reason}")
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    # the body was already read, the next message is the disconnect
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def run_cancellable(
+    request: Request, work: Awaitable[T], timeout: Optional[float]
+) -> T:
+    work_task = asyncio.ensure_future(work)
+    disconnect_task = asyncio.create_task(_wait_for_disconnect(request))
+    try:
+        done, _ = await asyncio.wait(
+            {work_task, disconnect_task},
+            timeout=timeout,
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        if work_task in done:
+            return work_task.result()
+
+        reason = (
+            "client_disconnected" if disconnect_task in done else "deadline_exceeded"
+        )
+        logger.warning(
+            "request_cancelled",
+            path=request.url.path,
+            reason=reason,
+            timeout_seconds=timeout,
+        )
+        work_task.cancel()
+        await asyncio.gather(work_task, return_exceptions=True)
+        raise RequestCancelledError(reason)
+    finally:
+        disconnect_task.cancel()
+        work_task.cancel()
+
+
+# each step runs under the remaining time, a timeout cancels the stream mid step
+async def stream_with_deadline(
+    stream: AsyncGenerator[T, None], timeout: Optional[float]
+) -> AsyncIterator[T]:
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        while True:
+            remaining = (
+                None if deadline is None else max(deadline - time.monotonic(), 0)
+            )
+            try:
+                item = await asyncio.wait_for(stream.__anext__(), timeout=remaining)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                logger.warning(
+                    "request_cancelled",
+                    reason="deadline_exceeded",
+                    timeout_seconds=timeout,
+                )
+                raise RequestCancelledError("deadline_exceeded")
+            yield item
+    finally:
+        # closed early (client gone), let the stream cancel its work now
+        await stream.aclose()
@@ -0,0 +1,201 @@
+from typing import Dict, List, Optional, Tuple
+from services.models.component_models import ComponentApi
+import re
+
+"""
+Extracts the public api of a Shadcn component file (components/ui/*.tsx):
+exported names, cva variants with their defaults and the props type of every
+exported component. Not a typescript parser, it relies on the shape the shadcn
+cli generates (function components or React.forwardRef, cva(...) variants,
+one export { ... } list) and skips whatever it does not recognise.
+"""
+
+MAX_PROPS_LENGTH = 300
+
+EXPORT_LIST = re.compile(r"export\s*\{([^}]*)\}")
+EXPORT_DECLARATION = re.compile(
+    r"export\s+(?:default\s+)?(?:function|const|let)\s+([A-Za-z_]\w*)"
+)
+CVA_DECLARATION = re.compile(r"const\s+([A-Za-z_]\w*)\s*=\s*cva\(")
+FUNCTION_COMPONENT = re.compile(r"function\s+([A-Z]\w*)\s*(?:<[^>(]*>)?\s*\(")
+FORWARD_REF_COMPONENT = re.compile(r"const\s+([A-Z]\w*)\s*=\s*React\.forwardRef\s*<")
+OPENING = {"{": "}", "(": ")", "[": "]", "<": ">"}
+# whole line comments only, "//" also shows up inside strings (urls)
+LINE_COMMENT = re.compile(r"^\s*//.*$", re.MULTILINE)
+BLOCK_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+
+
+# index just past the quote closing the string that starts at `start`
+def _close_string(source: str, start: int) -> int:
+    end = source.find(source[start], start + 1)
+    while end != -1 and source[end - 1] == "\\":
+        end = source.find(source[start], end + 1)
+    return len(source) if end == -1 else end + 1
+
+
+# index just past the bracket closing the one at `start`, strings are skipped
+def _close(source: str, start: int) -> int:
+    opening = source[start]
+    closing = OPENING[opening]
+    depth = 0
+    index = start
+    while index < len(source):
+        char = source[index]
+        if char in "\"'`":
+            index = _close_string(source, index)
+            continue
+        # "=>" inside a generic is not a closing angle bracket
+        if char == opening and not (opening == "<" and source[index - 1] == "="):
+            depth += 1
+        elif char == closing and not (closing == ">" and source[index - 1] == "="):
+            depth -= 1
+            if depth == 0:
+                return index + 1
+        index += 1
+    return len(source)
+
+
+# top level "key: value" pairs of an object literal body
+def _entries(body: str) -> List[Tuple[str, str]]:
+    segments: List[str] = []
+    depth = 0
+    segment_start = 0
+    index = 0
+    while index < len(body):
+        char = body[index]
+        if char in "\"'`":
+            index = _close_string(body, index)
+            continue
+        if char in "{([":
+            depth += 1
+        elif char in "})]":
+            depth -= 1
+        elif char == "," and depth == 0:
+            segments.append(body[segment_start:index])
+            segment_start = index + 1
+        index += 1
+    segments.append(body[segment_start:])
+
+    entries: List[Tuple[str, str]] = []
+    for segment in segments:
+        key, separator, value = segment.partition(":")
+        key = key.strip().strip("\"'")
+        if separator and re.fullmatch(r"[\w-]+", key):
+            entries.append((key, value.strip()))
+    return entries
+
+
+# body of the object literal that follows `key:` at the top level of `body`
+def _object(body: str, key: str) -> Optional[str]:
+    for entry_key, value in _entries(body):
+        if entry_key == key and value.startswith("{"):
+            return value[1 : _close(value, 0) - 1]
+    return None
+
+
+def _compact(text: str) -> str:
+    text = re.sub(r"\s+", " ", text).strip()
+    text = re.sub(r"([<({\[]) ", r"\1", text)
+    text = re.sub(r" ([>)}\]])", r"\1", text)
+    if len(text) > MAX_PROPS_LENGTH:
+        text = text[: MAX_PROPS_LENGTH - 3] + "..."
+    return text
+
+
+def _exports(source: str) -> List[str]:
+    names: List[str] = []
+    for export_list in EXPORT_LIST.findall(source):
+        for name in export_list.split(","):
+            name = name.strip().removeprefix("type ").strip()
+            # "Foo as Bar" exports Bar
+            name = name.split(" as ")[-1].strip()
+            if name:
+                names.append(name)
+    names.extend(EXPORT_DECLARATION.findall(source))
+    return list(dict.fromkeys(names))
+
+
+def _variants(
+    source: str,
+) -> Tuple[Dict[str, Dict[str, List[str]]], Dict[str, Dict[str, str]]]:
+    variants: Dict[str, Dict[str, List[str]]] = {}
+    defaults: Dict[str, Dict[str, str]] = {}
+    for match in CVA_DECLARATION.finditer(source):
+        call_start = match.end() - 1
+        arguments = source[call_start + 1 : _close(source, call_start) - 1]
+        config_start = arguments.find("{")
+        if config_start == -1:
+            continue  # base classes only, nothing to choose from
+        config = arguments[config_start + 1 : _close(arguments, config_start) - 1]
+
+        variant_body = _object(config, "variants")
+        if variant_body is None:
+            continue
+        options: Dict[str, List[str]] = {}
+        for name, value in _entries(variant_body):
+            if value.startswith("{"):
+                option_body = value[1 : _close(value, 0) - 1]
+                options[name] = [option for option, _ in _entries(option_body)]
+        variants[match.group(1)] = options
+
+        default_body = _object(config, "defaultVariants")
+        if default_body is not None:
+            defaults[match.group(1)] = {
+                name: value.strip("\"'") for name, value in _entries(default_body)
+            }
+    return variants, defaults
+
+
+# props type annotation of function components: function Button({ ... }: Props) {
+def _function_props(source: str) -> Dict[str, str]:
+    props: Dict[str, str] = {}
+    for match in FUNCTION_COMPONENT.finditer(source):
+        params_start = match.end() - 1
+        params = source[params_start + 1 : _close(source, params_start) - 1].strip()
+        if not params:
+            props[match.group(1)] = ""
+            continue
+        annotation_start = _close(params, 0) if params[0] == "{" else 0
+        _, colon, annotation = params[annotation_start:].partition(":")
+        props[match.group(1)] = _compact(annotation) if colon else ""
+    return props
+
+
+# second type argument of React.forwardRef<Element, Props>
+def _forward_ref_props(source: str) -> Dict[str, str]:
+    props: Dict[str, str] = {}
+    for match in FORWARD_REF_COMPONENT.finditer(source):
+        generic_start = match.end() - 1
+        generics = source[generic_start + 1 : _close(source, generic_start) - 1]
+        depth = 0
+        for index, char in enumerate(generics):
+            if char in "<({[":
+                depth += 1
+            elif char in ">)}]":
+                depth -= 1
+            elif char == "," and depth == 0:
+                props[match.group(1)] = _compact(generics[index + 1 :])
+                break
+    return props
+
+
+def extract_component_api(file_name: str, source: str) -> ComponentApi:
+    name = file_name.removesuffix(".tsx")
+    source = LINE_COMMENT.sub("", BLOCK_COMMENT.sub("", source))
+    exports = _exports(source)
+    variants, default_variants = _variants(source)
+
+    all_props = {**_forward_ref_props(source), **_function_props(source)}
+    props = {
+        component: all_props[component]
+        for component in exports
+        if component in all_props
+    }
+    return ComponentApi(
+        name=name,
+        import_path=f"@/components/ui/{name}",
+        exports=exports,
+        variants=variants,
+        default_variants=default_variants,
+        props=props,
+    )
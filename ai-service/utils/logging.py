@@ -1,6 +1,7 @@
 from fastapi import Request
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response
+from opentelemetry import trace
 from structlog.stdlib import BoundLogger
 import structlog
 import uuid
@@ -14,6 +15,13 @@ class LoggingMiddleWare(BaseHTTPMiddleware):
         structlog.contextvars.bind_contextvars(
             request_id=str(uuid.uuid4()),
         )
+        # set by TracingMiddleWare, ties the logs of a request to its trace
+        span_context = trace.get_current_span().get_span_context()
+        if span_context.is_valid:
+            structlog.contextvars.bind_contextvars(
+                trace_id=format(span_context.trace_id, "032x"),
+                span_id=format(span_context.span_id, "016x"),
+            )
 
         logger.info("request_received", method=request.method, path=request.url.path)
 
@@ -0,0 +1,175 @@
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from contextlib import contextmanager
+from typing import Iterator, Tuple
+import os
+import time
+
+"""
+Prometheus metrics, served by GET /metrics (outside the /ai-service/v1 prefix).
+Recording is a labelled in-memory (or mmap) increment, no io and no awaits.
+Several uvicorn workers: point PROMETHEUS_MULTIPROC_DIR at an empty directory
+before the server starts (prometheus_client reads it at import), every worker then
+writes its own files and /metrics merges them (MultiProcessCollector). Gauges sum
+the live workers only.
+HTTP requests are labelled with the route template, not the raw path, so sandbox
+ids do not explode the label space. Streaming responses are timed until their
+last byte.
+"""
+
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+HTTP_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+SANDBOX_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+STEP_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "ai_service_http_request_seconds",
+    "http request latency by route template and status",
+    ["method", "route", "status"],
+    buckets=HTTP_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge(
+    "ai_service_http_requests_in_flight",
+    "http requests being served",
+    multiprocess_mode="livesum",
+)
+
+LLM_CALL_SECONDS = Histogram(
+    "ai_service_llm_call_seconds",
+    "latency of a single llm call (one agent step or one query)",
+    ["provider", "model", "outcome"],
+    buckets=LLM_BUCKETS,
+)
+LLM_IN_FLIGHT = Gauge(
+    "ai_service_llm_calls_in_flight",
+    "llm calls running",
+    ["provider"],
+    multiprocess_mode="livesum",
+)
+LLM_TOKENS = Counter(
+    "ai_service_llm_tokens",
+    "llm tokens by type (input includes cache_read and cache_creation)",
+    ["provider", "model", "type"],
+)
+LLM_COST_USD = Counter(
+    "ai_service_llm_estimated_cost_usd",
+    "estimated llm cost from the llm_prices setting",
+    ["provider", "model", "kind"],
+)
+LLM_REQUESTS = Counter(
+    "ai_service_llm_requests",
+    "query and code agent requests",
+    ["provider", "model", "kind"],
+)
+AGENT_STEPS = Histogram(
+    "ai_service_agent_steps",
+    "llm steps per code agent run",
+    ["provider"],
+    buckets=STEP_BUCKETS,
+)
+
+SANDBOX_OPERATION_SECONDS = Histogram(
+    "ai_service_sandbox_operation_seconds",
+    "sandbox operation latency, connecting included when the connection was not cached",
+    ["operation", "outcome"],
+    buckets=SANDBOX_BUCKETS,
+)
+SANDBOX_IN_FLIGHT = Gauge(
+    "ai_service_sandbox_operations_in_flight",
+    "sandbox operations running",
+    ["operation"],
+    multiprocess_mode="livesum",
+)
+
+CACHE_LOOKUPS = Counter(
+    "ai_service_cache_lookups",
+    "cache lookups by cache and result (hit or miss)",
+    ["cache", "result"],
+)
+SINGLE_FLIGHT_COALESCED = Counter(
+    "ai_service_single_flight_coalesced",
+    "calls that joined an identical in-flight call instead of starting their own",
+    ["name"],
+)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+@contextmanager
+def time_sandbox_operation(operation: str) -> Iterator[None]:
+    in_flight = SANDBOX_IN_FLIGHT.labels(operation)
+    in_flight.inc()
+    start = time.perf_counter()
+    outcome = "cancelled"
+    try:
+        yield
+        outcome = "ok"
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        in_flight.dec()
+        SANDBOX_OPERATION_SECONDS.labels(operation, outcome).observe(
+            time.perf_counter() - start
+        )
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+# a stopped worker's live gauges must not count anymore
+def mark_worker_stopped() -> None:
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+# plain asgi middleware, BaseHTTPMiddleware would time streaming responses only
+# until their headers
+class MetricsMiddleWare:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # the router stores the matched route in the scope
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status),
+            ).observe(time.perf_counter() - start)
@@ -0,0 +1,52 @@
+from collections import deque
+from typing import Deque
+
+"""
+Bounded capture of a command's stdout or stderr.
+The first head_bytes are kept as they arrive, after that only the last
+tail_bytes are kept in a ring buffer, the middle is dropped and counted.
+Build logs (npm install) put the useful lines at both ends: the command
+and its first errors at the head, the summary and exit reason at the tail.
+"""
+
+
+class OutputCapture:
+    def __init__(self, head_bytes: int, tail_bytes: int) -> None:
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+
+        self.head = bytearray()
+        self.tail: Deque[bytes] = deque()
+        self.tail_size = 0
+        self.total_bytes = 0
+
+    def append(self, chunk: str) -> None:
+        data = chunk.encode()
+        self.total_bytes += len(data)
+
+        if len(self.head) < self.head_bytes:
+            room = self.head_bytes - len(self.head)
+            self.head += data[:room]
+            data = data[room:]
+        if not data:
+            return
+
+        self.tail.append(data)
+        self.tail_size += len(data)
+        # whole chunks only, the last partial chunk is cut when the text is built
+        while self.tail and self.tail_size - len(self.tail[0]) >= self.tail_bytes:
+            self.tail_size -= len(self.tail.popleft())
+
+    @property
+    def dropped_bytes(self) -> int:
+        return self.total_bytes - len(self.head) - min(self.tail_size, self.tail_bytes)
+
+    def text(self) -> str:
+        tail = b"".join(self.tail)[-self.tail_bytes :] if self.tail_bytes else b""
+        head_text = self.head.decode(errors="ignore")
+        tail_text = tail.decode(errors="ignore")
+        if not self.dropped_bytes:
+            return head_text + tail_text
+        return (
+            f"{head_text}\n... [{self.dropped_bytes} bytes truncated] ...\n{tail_text}"
+        )
@@ -0,0 +1,235 @@
+from typing import List, Optional, Tuple
+from services.models.sandbox_models import PatchEdit
+import re
+
+"""
+Applies agent edits to file content without the agent sending the whole file back.
+Two formats: unified diff hunks and search/replace edits.
+Matching is forgiving the way llm written patches need it to be: hunk line numbers
+are only a hint (the closest match wins), trailing whitespace and then indentation
+differences are ignored when an exact match fails, and up to two context lines at
+either end of a hunk may be dropped. A patch that still does not match raises
+PatchError so the agent can re-read the file and retry, as does a diff whose file
+headers name more than one file (each file gets its own patch).
+"""
+
+HUNK_HEADER = re.compile(r"^@@(?: -(\d+)(?:,(\d+))? \+\d+(?:,(\d+))?)? @@")
+MAX_FUZZ = 2
+
+
+class PatchError(Exception):
+    pass
+
+
+class Hunk:
+    def __init__(
+        self,
+        old_start: Optional[int],
+        old_count: Optional[int] = None,
+        new_count: Optional[int] = None,
+    ) -> None:
+        self.old_start = old_start
+        self.lines: List[Tuple[str, str]] = []  # (" " | "-" | "+", text)
+        # lines the header still announces, None for a bare "@@ @@" header
+        self.old_remaining = old_count
+        self.new_remaining = new_count
+
+    def add(self, tag: str, text: str) -> None:
+        self.lines.append((tag, text))
+        if self.old_remaining is None or self.new_remaining is None:
+            return
+        if tag != "+":
+            self.old_remaining -= 1
+        if tag != "-":
+            self.new_remaining -= 1
+
+    # inside the lines its header announced, "--- x" there is a removed "-- x" (the
+    # counts are only trusted for that, llm written headers often miscount)
+    def expects_more(self) -> bool:
+        if self.old_remaining is None or self.new_remaining is None:
+            return False
+        return self.old_remaining > 0 or self.new_remaining > 0
+
+    # hunk lines without up to `fuzz` context lines at either end
+    def trimmed(self, fuzz: int) -> List[Tuple[str, str]]:
+        lines = self.lines
+        for _ in range(fuzz):
+            if lines and lines[0][0] == " ":
+                lines = lines[1:]
+        for _ in range(fuzz):
+            if lines and lines[-1][0] == " ":
+                lines = lines[:-1]
+        return lines
+
+
+# "--- a/app/page.tsx\t2024-..." -> "app/page.tsx", None for /dev/null
+def header_path(line: str) -> Optional[str]:
+    path = line[4:].split("\t", 1)[0].strip()
+    if path == "/dev/null":
+        return None
+    if path.startswith(("a/", "b/")):
+        path = path[2:]
+    return path
+
+
+def parse_hunks(diff: str) -> List[Hunk]:
+    hunks: List[Hunk] = []
+    current: Optional[Hunk] = None
+    file_path: Optional[str] = None
+    diff_lines = diff.split("\n")
+    for index, line in enumerate(diff_lines):
+        # a body line starts with " ", "-" or "+", so "@@" always opens the next hunk
+        header = HUNK_HEADER.match(line)
+        if header:
+            old_start, old_count, new_count = header.groups()
+            current = Hunk(
+                int(old_start) if old_start else None,
+                # an omitted count means one line
+                (int(old_count) if old_count else 1) if old_start else None,
+                (int(new_count) if new_count else 1) if old_start else None,
+            )
+            hunks.append(current)
+            continue
+
+        # file headers end the current hunk ("---" would otherwise read as a removal),
+        # only outside the lines the hunk header announced
+        in_body = current is not None and current.expects_more()
+        next_line = diff_lines[index + 1] if index + 1 < len(diff_lines) else ""
+        if not in_body and line.startswith("diff --git"):
+            current = None
+            continue
+        if not in_body and line.startswith("--- ") and next_line.startswith("+++ "):
+            path = header_path(next_line) or header_path(line)
+            if file_path is not None and path is not None and path != file_path:
+                raise PatchError(
+                    f"diff changes more than one file ({file_path} and {path}), send one patch per file"
+                )
+            file_path = path or file_path
+            current = None
+            continue
+        if current is None or line.startswith("\\"):
+            continue
+
+        if line.startswith(("-", "+", " ")):
+            current.add(line[0], line[1:])
+        elif line == "":
+            current.add(" ", "")  # blank context line without its space
+        else:
+            raise PatchError(f"unexpected line in hunk {len(hunks)}: {line[:80]!r}")
+
+    # a trailing newline at the end of the diff is not a blank context line
+    for hunk in hunks:
+        while hunk.lines and hunk.lines[-1] == (" ", ""):
+            hunk.lines.pop()
+    return hunks
+
+
+def _find(
+    lines: List[str], old: List[str], expected: Optional[int], cursor: int
+) -> Optional[int]:
+    normalizers = (lambda s: s, str.rstrip, str.strip)
+    for normalize in normalizers:
+        normalized = [normalize(line) for line in lines]
+        target = [normalize(line) for line in old]
+        matches = [
+            start
+            for start in range(cursor, len(lines) - len(old) + 1)
+            if normalized[start : start + len(old)] == target
+        ]
+        if matches:
+            if expected is None:
+                return matches[0]
+            return min(matches, key=lambda start: abs(start - expected))
+    return None
+
+
+def apply_unified_diff(content: str, diff: str) -> Tuple[str, int]:
+    hunks = parse_hunks(diff)
+    if not hunks:
+        raise PatchError("diff has no hunks (expected lines starting with @@)")
+
+    lines = content.split("\n")
+    offset = 0
+    cursor = 0
+    for number, hunk in enumerate(hunks, start=1):
+        expected = None if hunk.old_start is None else hunk.old_start - 1 + offset
+
+        for fuzz in range(MAX_FUZZ + 1):
+            hunk_lines = hunk.trimmed(fuzz)
+            old = [text for tag, text in hunk_lines if tag != "+"]
+            start: Optional[int] = None
+            if old:
+                # after the previous hunk first, hunks given out of order anywhere
+                start = _find(lines, old, expected, cursor)
+                if start is None and cursor:
+                    start = _find(lines, old, expected, 0)
+            elif fuzz == 0:
+                # pure insertion, only the line number says where
+                start = (
+                    len(lines)
+                    if expected is None
+                    else min(max(expected, 0), len(lines))
+                )
+            if start is not None:
+                break
+        else:
+            first = next((text for tag, text in hunk.lines if tag != "+"), "")
+            raise PatchError(
+                f"hunk {number} does not match the file (starting at {first.strip()[:60]!r})"
+            )
+
+        # context keeps the file's own lines, they may have matched loosely
+        new: List[str] = []
+        position = start
+        for tag, text in hunk_lines:
+            if tag == " ":
+                new.append(lines[position])
+                position += 1
+            elif tag == "-":
+                position += 1
+            else:
+                new.append(text)
+
+        lines[start : start + len(old)] = new
+        offset += len(new) - len(old)
+        cursor = start + len(new)
+
+    return "\n".join(lines), len(hunks)
+
+
+def apply_search_replace(content: str, edits: List[PatchEdit]) -> Tuple[str, int]:
+    for number, edit in enumerate(edits, start=1):
+        if not edit.search.strip():
+            raise PatchError(f"edit {number} has an empty search text")
+
+        count = content.count(edit.search)
+        if count == 1:
+            content = content.replace(edit.search, edit.replace, 1)
+            continue
+        if count > 1:
+            raise PatchError(
+                f"edit {number} search text matches {count} times, include more surrounding lines"
+            )
+
+        # same lines with different indentation or trailing whitespace
+        lines = content.split("\n")
+        search = edit.search.strip("\n").split("\n")
+        matches = [
+            start
+            for start in range(len(lines) - len(search) + 1)
+            if all(
+                lines[start + i].strip() == search[i].strip()
+                for i in range(len(search))
+            )
+        ]
+        if len(matches) != 1:
+            found = "matches several places" if matches else "was not found"
+            raise PatchError(f"edit {number} search text {found} in the file")
+
+        replace = edit.replace.strip("\n")
+        lines[matches[0] : matches[0] + len(search)] = (
+            replace.split("\n") if replace else []
+        )
+        content = "\n".join(lines)
+
+    return content, len(edits)
@@ -0,0 +1,14 @@
+from services.models.ai_models import AIStreamEvent
+import json
+
+"""
+Server-sent events helpers for the streaming routes.
+Each event is written as an "event:" line followed by a json "data:" line.
+"""
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def format_sse(stream_event: AIStreamEvent) -> str:
+    data = json.dumps(stream_event.data, default=str)
+    return f"event: {stream_event.event}\ndata: {data}\n\n"
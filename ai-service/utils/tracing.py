@@ -0,0 +1,172 @@
+from opentelemetry import context, trace
+from opentelemetry.sdk.resources import SERVICE_NAME, Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SpanExporter,
+)
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import Span, SpanKind, Status, StatusCode
+from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from api.config import settings
+from contextlib import contextmanager
+from typing import Iterator, Optional
+from utils.logging import logger
+import os
+
+"""
+OpenTelemetry tracing. Every http request gets a root (server) span that continues
+the caller's trace when it sends a W3C traceparent header, below it:
+code_agent_run > agent_step (one per AgentExecutor iteration) > chat {model} (one per
+llm call, with token attributes) and sandbox.{operation} (one per SandboxService call,
+connecting included).
+Spans are batched and exported off the event loop by tracing_exporter: none (spans are
+not recorded, traceparent is still passed through to the logs), file (one json span
+per line at tracing_file_path) or otlp (http collector at tracing_otlp_endpoint).
+Sampling follows the caller's decision when there is one, tracing_sample_ratio of the
+new traces otherwise. Set up per worker in the app lifespan.
+"""
+
+tracer = trace.get_tracer("ai-service")
+
+# W3C trace context only, whatever OTEL_PROPAGATORS says
+propagator = TraceContextTextMapPropagator()
+
+# scrapes and probes would bury the real requests
+UNTRACED_PATHS = {"/metrics", "/ai-service/v1/healthz"}
+
+_provider: Optional[TracerProvider] = None
+
+
+# ConsoleSpanExporter writing json lines to a file it owns
+class FileSpanExporter(ConsoleSpanExporter):
+    def __init__(self, path: str) -> None:
+        self.file = open(path, "a", encoding="utf-8")
+        super().__init__(
+            out=self.file,
+            formatter=lambda span: span.to_json(indent=None) + os.linesep,
+        )
+
+    def shutdown(self) -> None:
+        self.file.close()
+
+
+def _make_exporter(exporter: str) -> Optional[SpanExporter]:
+    if exporter == "file":
+        return FileSpanExporter(settings.tracing_file_path)
+    if exporter == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+            OTLPSpanExporter,
+        )
+
+        return OTLPSpanExporter(endpoint=settings.tracing_otlp_endpoint)
+    if exporter != "none":
+        logger.warning("tracing_exporter_unknown", exporter=exporter)
+    return None
+
+
+def configure_tracing() -> None:
+    global _provider
+    if _provider is not None:
+        return
+    exporter = _make_exporter(settings.tracing_exporter)
+    if exporter is None:
+        return
+
+    _provider = TracerProvider(
+        resource=Resource.create({SERVICE_NAME: settings.tracing_service_name}),
+        sampler=ParentBased(TraceIdRatioBased(settings.tracing_sample_ratio)),
+    )
+    _provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(_provider)
+    logger.info(
+        "tracing_configured",
+        exporter=settings.tracing_exporter,
+        sample_ratio=settings.tracing_sample_ratio,
+    )
+
+
+# flushes the spans still queued
+def shutdown_tracing() -> None:
+    if _provider is not None:
+        _provider.shutdown()
+
+
+def set_span_error(span: Span, error: BaseException) -> None:
+    span.record_exception(error)
+    span.set_status(Status(StatusCode.ERROR, type(error).__name__))
+
+
+# a span around one sandbox operation, current while it runs
+@contextmanager
+def sandbox_span(operation: str, sandbox_id: Optional[str] = None) -> Iterator[Span]:
+    with tracer.start_as_current_span(
+        f"sandbox.{operation}",
+        kind=SpanKind.CLIENT,
+        attributes={"sandbox.operation": operation},
+        record_exception=False,
+        set_status_on_exception=False,
+    ) as span:
+        if sandbox_id:
+            span.set_attribute("sandbox.id", sandbox_id)
+        try:
+            yield span
+        except Exception as e:
+            set_span_error(span, e)
+            raise
+
+
+# plain asgi middleware like MetricsMiddleWare, the span ends with the last byte of
+# streaming responses
+class TracingMiddleWare:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in UNTRACED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {
+            key.decode("latin-1"): value.decode("latin-1")
+            for key, value in scope["headers"]
+        }
+        parent = propagator.extract(headers)
+        status = 500
+        failed = False
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        span = tracer.start_span(
+            scope["method"],
+            context=parent,
+            kind=SpanKind.SERVER,
+            attributes={
+                "http.request.method": scope["method"],
+                "url.path": scope["path"],
+            },
+        )
+        token = context.attach(trace.set_span_in_context(span, parent))
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception as e:
+            failed = True
+            set_span_error(span, e)
+            raise
+        finally:
+            context.detach(token)
+            # the router stores the matched route in the scope
+            route = getattr(scope.get("route"), "path", None)
+            if route:
+                span.update_name(f"{scope['method']} {route}")
+                span.set_attribute("http.route", route)
+            span.set_attribute("http.response.status_code", status)
+            if status >= 500 and not failed:
+                span.set_status(Status(StatusCode.ERROR))
+            span.end()